@@ -31,6 +31,9 @@ import fabio.edfimage
 # hdf5 parsing utilities
 import h5py
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 
 """
 
@@ -140,7 +143,9 @@ def main(argv):
 	parser.add_argument('-M', '--Max', required=False, help="Maximum value threshold. Anyting above this value will be set to 0, which is useful to get rid of gaps or dead pixels. Send a float. Strongly recommended but default is %(default)s", type=float, default=None)
 
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "ID27_hdf5_To_Edf")
 
 	edfimagepath = args['edfimagepath']
 	stem = args['stem']
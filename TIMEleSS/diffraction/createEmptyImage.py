@@ -37,13 +37,15 @@ import argparse
 import os.path
 # string module contains a number of functions that are useful for manipulating strings
 import string
-# Mathematical stuff (for data array and image processsing)
+# Mathematical stuff (for data array)
 import numpy
-import scipy
 # Fabio, from ESRF fable package
 import fabio
 import fabio.edfimage
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 ##########################################################################################################
 
 def createEmptyImage(startfile, newname, omega=None):
@@ -108,7 +110,9 @@ def main(argv):
 	# Optionnal arguments
 	parser.add_argument('-o', '--omega', required=False, help="Assign a value for Omega (optionnal). Default is %(default)s", type=float, default=None)
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "CreateEmptyImage")
 
 	startfile = args['startfile']
 	newname = args['newname']
@@ -32,33 +32,35 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # string module contains a number of functions that are useful for manipulating strings
 import string
 
 # Mathematical stuff (for data array)
 import numpy
-import scipy
-import scipy.ndimage
-import scipy.ndimage.filters
-import scipy.ndimage.morphology
-
-# Image manipulation library
-import PIL.Image
 
 # Fabio, from ESRF fable package
 import fabio
 import fabio.edfimage
 
-# Plotting library
-import matplotlib
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
+# Image processing (scipy.ndimage, PIL) and plotting libraries are slow to load
+# They are imported in the functions which need them
 
 
 ##########################################################################################################
 
 def dacShadowMask(edfimagepath, newpath, stem, first, last, ndigits=4, extension='edf', scale=200, filtersize=3, threshold=1., c_rawy=None, c_rawz=None, radius=None):
   
+  # Image processing and plotting libraries
+  import scipy.ndimage
+  import scipy.ndimage.filters
+  import scipy.ndimage.morphology
+  import PIL.Image
+  import matplotlib
+  matplotlib.use('TkAgg')
+  import matplotlib.pyplot as plt
 
   if ((not (os.path.isdir(newpath))) or (not (os.path.exists(newpath)))) :
       print("ERROR! %s is not a directory or does not exist.\nAborting." % newpath)
@@ -212,7 +214,9 @@ Complex example:
 	parser.add_argument('--radius', required=False, type=int, help="Radius of disk to ignore around the beam center (in pixels, optional). c_rawy and c_rawz are mendatory if you want to use this option. . Used to ignore a disk at the center of the image. If you have low intensity in the center, the script might end up masking real data.", default=None)
 	
 	
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "DACShadow")
 	
 	stem = args['stem']
 	first = args['first']
@@ -44,30 +44,21 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # string module contains a number of functions that are useful for manipulating strings
 import string
 
-# Mathematical stuff (for data array and image processsing)
+# Mathematical stuff (for data array)
 import numpy
-import scipy
-import scipy.ndimage
-import scipy.ndimage.filters
-import scipy.ndimage.morphology
-
-# Image manipulation library
-import PIL.Image
-
-# Inpaint into a mask
-from . import inpaint
 
 # Fabio, from ESRF fable package
 import fabio
 import fabio.edfimage
 
-# Plotting library
-import matplotlib
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
+# Image processing (scipy.ndimage, PIL), inpainting, and plotting libraries are slow to load
+# They are imported in the functions which need them
 
 
 ##########################################################################################################
@@ -88,6 +79,16 @@ def testSpotDetection(edfimagepath, stem, first, last, medianename, ndigits=4, e
 	filtersize: size of median filter to apply on reduced image to remove smaller spots
 	threshold: threshold for spot detection, in multiples of image mean intensity
 	"""
+	# Image processing libraries
+	import scipy.ndimage
+	import scipy.ndimage.filters
+	import scipy.ndimage.morphology
+	import PIL.Image
+	# Plotting library, loaded only when a plot is needed
+	import matplotlib
+	matplotlib.use('TkAgg')
+	import matplotlib.pyplot as plt
+
 
 	# Read median image
 	imagename = os.path.join(edfimagepath, medianename)
@@ -184,6 +185,12 @@ def createMask(edfimagepath, stem, first, last, medianename, ndigits=4, extensio
 	c_rawz: Raw Z position of beam center (optional). Can be seem in Fabian. Just go over the center with your mouse with the image shown with orientation 1 0 0 1.
 	radius: radius of disk to ignore around the beam center (in pixels, optional). c_rawy and c_rawz are mendatory if you want to use this option
 	"""
+	# Image processing libraries
+	import scipy.ndimage
+	import scipy.ndimage.filters
+	import scipy.ndimage.morphology
+	import PIL.Image
+
 		
 	# Read median image
 	print("Loading median image")
@@ -206,44 +213,46 @@ def createMask(edfimagepath, stem, first, last, medianename, ndigits=4, extensio
 		image = format % (stem,i)
 		imagename = os.path.join(edfimagepath, image)
 		print("Reading " + imagename + " and creating corresponding mask")
-		im = fabio.edfimage.edfimage()
-		im.read(imagename)
-		data = im.data.astype('float32')
-		# Removing median image
-		data = data-medianeData
-		# Removing anything below 0
-		data = data.clip(min=0)
-		oldmean = data.mean()
-		oldmax = data.max()
-		oldmin = data.min()
-		# Resizing data, we do not need full resolution to find diamond spots!
-		# Better to work on low resolution, removed a lot of false positives
-		# datascale = scipy.misc.imresize(data,(scale,scale),interp='nearest')
-        # Scipy.misc.imresize is deprecated
-		# Moving to a similar call using the PIL library
-		datascale = numpy.array(PIL.Image.fromarray(data).resize((scale,scale),resample=PIL.Image.NEAREST))
-		max = datascale.max()
-		datascale = datascale*oldmax/max
-		meandata = datascale.mean()
-		mindata = datascale.min()
-		maxdata = datascale.max()
-		# Applying a median filter for removal of smaller spots
-		datascale2 = scipy.ndimage.filters.median_filter(datascale,size=filtersize)
-		max = datascale2.max()
-		if (max > 0):
-			datascale2 = datascale2*oldmax/max
-			min = datascale2.min()
+		with instrumentation.stage("read"):
+			im = fabio.edfimage.edfimage()
+			im.read(imagename)
+			data = im.data.astype('float32')
+		with instrumentation.stage("mask"):
+			# Removing median image
+			data = data-medianeData
+			# Removing anything below 0
+			data = data.clip(min=0)
+			oldmean = data.mean()
+			oldmax = data.max()
+			oldmin = data.min()
+			# Resizing data, we do not need full resolution to find diamond spots!
+			# Better to work on low resolution, removed a lot of false positives
+			# datascale = scipy.misc.imresize(data,(scale,scale),interp='nearest')
+	        # Scipy.misc.imresize is deprecated
+			# Moving to a similar call using the PIL library
+			datascale = numpy.array(PIL.Image.fromarray(data).resize((scale,scale),resample=PIL.Image.NEAREST))
+			max = datascale.max()
+			datascale = datascale*oldmax/max
+			meandata = datascale.mean()
+			mindata = datascale.min()
+			maxdata = datascale.max()
+			# Applying a median filter for removal of smaller spots
+			datascale2 = scipy.ndimage.filters.median_filter(datascale,size=filtersize)
 			max = datascale2.max()
-			mean = datascale2.mean()
-		else:
-			mean = 0
-		# Creating mask with threshold
-		# print("threshold: ", threshold)
-		thismask = (datascale2 > threshold*mean).astype(numpy.int8)
-		# Growing mask in X and Y
-		print("Growing  mask by " + str(growXY) + " pixels in X and Y")
-		thismask = scipy.ndimage.morphology.binary_dilation(thismask,iterations=growXY)
-		mask[i-first::] = thismask
+			if (max > 0):
+				datascale2 = datascale2*oldmax/max
+				min = datascale2.min()
+				max = datascale2.max()
+				mean = datascale2.mean()
+			else:
+				mean = 0
+			# Creating mask with threshold
+			# print("threshold: ", threshold)
+			thismask = (datascale2 > threshold*mean).astype(numpy.int8)
+			# Growing mask in X and Y
+			print("Growing  mask by " + str(growXY) + " pixels in X and Y")
+			thismask = scipy.ndimage.morphology.binary_dilation(thismask,iterations=growXY)
+			mask[i-first::] = thismask
 	# Smoothing (removed, it was not helping and removing real spots
 	#print("Smoothing global mask")
 	# Remove small white regions
@@ -252,8 +261,9 @@ def createMask(edfimagepath, stem, first, last, medianename, ndigits=4, extensio
 	#mask = scipy.ndimage.binary_closing(mask)
 	# Growing mask around the values we found
 	# See http://docs.scipy.org/doc/scipy/reference/generated/scipy.ndimage.morphology.binary_dilation.html
-	print("Growing  global mask by " + str(growXYO) + " pixels in X, Y, and omega")
-	mask = scipy.ndimage.morphology.binary_dilation(mask,iterations=growXYO)
+	with instrumentation.stage("mask"):
+		print("Growing  global mask by " + str(growXYO) + " pixels in X, Y, and omega")
+		mask = scipy.ndimage.morphology.binary_dilation(mask,iterations=growXYO)
 	# Clearing central disk
 	if (radius != None):
 		print("Removing portion of mask within the central radius")
@@ -288,6 +298,13 @@ def plotMask(edfimagepath, stem, first, last, mask, ndigits=4, extension='edf'):
 	ndigits: Number of digits for EDF file numbering.
 	extension: EDF file extension.
 	"""
+	# Image processing library
+	import PIL.Image
+	# Plotting library, loaded only when a plot is needed
+	import matplotlib
+	matplotlib.use('TkAgg')
+	import matplotlib.pyplot as plt
+
 	print("Preparing to test mask"  )
 	# Loop on images and plot corresponding mask
 	for i in range(first,last+1):
@@ -335,6 +352,13 @@ def testClearMask(edfimagepath, stem, first, last, medianename, mask, ndigits=4,
 	ndigits: Number of digits for EDF file numbering.
 	extension: EDF file extension.
 	"""
+	# Image processing library
+	import PIL.Image
+	# Plotting library, loaded only when a plot is needed
+	import matplotlib
+	matplotlib.use('TkAgg')
+	import matplotlib.pyplot as plt
+
 	print("Loading median data")
 	# Read median image
 	imagename = os.path.join(edfimagepath, medianename)
@@ -399,6 +423,10 @@ def saveDataClearMask(edfimagepath, newpath, stem, first, last, medianename, mas
 	extension: EDF file extension.
 	doinpaint: if set to true, fills diamond mask with inpainting. If not set, diamond mask is filled with median value
 	"""
+	# Image processing library, and inpaint into a mask
+	import PIL.Image
+	from . import inpaint
+
 	if ((not (os.path.isdir(newpath))) or (not (os.path.exists(newpath)))) :
 		print("ERROR! %s is not a directory or does not exist.\nAborting." % newpath)
 		return
@@ -424,60 +452,64 @@ def saveDataClearMask(edfimagepath, newpath, stem, first, last, medianename, mas
 		image = format % (stem,i)
 		imagename = os.path.join(edfimagepath, image)
 		print("Reading and processing " + imagename)
-		im = fabio.edfimage.edfimage()
-		im.read(imagename)
-		data = im.data.astype('float32')
-		header = im.header
-		# Removing median image
-		data = data-medianeData
-		# Removing anything below 0
-		data = data.clip(min=0)
-		meanI = data.mean()
-		medianI = numpy.median(data)
-		maxI = data.max()
-		minI = data.min()
-		xsize = im.shape[-1]
-		ysize = im.shape[-2]
-		# Preparing mask
-		thismask = mask[i-first]
-		thismask = thismask.astype(numpy.float32) # New versions of python do not like resizing with integer...
-		#maskscaled = scipy.misc.imresize(thismask,(xsize,ysize),interp='nearest',mode='F')		# Scipy.misc.imresize is deprecated
-		# Moving to a similar call using the PIL library
-		maskscaled = numpy.array(PIL.Image.fromarray(thismask).resize((xsize,ysize),resample=PIL.Image.NEAREST))
+		with instrumentation.stage("read"):
+			im = fabio.edfimage.edfimage()
+			im.read(imagename)
+			data = im.data.astype('float32')
+			header = im.header
+		with instrumentation.stage("mask"):
+			# Removing median image
+			data = data-medianeData
+			# Removing anything below 0
+			data = data.clip(min=0)
+			meanI = data.mean()
+			medianI = numpy.median(data)
+			maxI = data.max()
+			minI = data.min()
+			xsize = im.shape[-1]
+			ysize = im.shape[-2]
+			# Preparing mask
+			thismask = mask[i-first]
+			thismask = thismask.astype(numpy.float32) # New versions of python do not like resizing with integer...
+			#maskscaled = scipy.misc.imresize(thismask,(xsize,ysize),interp='nearest',mode='F')		# Scipy.misc.imresize is deprecated
+			# Moving to a similar call using the PIL library
+			maskscaled = numpy.array(PIL.Image.fromarray(thismask).resize((xsize,ysize),resample=PIL.Image.NEAREST))
 		# Creating data under mask using linear interpolation or inpainting
 		# Need to create a list of points for which we have data
 		# Actually, gave up, fill with median value!
 		idx=(maskscaled>0)
-		if (doinpaint):
-			# Creating data under mask using inpainting
-			# We rescale the image and inpaint on a smaller version. Before reducing, remove extreme intensity values (it works better)
-			datacopy = data.copy()
-			datacopy = datacopy.clip(0., 10.*meanI)
-			#datareduced = scipy.misc.imresize(datacopy,(thismask.shape[0],thismask.shape[1]),interp='nearest',mode='F')
-			# Scipy.misc.imresize is deprecated
-			# Moving to a similar call using the PIL library
-			datareduced = numpy.array(PIL.Image.fromarray(datacopy).resize((thismask.shape[0],thismask.shape[1]),resample=PIL.Image.NEAREST))
-			# Setting mask data as NaN and call for inpainting. Parameters have been set from trial and error
-			idx2=(thismask>0)
-			datareduced[idx2] = numpy.NaN
-			result0 = inpaint.replace_nans(datareduced, max_iter=20, tol=1., kernel_radius=2, kernel_sigma=5, method='idw')
-			# Rescaling inpainted image and set new values at mask positions
-			# result0 = scipy.misc.imresize(result0,(xsize,ysize),interp='nearest',mode='F')
-			# Scipy.misc.imresize is deprecated
-			# Moving to a similar call using the PIL library
-			result0 = numpy.array(PIL.Image.fromarray(result0).resize((xsize,ysize),resample=PIL.Image.NEAREST))
-			data[idx] = result0[idx]
-		else:
-			# Fill maslwith median value!
-			data[idx]=medianI
+		with instrumentation.stage("inpaint"):
+			if (doinpaint):
+				# Creating data under mask using inpainting
+				# We rescale the image and inpaint on a smaller version. Before reducing, remove extreme intensity values (it works better)
+				datacopy = data.copy()
+				datacopy = datacopy.clip(0., 10.*meanI)
+				#datareduced = scipy.misc.imresize(datacopy,(thismask.shape[0],thismask.shape[1]),interp='nearest',mode='F')
+				# Scipy.misc.imresize is deprecated
+				# Moving to a similar call using the PIL library
+				datareduced = numpy.array(PIL.Image.fromarray(datacopy).resize((thismask.shape[0],thismask.shape[1]),resample=PIL.Image.NEAREST))
+				# Setting mask data as NaN and call for inpainting. Parameters have been set from trial and error
+				idx2=(thismask>0)
+				datareduced[idx2] = numpy.nan
+				result0 = inpaint.replace_nans(datareduced, max_iter=20, tol=1., kernel_radius=2, kernel_sigma=5, method='idw')
+				# Rescaling inpainted image and set new values at mask positions
+				# result0 = scipy.misc.imresize(result0,(xsize,ysize),interp='nearest',mode='F')
+				# Scipy.misc.imresize is deprecated
+				# Moving to a similar call using the PIL library
+				result0 = numpy.array(PIL.Image.fromarray(result0).resize((xsize,ysize),resample=PIL.Image.NEAREST))
+				data[idx] = result0[idx]
+			else:
+				# Fill maslwith median value!
+				data[idx]=medianI
 		# Save new data
-		newname = os.path.join(newpath, image)
-		print("Saving new EDF with median and mask removed in " + newname)
-		im = fabio.edfimage.edfimage()
-		im.read(imagename)
-		im.data = (data.astype('uint32'))
-		im.header = header
-		im.save(newname)
+		with instrumentation.stage("write"):
+			newname = os.path.join(newpath, image)
+			print("Saving new EDF with median and mask removed in " + newname)
+			im = fabio.edfimage.edfimage()
+			im.read(imagename)
+			im.data = (data.astype('uint32'))
+			im.header = header
+			im.save(newname)
 
     
 ##########################################################################################################
@@ -549,7 +581,9 @@ This is part of the TIMEleSS project\nhttp://timeless.texture.rocks\n
 	parser.add_argument('--radius', required=False, type=int, help="Radius of disk to ignore around the beam center (in pixels, optional). c_rawy and c_rawz are mendatory if you want to use this option. . Used to ignore a disk at the center of the image. If you have large intensity spots which are not diamond in there.", default=None)
 	parser.add_argument('--inpaint', required=False, type=bool, help="If set to True, fill diamond mask with inpainting. If not set, diamond mask is filled with median value.", default=False)
 	
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "DiamondSpotRemoval")
 	
 	todo = args['todo']
 	
@@ -34,6 +34,9 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # string module contains a number of functions that are useful for manipulating strings
 import string
 
@@ -112,7 +115,9 @@ def main(argv):
 	parser.add_argument('-d', '--ndigits', required=False, help="Number of digits for file number. Default is %(default)s", type=int, default=4)
 	parser.add_argument('-u', '--dounderscore', required=False, help="Replace last character of file stem with an underscore. Can be True or False. Default is %(default)s", type=bool, default=False)
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "Edf2tiffFileSeries")
 
 	tiffimagepath = args['tiffimagepath']
 	edfimagepath = args['edfimagepath']
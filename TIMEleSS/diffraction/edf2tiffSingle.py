@@ -33,6 +33,9 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # string module contains a number of functions that are useful for manipulating strings
 import string
 
@@ -84,7 +87,9 @@ def main(argv):
 	# Required arguments
 	parser.add_argument('file', help="EDF file name (required)", type=str)
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "Edf2tiff")
 
 	filename = args['file']
 
@@ -29,6 +29,9 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # Fabio, from ESRF fable package
 import fabio
 import fabio.edfimage
@@ -152,7 +155,9 @@ def main(argv):
 	parser.add_argument('-dmp', '--damp', required=False, help="Increase the value to make the background less noisy. Default is %(default)s", type=int, default=20)
 
 	# Parsing command line
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "FlatFieldFileSeries")
 	
 	stem = args['stem']
 	first = args['first']
@@ -34,6 +34,9 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # Fabio, from ESRF fable package
 import fabio
 import fabio.edfimage
@@ -69,9 +72,10 @@ def meanFileSeries(stem,first,last,digits,ext,new,tif):
 		print(("Error: file %s not found" % ifile))
 		sys.exit(2)
 	# Open the EDF image file
-	imedf = fabio.open(ifile)
-	# get data and use it as a starting point
-	data = (numpy.copy(imedf.data)).astype('int64')
+	with instrumentation.stage("read"):
+		imedf = fabio.open(ifile)
+		# get data and use it as a starting point
+		data = (numpy.copy(imedf.data)).astype('int64')
 	# Read the rest
 	for i in range(first+1,last+1):
 		ifile = formatfileedf % (stem, i)
@@ -80,9 +84,10 @@ def meanFileSeries(stem,first,last,digits,ext,new,tif):
 			print(("Error: file %s not found" % ifile))
 			sys.exit(2)
 		# Open the EDF image file
-		imedf = fabio.open(ifile)
-		# get data and use it as a starting point
-		data += numpy.copy(imedf.data).astype('int64')
+		with instrumentation.stage("read"):
+			imedf = fabio.open(ifile)
+			# get data and use it as a starting point
+			data += numpy.copy(imedf.data).astype('int64')
 	# calculating mean
 	data = data / (last-first+1)
 	# Preparing a header
@@ -110,16 +115,17 @@ def meanFileSeries(stem,first,last,digits,ext,new,tif):
 		omPos = None
 	# clipping data to int32 (it should be ok, but should be done in a cleaner way)
 	newdata = (numpy.copy(data)).astype('int32')
-	if (tif):
-		imtiff = fabio.tifimage.tifimage(newdata,headernew)
-		imtiff.save(new)
-		print("Mean image saved in " + new)
-	else:
-		im3 = fabio.edfimage.edfimage()
-		im3.data = newdata
-		im3.header = headernew
-		im3.save(new)
-		print("Mean image saved in " + new)
+	with instrumentation.stage("write"):
+		if (tif):
+			imtiff = fabio.tifimage.tifimage(newdata,headernew)
+			imtiff.save(new)
+			print("Mean image saved in " + new)
+		else:
+			im3 = fabio.edfimage.edfimage()
+			im3.data = newdata
+			im3.header = headernew
+			im3.save(new)
+			print("Mean image saved in " + new)
 		
 	return
 	
@@ -162,7 +168,9 @@ def main(argv):
 	parser.add_argument('-t', '--tif', required=False, help="Save in tiff instead of EDF if True. Default is %(default)s", type=bool, default=False)
 	
 	# Parsing command line
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "MeanFileSeries")
 	
 	stem = args['stem']
 	first = args['first']
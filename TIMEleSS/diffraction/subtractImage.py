@@ -34,6 +34,9 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # Fabio, from ESRF fable package
 import fabio
 import fabio.edfimage
@@ -111,7 +114,9 @@ def main(argv):
 	# Required parameters
 	parser.add_argument('files', type=str, nargs=3, help='Image, background, New image name')
 	
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "SubtractEDF")
 	files = args['files']
 	
 	filename = files[0]
@@ -33,6 +33,9 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 
 # Maths stuff
 import numpy
@@ -54,10 +57,280 @@ def normalizedAngle180(angle):
 	"""
 	return angle - (numpy.floor((angle + 180)/360))*360;           # [-180;180):
 
-def gs_indexing_statistics(logfile, gve, gsinputfile, wavelength):
+def rangeMask(values, ranges):
+	"""
+	Returns a boolean mask, True for values which are within at least one of the [min;max] ranges
+	
+	Parameters:
+	- values: numpy array of values to test
+	- ranges: list of [min,max] ranges
+	"""
+	mask = numpy.zeros(len(values), dtype=bool)
+	for thisrange in ranges:
+		mask |= (values >= thisrange[0]) & (values <= thisrange[1])
+	return mask
+
+def mergeIntervals(mins, maxs):
+	"""
+	Merges overlapping [min;max] intervals
+	
+	Parameters:
+	- mins: numpy array with the lower bounds of the intervals
+	- maxs: numpy array with the upper bounds of the intervals
+	
+	Returns
+	- starts, ends: sorted numpy arrays with the bounds of non-overlapping intervals
+	"""
+	if (len(mins) == 0):
+		return [numpy.zeros(0), numpy.zeros(0)]
+	order = numpy.argsort(mins)
+	mins = numpy.asarray(mins)[order]
+	maxs = numpy.asarray(maxs)[order]
+	# A new interval starts whenever the lower bound is above all previous upper bounds
+	runningmax = numpy.maximum.accumulate(maxs)
+	newinterval = numpy.ones(len(mins), dtype=bool)
+	newinterval[1:] = mins[1:] > runningmax[:-1]
+	firsts = numpy.flatnonzero(newinterval)
+	starts = mins[firsts]
+	ends = numpy.maximum.reduceat(maxs, firsts)
+	return [starts, ends]
+
+def inIntervals(values, starts, ends):
+	"""
+	Returns a boolean mask, True for values which are within one of the intervals
+	
+	Parameters:
+	- values: numpy array of values to test
+	- starts, ends: sorted, non-overlapping, intervals, as returned by mergeIntervals
+	"""
+	i = numpy.searchsorted(starts, values, side='right') - 1
+	mask = (i >= 0)
+	mask[mask] = values[mask] <= ends[i[mask]]
+	return mask
+
+def countInIntervals(sortedvalues, mins, maxs):
+	"""
+	Counts the number of values within each of the [min;max] intervals. Intervals may overlap.
+	
+	Parameters:
+	- sortedvalues: sorted numpy array of values
+	- mins: numpy array with the lower bounds of the intervals
+	- maxs: numpy array with the upper bounds of the intervals
+	
+	Returns
+	- a numpy array with the number of values in each interval
+	"""
+	return numpy.searchsorted(sortedvalues, maxs, side='right') - numpy.searchsorted(sortedvalues, mins, side='left')
+
+def parseSamplePeaks(header, wavelength, tttol, gvefile=""):
+	"""
+	Extracts the list of predicted sample peaks from the "ds h k l" block of a GVE file header
+	
+	Parameters:
+	- header: GVE file header, as returned by multigrainOutputParser.parseGVE
+	- wavelength: wavelength, in angstroms
+	- tttol: tolerance in 2theta, in degrees
+	- gvefile: name of the GVE file, for error messages
+	
+	Returns
+	- a numpy array in which each line holds ds, h, k, l, 2theta, dsmin, dsmax, tttol
+	"""
+	peakssample = []
+	recordpeaks = False
+	for line in header.split("\n"):
+		if ((line.strip() == "#  gx  gy  gz  xc  yc  ds  eta  omega  spot3d_id  xl  yl  zl")):
+			recordpeaks = False
+			# We reached the end of the header...
+		if recordpeaks:
+			try:
+				tt = line.split()
+				ds = float(tt[0])
+				h = int(tt[1])
+				k = int(tt[2])
+				l = int(tt[3])
+			except ValueError:
+				print("Conversion error when reading predicted sample peaks from %s." % (gvefile))
+				print("Was trying to convert %s to ds, h, k, and l" % (line))
+				sys.exit(1)
+			peakssample.append([ds,h,k,l])
+		if ((line.strip() == "# ds h k l")):
+			recordpeaks = True
+	peakssample = numpy.array(peakssample, dtype=float).reshape((-1,4))
+	ds = peakssample[:,0]
+	tt = 2.*numpy.degrees(numpy.arcsin(wavelength*ds/2.))
+	dsmin = 2.*numpy.sin(numpy.radians((tt-tttol)/2.))/(wavelength)
+	dsmax = 2.*numpy.sin(numpy.radians((tt+tttol)/2.))/(wavelength)
+	tolerance = numpy.full(len(ds), tttol)
+	return numpy.column_stack((peakssample, tt, dsmin, dsmax, tolerance))
+
+def groupRings(samplepeaks, dstol=1.e-5):
+	"""
+	Groups predicted sample peaks (i.e. hkl) into diffraction rings. Peaks with the same ds, within dstol, are in the same ring.
+	
+	Parameters:
+	- samplepeaks: numpy array of predicted sample peaks, as returned by parseSamplePeaks
+	- dstol: tolerance on ds to consider two peaks on the same ring
+	
+	Returns
+	- rings: numpy array of rings, each line holds ds, h, k, l (first hkl of the ring), 2theta, dsmin, dsmax, tttol, sorted by ds
+	- multiplicity: number of hkl in each ring
+	- ringofpeak: index of the ring for each of the predicted sample peaks
+	"""
+	order = numpy.argsort(samplepeaks[:,0], kind='stable')
+	ds = samplepeaks[order,0]
+	newring = numpy.ones(len(ds), dtype=bool)
+	newring[1:] = numpy.diff(ds) > dstol
+	firsts = numpy.flatnonzero(newring)
+	rings = samplepeaks[order[firsts]]
+	multiplicity = numpy.diff(numpy.append(firsts, len(ds)))
+	ringofpeak = numpy.empty(len(ds), dtype=int)
+	ringofpeak[order] = numpy.cumsum(newring)-1
+	return [rings, multiplicity, ringofpeak]
+
+def assignToRings(ds, rings):
+	"""
+	Assigns g-vectors to the closest diffraction ring
+	
+	Parameters:
+	- ds: numpy array of g-vector ds
+	- rings: numpy array of rings, sorted by ds, as returned by groupRings
+	
+	Returns
+	- index of the closest ring for each g-vector, -1 if the g-vector is not within the [dsmin;dsmax] range of this ring
+	"""
+	if (len(rings) == 0):
+		return numpy.full(len(ds), -1, dtype=int)
+	ringds = rings[:,0]
+	i = numpy.searchsorted(ringds, ds)
+	# Closest of the two neighbouring rings
+	lower = numpy.clip(i-1, 0, len(ringds)-1)
+	upper = numpy.clip(i, 0, len(ringds)-1)
+	i = numpy.where((ds - ringds[lower]) <= (ringds[upper] - ds), lower, upper)
+	inring = (ds >= rings[i,5]) & (ds <= rings[i,6])
+	return numpy.where(inring, i, -1)
+
+def expectedPeaksPerRing(grains, samplepeaks, ringofpeak, nrings, gsinput, wavelength, chunksize=1000000):
+	"""
+	Counts the number of peaks which should be observed for a list of indexed grains, for each diffraction ring
+	Peak positions are calculated from the UBI matrix of each grain, for all hkl of the sample, and only
+	peaks within the 2theta, eta, and omega ranges of the GrainSpotter input file are counted.
+	
+	Parameters:
+	- grains: list of grains
+	- samplepeaks: numpy array of predicted sample peaks, as returned by parseSamplePeaks
+	- ringofpeak: index of the ring for each of the predicted sample peaks, as returned by groupRings
+	- nrings: number of rings
+	- gsinput: GrainSpotter input file information, with the "dsranges" set
+	- wavelength: wavelength, in angstroms
+	- chunksize: maximum number of g-vectors to calculate at once, to limit memory usage
+	
+	Returns
+	- a numpy array with the expected number of peaks in each ring
+	"""
+	# Imported here, only needed for the completeness report
+	from ImageD11 import transform
+	expected = numpy.zeros(nrings)
+	nhkl = len(samplepeaks)
+	if ((len(grains) == 0) or (nhkl == 0)):
+		return expected
+	hkl = samplepeaks[:,1:4]
+	# hkl within 2theta ranges
+	hklInRange = rangeMask(samplepeaks[:,0], gsinput["dsranges"])
+	UB = numpy.linalg.inv(numpy.array([grain.getUBi() for grain in grains]))
+	ngrainsperchunk = max(1, chunksize//nhkl)
+	for first in range(0, len(grains), ngrainsperchunk):
+		thisUB = UB[first:first+ngrainsperchunk]
+		# g-vectors for all grains and all hkl, shape (3, ngrains*nhkl)
+		g = numpy.einsum('gij,nj->ign', thisUB, hkl).reshape((3,-1))
+		(tth, eta, omega) = transform.uncompute_g_vectors(g, wavelength)
+		count = numpy.zeros(g.shape[1])
+		for solution in range(0,2):
+			thiseta = normalizedAngle360(eta[solution]) # In GrainSpotter, eta is in [0;360]
+			thisomega = normalizedAngle180(omega[solution]) # In GrainSpotter, omega is in [-180;180]
+			count += rangeMask(thiseta, gsinput["etaranges"]) & rangeMask(thisomega, gsinput["omegaranges"])
+		count = count.reshape((-1,nhkl)).sum(axis=0)*hklInRange
+		expected += numpy.bincount(ringofpeak, weights=count, minlength=nrings)
+	return expected
+
+def ringCompleteness(grains, gves, samplepeaks, inRange, gsinput, wavelength):
+	"""
+	Indexing completeness for each diffraction ring of a phase
+	
+	Parameters:
+	- grains: list of indexed grains for this phase
+	- gves: table of all experimental g-vectors, as returned by mergeGVETables (sorted by spot3d_id)
+	- samplepeaks: numpy array of predicted sample peaks for this phase, as returned by parseSamplePeaks
+	- inRange: boolean mask, True for g-vectors within the 2theta, eta, and omega ranges for this phase
+	- gsinput: GrainSpotter input file information for this phase, with the "dsranges" set
+	- wavelength: wavelength, in angstroms
+	
+	Returns
+	- a numpy structured array with, for each ring, ds, h, k, l, tth, multiplicity, and the number of
+	  observed, assigned, and expected g-vectors, as well as the completeness (assigned/expected)
+	"""
+	[rings, multiplicity, ringofpeak] = groupRings(samplepeaks)
+	nrings = len(rings)
+	# Observed g-vectors: within eta, omega, and 2theta ranges, and close to the ring
+	observedring = assignToRings(gves['ds'][inRange], rings)
+	observed = numpy.bincount(observedring[observedring >= 0], minlength=nrings)
+	# G-vectors assigned to grains, identified by their spot3d_id. The same peak can be indexed twice.
+	peakids = numpy.unique(multigrainOutputParser.indexedPeaksTable(grains)[0]['peakid'])
+	index = multigrainOutputParser.rowsForIDs(gves['spot3d_id'], None, peakids)
+	if (numpy.count_nonzero(index < 0) > 0):
+		print("Warning: %d indexed peaks could not be found in the list of g-vectors" % (numpy.count_nonzero(index < 0)))
+	assignedring = assignToRings(gves['ds'][index[index >= 0]], rings)
+	assigned = numpy.bincount(assignedring[assignedring >= 0], minlength=nrings)
+	# Expected g-vectors, based on the orientation of indexed grains
+	expected = expectedPeaksPerRing(grains, samplepeaks, ringofpeak, nrings, gsinput, wavelength)
+
+	report = numpy.zeros(nrings, dtype=[('ds', float), ('h', int), ('k', int), ('l', int), ('tth', float), ('multiplicity', int), ('observed', int), ('assigned', int), ('expected', int), ('completeness', float)])
+	report['ds'] = rings[:,0]
+	report['h'] = rings[:,1]
+	report['k'] = rings[:,2]
+	report['l'] = rings[:,3]
+	report['tth'] = rings[:,4]
+	report['multiplicity'] = multiplicity
+	report['observed'] = observed
+	report['assigned'] = assigned
+	report['expected'] = expected
+	withpeaks = expected > 0
+	report['completeness'][withpeaks] = assigned[withpeaks]/expected[withpeaks]
+	return report
+
+def saveRingReport(reports, fname):
+	"""
+	Saves the indexing completeness for each phase and diffraction ring in a text file, with one line per ring,
+	and tab separated columns
+	
+	Parameters:
+	- reports: list of ring completeness reports, for each phase, as returned by ringCompleteness
+	- fname: name of output file
+	"""
+	names = ('phase',) + reports[0].dtype.names
+	fmt = ['%d', '%.6f', '%d', '%d', '%d', '%.4f', '%d', '%d', '%d', '%d', '%.4f']
+	table = numpy.zeros(sum([len(report) for report in reports]), dtype=[('phase', int)] + reports[0].dtype.descr)
+	i = 0
+	for phase in range(0,len(reports)):
+		n = len(reports[phase])
+		table[i:i+n]['phase'] = phase
+		for name in reports[phase].dtype.names:
+			table[i:i+n][name] = reports[phase][name]
+		i += n
+	numpy.savetxt(fname, table, fmt=fmt, delimiter="\t", header="\t".join(names))
+	print ("Saved indexing completeness per phase and ring in %s" % (fname))
+
+def gs_indexing_statistics(logfile, gve, gsinputfile, wavelength, report=None):
 	"""
 	Checks a grainspotter indexing performance
 	Send the final GrainSpotter log, the list of g-vectors, the GS input file (with the loosest conditions), and the wavelength
+	If report is set, the indexing completeness for each phase and diffraction ring is saved in this file
+	
+	Returns a dictionnary with
+	- "phases": a list with indexing statistics for each phase, as dictionnaries
+	- "rings": a list with, for each phase, a numpy array of predicted sample peaks (ds, h, k, l, 2theta, dsmin, dsmax, tttol)
+	- "ringcounts": a list with, for each phase, the number of g-vectors within eta, omega, and 2theta ranges, for each predicted sample peak
+	- "completeness": a list with, for each phase, the indexing completeness for each diffraction ring, as returned by ringCompleteness
+	- "total": global indexing statistics, as a dictionnary
 	"""
 	nphases = len(logfile)
 	grains = []
@@ -96,109 +369,70 @@ def gs_indexing_statistics(logfile, gve, gsinputfile, wavelength):
 	# Extract peak list and ds ranges in which to look for peak
 	# For each phase, the list of peaks is on top of the gve file
 	# Then, need keep a record of the ds tolerance for the peak (which could different for each phase)
-	peakssample = []
+	peakssample = [None] * nphases
 	peaksgve = [None] * nphases
-	idlist = [None] * nphases
 	for i in range(0,nphases):
-		[peaksgve[i],idlist[i],header] = multigrainOutputParser.parseGVE(gve[i]) 
+		[peaksgve[i],header] = multigrainOutputParser.parseGVETable(gve[i]) 
 		print("Parsing header from GVE files %s to extract predicted sample peaks for phase %i" % (gve[i], i))
 		tttol = gsinput[i]["sigma_tth"]*gsinput[i]["nsigmas"]
-		recordpeaks = False
-		for line in header.split("\n"):
-			if ((line.strip() == "#  gx  gy  gz  xc  yc  ds  eta  omega  spot3d_id  xl  yl  zl")):
-				recordpeaks = False
-				# We reached the end of the header...
-			if recordpeaks:
-				try:
-					tt = line.split()
-					ds = float(tt[0])
-					h = int(tt[1])
-					k = int(tt[2])
-					l = int(tt[3])
-					tt = 2.*numpy.degrees(numpy.arcsin(wavelength*ds/2.))
-					dsmin = 2.*numpy.sin(numpy.radians((tt-tttol)/2.))/(wavelength)
-					dsmax = 2.*numpy.sin(numpy.radians((tt+tttol)/2.))/(wavelength)
-				except ValueError:
-					print("Conversion error when reading predicted sample peaks from %s." % (gve[i]))
-					print("Was trying to convert %s to ds, h, k, and l" % (line))
-					sys.exit(1)
-				peakssample.append([ds,h,k,l,tt,dsmin,dsmax,tttol])
-			if ((line.strip() == "# ds h k l")):
-				recordpeaks = True
-	print ("\nRead theoretical peak positions in 2theta for all phases.\nI have a list of %d potential peaks for all %d phases.\n" % (len(peakssample), nphases))
+		peakssample[i] = parseSamplePeaks(header, wavelength, tttol, gve[i])
+	allpeakssample = numpy.concatenate(peakssample)
+	print ("\nRead theoretical peak positions in 2theta for all phases.\nI have a list of %d potential peaks for all %d phases.\n" % (len(allpeakssample), nphases))
 	
 	# Merging peaks from GVE files, removing doubles
-	allgves = peaksgve[0]
-	allPeakIds = idlist[0]
-	for i in range(1,nphases):
-		missinggveID = set(idlist[i]).symmetric_difference(set(allPeakIds))
-		for peakid in missinggveID:
-			ID_idlist = (idlist[i]).index(peakid)
-			allPeakIds.append(peakid)
-			allgves.append(peaksgve[i][ID_idlist])
-			
+	allgves = multigrainOutputParser.mergeGVETables(peaksgve)
 	print ("Merged unique g-vectors of all %d gve files. I now have %d experimental g-vectors." % (nphases, len(allgves)))
-			
-	# Loop on all experimental g-vectors
-	# Are they in one of the 2 theta, omega, and eta ranges defined in grain spotter?
-	# Need to check for all phases
 	
-	ds = []
-	eta = []
-	omega = []
-	keepPeak = [False] * len(allgves)
+	# Typed arrays for the experimental g-vectors
+	ds = allgves['ds']
+	eta = normalizedAngle360(allgves['eta']) # In GrainSpotter, eta is in [0;360]
+	omega = normalizedAngle180(allgves['omega']) # In GrainSpotter, omega is in [-180;180]
 	
+	# Are experimental g-vectors in one of the 2 theta, omega, and eta ranges defined in grain spotter?
+	# Need to check for all phases
+	keepPeak = numpy.zeros(len(ds), dtype=bool)
+	phaseStats = []
+	ringCounts = []
+	completeness = []
 	for i in range(0,nphases): # Loop on phase
 		gsinput[i]["dsranges"] = []
 		for tthrange in gsinput[i]["tthranges"]:  # Convert 2theta range to ds range for easier comparison
 			ds0 = 2.*numpy.sin(numpy.radians(tthrange[0]/2.))/(wavelength)
 			ds1 = 2.*numpy.sin(numpy.radians(tthrange[1]/2.))/(wavelength)
 			(gsinput[i]["dsranges"]).append([ds0,ds1])
-		# Loop on peaks. If the peak is within the range, we keep it for later
-		for j in range(0,len(allgves)):
-			peak = allgves[j]
-			thisds = float(peak['ds'])
-			thiseta = normalizedAngle360(float(peak['eta'])) # In GrainSpotter, eta is in [0;360]
-			thisomega = normalizedAngle180(float(peak['omega'])) # In GrainSpotter, omega is in [-180;180]
-			test1 = 0
-			test2 = 0
-			test3 = 0
-			for dsrange in gsinput[i]["dsranges"]:
-				if ((thisds >= dsrange[0]) and (thisds <= dsrange[1])):
-					test1 = 1
-			for etarange in gsinput[i]["etaranges"]:
-				if ((thiseta >= etarange[0]) and (thiseta <= etarange[1])):
-					test2 = 1
-				#else:
-				#	print "Not for eta %.1f < %.1f < %.1f" % (etarange[0],thiseta,etarange[1])
-			for omegarange in gsinput[i]["omegaranges"]:
-				if ((thisomega >= omegarange[0]) and (thisomega <= omegarange[1])):
-					test3 = 1
-				#else:
-				#	print "Not for omega %.1f < %.1f < %.1f" % (omegarange[0],thisomega,omegarange[1])
-			if (test1*test2*test3 == 1): # The peak is within the range of ttheta, eta, and omega for phase i. It could have been indexed.
-				keepPeak[j] = True
-	
-	for j in range(0,len(allgves)):
-		if (keepPeak[j]):
-			peak = allgves[j]
-			ds.append(float(peak['ds']))
-			eta.append(float(peak['eta']))
-			omega.append(float(peak['omega']))
-
+		# The peak is within the range of ttheta, eta, and omega for phase i. It could have been indexed.
+		inRange = rangeMask(ds, gsinput[i]["dsranges"]) & rangeMask(eta, gsinput[i]["etaranges"]) & rangeMask(omega, gsinput[i]["omegaranges"])
+		keepPeak |= inRange
+		# Statistics for this phase: g-vectors in range and within one of the sample peaks of this phase
+		[starts, ends] = mergeIntervals(peakssample[i][:,5], peakssample[i][:,6])
+		dsInRange = ds[inRange]
+		nassignedphase = int(numpy.count_nonzero(inIntervals(dsInRange, starts, ends)))
+		ringCounts.append(countInIntervals(numpy.sort(dsInRange), peakssample[i][:,5], peakssample[i][:,6]))
+		stats = {}
+		stats["ngrains"] = ngrains[i]
+		stats["nindexed"] = nindexed[i]
+		stats["ninrange"] = len(dsInRange)
+		stats["nassigned"] = nassignedphase
+		if (nassignedphase > 0):
+			stats["pcindexed"] = 100.*nindexed[i]/nassignedphase
+		else:
+			stats["pcindexed"] = 0.
+		phaseStats.append(stats)
+		# Indexing completeness for each diffraction ring of this phase
+		completeness.append(ringCompleteness(grains[i], allgves, peakssample[i], inRange, gsinput[i], wavelength))
+
+	ds = ds[keepPeak]
 	print("%d g-vectors within eta, omega, and 2theta ranges and could have been indexed." % (len(ds)))
 
 	# Counting peak, within 2 theta range, and that can be assigned to the sample
-
-	nassigned = 0
-	for thisds in ds:
-		append = 0
-		for i in range(0,len(peakssample)):
-			if ((thisds <= peakssample[i][6]) and (thisds >= peakssample[i][5])):
-				append = 1
-		nassigned += append
+	[starts, ends] = mergeIntervals(allpeakssample[:,5], allpeakssample[:,6])
+	nassigned = int(numpy.count_nonzero(inIntervals(ds, starts, ends)))
 	print("%d g-vectors assigned to one of the sample peaks within these ranges." % (nassigned))
 	
+	print("\nIndexing performance per phase")
+	for i in range(0,nphases):
+		print("\tPhase %d: %d g-vectors in range, %d assigned to a sample peak, %d indexed in %d grains (%.1f percents)" % (i, phaseStats[i]["ninrange"], phaseStats[i]["nassigned"], phaseStats[i]["nindexed"], phaseStats[i]["ngrains"], phaseStats[i]["pcindexed"]))
+	
 	print("\nGlobal indexing performance")
 	print("\tOut of %d possible g-vectors, %d have been assigned to %d grains" % (nassigned, totalindexedpeaks, totalngrains))
 	tt = nassigned-totalindexedpeaks
@@ -207,8 +441,23 @@ def gs_indexing_statistics(logfile, gve, gsinputfile, wavelength):
 	print("\t%.1f percents of g-vectors indexed" % (tt))
 	print() 
 	
+	print("Indexing completeness per diffraction ring")
+	for i in range(0,nphases):
+		print("\tPhase %d" % i)
+		for ring in completeness[i]:
+			print("\t\t(%d,%d,%d) 2theta = %.2f: %d observed, %d assigned, %d expected, %.1f percents complete" % (ring['h'], ring['k'], ring['l'], ring['tth'], ring['observed'], ring['assigned'], ring['expected'], 100.*ring['completeness']))
+	print()
+	if (report != None):
+		saveRingReport(completeness, report)
+	
+	total = {}
+	total["ngrains"] = totalngrains
+	total["nindexed"] = totalindexedpeaks
+	total["ninrange"] = len(ds)
+	total["nassigned"] = nassigned
+	total["pcindexed"] = tt
 	
-	return
+	return {"phases": phaseStats, "rings": peakssample, "ringcounts": ringCounts, "completeness": completeness, "total": total}
 
 #################################################################
 #
@@ -246,13 +495,17 @@ If you have multiple phases in your indexing, provide the GS input files, log fi
 	parser.add_argument('-l','--logfile', help="File name of the indexing log file (required)", required=True, nargs='+')
 	parser.add_argument('-g','--gve', help="File name of the experimental g-vector file (required)", required=True, nargs='+')
 	parser.add_argument('-w', '--wavelength', help="wavelength, in anstroms (required)", type=float, required=True)
+	parser.add_argument('-r', '--report', help="If set, saves the indexing completeness for each phase and diffraction ring in this file, as a tab separated table. Default is %(default)s", required=False, default=None)
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "GSIndexingStatistics")
 
 	gsinput = args['inputfile']
 	logfile = args['logfile']
 	gve = args['gve']
 	wavelength = args['wavelength']
+	report = args['report']
 
 	nphases = len(gsinput)
 	if (len(logfile) != nphases):
@@ -262,7 +515,7 @@ If you have multiple phases in your indexing, provide the GS input files, log fi
 		print("Error: I have %d GrainSpotter input file(s) and %d gve files. These should be identical." % (len(gsinput), len(gve)))
 		return
 
-	gs_indexing_statistics(logfile, gve, gsinput, wavelength)
+	gs_indexing_statistics(logfile, gve, gsinput, wavelength, report)
 
 
 
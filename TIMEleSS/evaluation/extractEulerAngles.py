@@ -33,29 +33,45 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 
 # Maths stuff
 import numpy
 
 # TIMEleSS parsing utilities
 from TIMEleSS.general import multigrainOutputParser
+from TIMEleSS.general import orientation
 
 
 # The purpose of this script is to extract the Euler angles from a .log file which was created during a GrainSpotter session. This script creates a list of Euler angles which can then be read by MTeX. The first column should be phi1, the second Phi and the third phi2.
+# Orientations can also be saved as quaternions (w x y z) or Rodrigues vectors.
+
+# Output formats and their description
+formats = {"euler": "Euler angles", "quaternion": "Quaternions", "rodrigues": "Rodrigues vectors"}
 
 
-def extract_euler_angles(inputf,outputf):
+def extract_euler_angles(inputf,outputf,outputformat="euler"):
 	file1 = inputf
 	grains1 = multigrainOutputParser.parseGrains(file1)
 	ngrains1 = len(grains1)
 	print("Parsed %s, found %d grains" % (file1, len(grains1)))
 	
+	# Euler angles are taken from the file, other representations are calculated from U for all grains at once
+	if (outputformat == "quaternion"):
+		data = orientation.quaternionFromU(orientation.orientationArray(grains1))
+		fmt = "%.6f"
+	elif (outputformat == "rodrigues"):
+		data = orientation.rodriguesFromU(orientation.orientationArray(grains1))
+		fmt = "%.6f"
+	else:
+		data = numpy.array([grain.geteulerangles() for grain in grains1], dtype=float).reshape(ngrains1,3)
+		fmt = "%.2f"
 	f = open(outputf,"w+")
-	for grain in grains1:
-		angles = grain.geteulerangles()
-		f.write("%.2f %.2f %.2f\n" % (angles[0], angles[1], angles[2]))
+	numpy.savetxt(f, data, fmt=fmt)
 	f.close()
-	print("Euler angles saved in %s" % (outputf))
+	print("%s saved in %s" % (formats[outputformat], outputf))
 	return
 
 
@@ -85,13 +101,17 @@ def main(argv):
 	# Arguments
 	parser.add_argument('input', help="Path and file name of the indexing log file (required)")
 	parser.add_argument('-o', '--output', required=False, help="Output file (.txt file). Default is %(default)s", default="euler_angles.txt")
+	parser.add_argument('-f', '--format', required=False, choices=list(formats.keys()), help="Orientation format: Euler angles (phi1 Phi phi2, in degrees), quaternions (w x y z), or Rodrigues vectors. Default is %(default)s", default="euler")
 	
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "ExtractEulerAngles")
 
 	inputf = args['input']
 	outputf = args['output']
-	extract_euler_angles(inputf,outputf)
+	outputformat = args['format']
+	extract_euler_angles(inputf,outputf,outputformat)
 
 
 
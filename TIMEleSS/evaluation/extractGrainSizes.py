@@ -34,16 +34,18 @@ import argparse
 import os.path
 from argparse import RawTextHelpFormatter
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # Maths stuff
-import matplotlib
-import matplotlib.pyplot as plt
-matplotlib.use("Qt5Agg")
+# matplotlib is only needed for the histograms which are commented out in main(), it is not loaded
 import numpy
 
 # TIMEleSS parsing utilities
 from TIMEleSS.general import multigrainOutputParser
 from TIMEleSS.general import indexedPeak3DXRD
 from TIMEleSS.general import cifTools
+from TIMEleSS.general import orientation
 
 
 # This script determines an average relative grain size of a multigrain dataset.
@@ -72,11 +74,13 @@ def grainSizeEstimate(logfile, fltfile, ciffile, wavelength, output = None, tthe
     """
     
     # Parsing indexing output files
-    grains = multigrainOutputParser.parseGrains(logfile)
-    ngrains = len(grains)
-    print("Parsed grains from %s, found %d grains" % (logfile, ngrains))
-    [peaksflt,idlist,header] = multigrainOutputParser.parseFLT(fltfile)
-    npeaks = len(idlist)
+    with instrumentation.stage("parse"):
+        grains = multigrainOutputParser.parseGrains(logfile)
+        ngrains = len(grains)
+        print("Parsed grains from %s, found %d grains" % (logfile, ngrains))
+        [peaksflt,header] = multigrainOutputParser.parseFLTTable(fltfile)
+        # All indexed peaks in a single table, sorted by grain
+        [peaks, offsets] = multigrainOutputParser.indexedPeaksTable(grains)
     
     #with open(ciffile) as f: # Only if you saved a list of theoretical intensities first
     #    cifpeaks = f.readlines()
@@ -84,82 +88,80 @@ def grainSizeEstimate(logfile, fltfile, ciffile, wavelength, output = None, tthe
     
     # Preparing a list of theoretical intensities based on CIF
     if (ttheta_min is None):
-        mintt = []
-        for grain in grains:
-            mintt.append(grain.getMinTwoTheta())
-        ttheta_min = min(mintt)-1.
+        ttheta_min = peaks['tth_meas'].min()-1.
     if (ttheta_max is None):
-        maxtt = []
-        for grain in grains:
-            maxtt.append(grain.getMaxTwoTheta())
-        ttheta_max = max(maxtt)+1.
-    cifpeaks = cifTools.peaksFromCIF(ciffile, ttheta_min,  ttheta_max, wavelength) 
+        ttheta_max = peaks['tth_meas'].max()+1.
+    # Theoretical peak intensities for all hkl and their symmetry equivalents
+    ciftable = cifTools.hklIntensityTable(ciffile, ttheta_min,  ttheta_max, wavelength)
     print("Calculated list of theoretical diffraction peak intensities from %s" % (ciffile))
+    peakhkl = numpy.stack([peaks['h'], peaks['k'], peaks['l']], axis=1)
+    # trick: Pnma to Pbnm
+    # peakhkl = peakhkl[:,[1,2,0]]
     
-    # Storing theoretical peak intensities in a dictionnary
-    intensityDic = {}
-    for elt in cifpeaks:
-        h = int(elt[0])
-        k = int(elt[1])
-        l = int(elt[2])
-        # trick: Pnma to Pbnm
-        # h = int(elt[2])
-        # k = int(elt[0])
-        # l = int(elt[1])
-        intensityDic[(h,k,l)] = float(elt[4])
-
-    # Preparing a list to store normalized grain sizes    
-    grainsizes = []
-    grainID = []
-    eulers = []
+    # Join between indexed peaks and the FLT file on peak ID
+    fltorder = numpy.argsort(peaksflt['spot3d_id'], kind='stable')
+    fltid = peaksflt['spot3d_id'][fltorder]
+    index = multigrainOutputParser.rowsForIDs(fltid, fltorder, peaks['peakid'])
+    if (not numpy.all(index >= 0)):
+        missing = numpy.flatnonzero(index < 0)[0]
+        print ("Failed to locate peak ID %d which was found in grain %s" % (peaks['peakid'][missing], grains[peaks['grain'][missing]].getName()))
+        return
+    intensity = peaksflt['sum_intensity'][index]
+    
+    # Theoretical intensities of indexed peaks, looked up on hkl
+    cifintensity = cifTools.hklIntensity(ciftable, peakhkl)
+    found = ~numpy.isnan(cifintensity)
+    for i in numpy.flatnonzero(~found):
+        print ("Failed to find theoretical peak intensity for %d %d %d" % (peakhkl[i,0],peakhkl[i,1],peakhkl[i,2]))
+    
+    # Intensities normalized by theoretical intensity, for peaks with a theoretical intensity
+    peakgrain = peaks['grain'][found]
+    relat_intensity = intensity[found] / cifintensity[found]
     
-    # Loop on grains
-    for grain in grains:
-        thisID = grain.getIndexInFile()
-        peaks = grain.getPeaks()
-        grainintensity = [] # A temporary list containing the normalized intensities
-        for peak in peaks:
-            try:
-                index = idlist.index(peak.getPeakID())
-                intensity = peaksflt[index]['sum_intensity']
-            except IndexError:
-                print ("Failed to locate peak ID %d which was found in grain %s" % (peak.getPeakID(), grain.getName()))
-                return
-            hkl = peak.getHKL()
-            try:
-                cifintensity = intensityDic[(hkl[0],hkl[1],hkl[2])] 
-                relat_intensity = float(intensity) / float(cifintensity) # Normalize by theoretical intensity
-                grainintensity.append(relat_intensity) # Append to list
-            except KeyError:
-                print ("Failed to find theoretical peak intensity for %d %d %d" % (hkl[0],hkl[1],hkl[2]))
-        # Make sure that you kick out outliers with surprizingly high intensities by comparing average and median    
-        average = sum(grainintensity) / len(grainintensity) # av int for each grain
-        kickout = kickoutfactor*numpy.median(grainintensity) # kickoutfactor times median of each grain
-        if average >= kickout:
+    # Average and median for each grain, from peaks sorted by grain, then intensity
+    order = numpy.lexsort((relat_intensity, peakgrain))
+    peakgrain = peakgrain[order]
+    relat_intensity = relat_intensity[order]
+    count = numpy.bincount(peakgrain, minlength=ngrains)
+    start = numpy.zeros(ngrains, dtype=numpy.int64)
+    start[1:] = numpy.cumsum(count)[:-1]
+    hasPeaks = (count > 0)
+    average = numpy.zeros(ngrains)
+    median = numpy.zeros(ngrains)
+    if (len(relat_intensity) > 0):
+        average[hasPeaks] = numpy.add.reduceat(relat_intensity, start[hasPeaks]) / count[hasPeaks]
+        median[hasPeaks] = 0.5*(relat_intensity[start[hasPeaks]+(count[hasPeaks]-1)//2] + relat_intensity[start[hasPeaks]+count[hasPeaks]//2])
+    
+    # Make sure that you kick out outliers with surprizingly high intensities by comparing average and median    
+    kickout = kickoutfactor*median
+    keep = hasPeaks & (average < kickout)
+    for i in numpy.flatnonzero(~keep):
+        thisID = grains[i].getIndexInFile()
+        if (hasPeaks[i]):
             print ("\nIntensities of grain %s are a bit shakey\n--> Grain %s is removed from the list." % (thisID,thisID))
         else:
-            grainsizes.append(average) # Collect the averages in a list
-            eulers.append(grain.EulerAnglesFromU())
-            grainID.append(thisID)
-    #print(grainID)
+            print ("\nNo theoretical intensity for the peaks of grain %s\n--> Grain %s is removed from the list." % (thisID,thisID))
+    keptgrains = [grains[i] for i in numpy.flatnonzero(keep)]
+    grainID = numpy.array([grain.getIndexInFile() for grain in keptgrains], dtype=numpy.int64)
+    
+    # Euler angles of the grains we keep, calculated from U for all grains at once
+    eulers = orientation.eulerFromU(orientation.orientationArray(keptgrains))
 
     # Normalize volumes
-    totalvol = sum(grainsizes)
-    for i in range(0,len(grainsizes)):
-        grainsizes[i] = grainsizes[i]/totalvol
+    grainsizes = average[keep]
+    grainsizes = grainsizes / grainsizes.sum()
     
     # Print the result to the console or save into a file
     if (output != None):
-        f= open(output,"w+")
-        f.write("# grainID, phi1, Phi, phi2, relative grain volume, grain radii (arbitrary unit)\n")
-        for i in range(0,len(grainsizes)):
-           radius = (3*grainsizes[i]/4/numpy.pi)**(1/3)
-           f.write("%i %.2f %.2f %.2f %.4e %.4e\n" % (grainID[i], eulers[i][0], eulers[i][1], eulers[i][2], grainsizes[i], radius))
-        f.close()
+        radius = (3*grainsizes/4/numpy.pi)**(1/3)
+        with instrumentation.stage("write"):
+            f= open(output,"w+")
+            f.write("# grainID, phi1, Phi, phi2, relative grain volume, grain radii (arbitrary unit)\n")
+            numpy.savetxt(f, numpy.column_stack((grainID, eulers, grainsizes, radius)), fmt=["%i", "%.2f", "%.2f", "%.2f", "%.4e", "%.4e"])
+            f.close()
         print ("Saved list of relative grain volumes and radii in %s" % (output))
     print ("\nDone with determination of relative grain sizes for %d grains.\n" % len(grainsizes))
-    return grainsizes
-
+    return grainsizes.tolist()
 
 
 ################################################################
@@ -212,7 +214,9 @@ This is part of the TIMEleSS project\nhttp://timeless.texture.rocks
     parser.add_argument('-r', '--reject', required=False, help="Reject grains with AverageI > reject*MedianI. Default is %(default)s", default=20., type=float)
     
     # Parse arguments
-    args = vars(parser.parse_args())
+    instrumentation.addArguments(parser)
+    args = vars(parser.parse_args(argv))
+    instrumentation.start(args, "ExtractGrainSizes")
     ciffile = args['ciffile']
     ttheta_min = args['ttheta_min']
     ttheta_max = args['ttheta_max']
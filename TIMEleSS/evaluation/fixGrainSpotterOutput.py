@@ -32,6 +32,9 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # TIMEleSS parsing utilities
 from TIMEleSS.general import multigrainOutputParser
 
@@ -77,7 +80,9 @@ def main(argv):
 	
 	parser.add_argument('-o', '--output', required=False, help="Name of output file. Default is %(default)s", default="clean.log")
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "FixGSOutput")
 
 	filename = args['files']
 	output = args['output']
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+This is part of the TIMEleSS tools
+http://timeless.texture.rocks/
+
+Copyright (C) S. Merkel, Universite de Lille, France
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+"""
+Database of indexed grains, peaks, and g-vectors, for queries across indexing runs
+
+Grains from many indexing runs (GrainSpotter logs, gff, or ubi files, and the g-vectors used for indexing)
+are stored in a single SQLite file, with tables
+- runs: one line per indexing run, with name, phase, pressure, dataset, and file names
+- grains: one line per grain, with run, index in file, number of peaks, U, UBI, Euler angles, and position
+- peaks: one line per indexed peak, with grain, run, gve id, peak id (spot3d_id), hkl, and measured and predicted 2theta, omega, eta
+- gvectors: one line per g-vector, with run, spot3d_id, gx, gy, gz, ds, eta, omega
+
+Peak ids (spot3d_id) are only meaningful within a dataset, i.e. a given peak search. Runs indexed from the
+same peaks should have the same dataset label (by default, the name of the g-vector file).
+
+Usage:
+	timelessGrainDatabase grains.db add -f grains.log -n run1 -p olivine -P 12.5 -v peaks.gve
+	timelessGrainDatabase grains.db runs
+	timelessGrainDatabase grains.db grains -m 50 -p olivine
+	timelessGrainDatabase grains.db shared -n run1 -g 12
+	timelessGrainDatabase grains.db sql -q "SELECT run, COUNT(*) FROM grains GROUP BY run"
+"""
+
+# System functions, to manipulate command line arguments
+import sys
+import argparse
+import os.path
+import time
+import sqlite3
+
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
+# TIMEleSS parsing utilities
+from TIMEleSS.general import multigrainOutputParser
+
+
+# Tables and indices
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+	id INTEGER PRIMARY KEY,
+	name TEXT UNIQUE NOT NULL,
+	phase TEXT,
+	pressure REAL,
+	dataset TEXT NOT NULL,
+	grainfile TEXT NOT NULL,
+	gvefile TEXT,
+	date TEXT
+);
+CREATE TABLE IF NOT EXISTS grains (
+	id INTEGER PRIMARY KEY,
+	run INTEGER NOT NULL REFERENCES runs(id),
+	grain INTEGER NOT NULL,
+	npeaks INTEGER NOT NULL,
+	u11 REAL, u12 REAL, u13 REAL, u21 REAL, u22 REAL, u23 REAL, u31 REAL, u32 REAL, u33 REAL,
+	ubi11 REAL, ubi12 REAL, ubi13 REAL, ubi21 REAL, ubi22 REAL, ubi23 REAL, ubi31 REAL, ubi32 REAL, ubi33 REAL,
+	phi1 REAL, phi REAL, phi2 REAL,
+	x REAL, y REAL, z REAL
+);
+CREATE TABLE IF NOT EXISTS peaks (
+	id INTEGER PRIMARY KEY,
+	grain INTEGER NOT NULL REFERENCES grains(id),
+	run INTEGER NOT NULL REFERENCES runs(id),
+	gveid INTEGER,
+	peakid INTEGER,
+	h INTEGER, k INTEGER, l INTEGER,
+	tth_meas REAL, tth_pred REAL, omega_meas REAL, omega_pred REAL, eta_meas REAL, eta_pred REAL
+);
+CREATE TABLE IF NOT EXISTS gvectors (
+	id INTEGER PRIMARY KEY,
+	run INTEGER NOT NULL REFERENCES runs(id),
+	spot3d_id INTEGER,
+	gx REAL, gy REAL, gz REAL, ds REAL, eta REAL, omega REAL
+);
+CREATE INDEX IF NOT EXISTS runs_phase ON runs(phase);
+CREATE INDEX IF NOT EXISTS runs_dataset ON runs(dataset);
+CREATE INDEX IF NOT EXISTS grains_run ON grains(run, grain);
+CREATE INDEX IF NOT EXISTS grains_npeaks ON grains(npeaks);
+CREATE INDEX IF NOT EXISTS peaks_grain ON peaks(grain);
+CREATE INDEX IF NOT EXISTS peaks_peakid ON peaks(peakid, run);
+CREATE INDEX IF NOT EXISTS peaks_gveid ON peaks(run, gveid);
+CREATE INDEX IF NOT EXISTS peaks_hkl ON peaks(run, h, k, l);
+CREATE INDEX IF NOT EXISTS gvectors_id ON gvectors(spot3d_id, run);
+"""
+
+#################################################################
+#
+# Database functions
+#
+#################################################################
+
+"""
+Opens (and creates, if needed) a grain database
+
+Parameters:
+- fname: name of the SQLite file
+
+Returns a connection to the database
+"""
+def openDatabase(fname):
+	db = sqlite3.connect(fname)
+	db.executescript(schema)
+	return db
+
+"""
+Adds an indexing run to the database
+
+Parameters:
+- db: connection to the database
+- name: name of the run (must be unique)
+- grainfile: GrainSpotter log, gff, or ubi file
+- gvefile: g-vector file used for indexing (optional)
+- phase: name of the phase (optional)
+- pressure: pressure (optional)
+- dataset: label for the peak search the run was indexed from. Peak ids are compared between runs of the same dataset.
+  Default is the full path of the g-vector file, or the name of the run if there is none.
+
+Returns the id of the new run
+"""
+def addRun(db, name, grainfile, gvefile=None, phase=None, pressure=None, dataset=None):
+	grains = multigrainOutputParser.parseGrains(grainfile)
+	if (dataset is None):
+		dataset = name if (gvefile is None) else os.path.abspath(gvefile)
+	with db:
+		cursor = db.execute("INSERT INTO runs (name, phase, pressure, dataset, grainfile, gvefile, date) VALUES (?, ?, ?, ?, ?, ?, ?)", (name, phase, pressure, dataset, os.path.abspath(grainfile), None if (gvefile is None) else os.path.abspath(gvefile), time.strftime("%Y-%m-%d %H:%M:%S")))
+		run = cursor.lastrowid
+		# Grains. Ids are set here, so that peaks can refer to them without reading them back
+		first = db.execute("SELECT COALESCE(MAX(id), 0)+1 FROM grains").fetchone()[0]
+		rows = []
+		for i in range(0,len(grains)):
+			grain = grains[i]
+			rows.append([first+i, run, grain.getIndexInFile(), grain.getNPeaks()] + grain.getU().flatten().tolist() + grain.getUBi().flatten().tolist() + list(grain.geteulerangles()) + list(grain.getPosition()))
+		db.executemany("INSERT INTO grains VALUES (%s)" % ",".join(["?"]*28), rows)
+		# Indexed peaks
+		[peaks, offsets] = multigrainOutputParser.indexedPeaksTable(grains)
+		rows = [(first+row[0], run) + tuple(row[2:13]) for row in peaks.tolist()]
+		db.executemany("INSERT INTO peaks (grain, run, gveid, peakid, h, k, l, tth_meas, tth_pred, omega_meas, omega_pred, eta_meas, eta_pred) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+		# G-vectors. The first 3 columns are gx, gy, gz (or xr, yr, zr in older files)
+		if (gvefile is not None):
+			[gve, header] = multigrainOutputParser.parseGVETable(gvefile)
+			names = gve.dtype.names
+			columns = [gve[names[0]], gve[names[1]], gve[names[2]], gve['ds'], gve['eta'], gve['omega']]
+			rows = zip([run]*len(gve), gve['spot3d_id'].tolist(), *[c.tolist() for c in columns])
+			db.executemany("INSERT INTO gvectors (run, spot3d_id, gx, gy, gz, ds, eta, omega) VALUES (?,?,?,?,?,?,?,?)", rows)
+	# Update statistics used by SQLite to choose indices
+	db.execute("ANALYZE")
+	return run
+
+"""
+Removes an indexing run, and its grains, peaks, and g-vectors, from the database
+"""
+def removeRun(db, run):
+	with db:
+		db.execute("DELETE FROM peaks WHERE run = ?", (run,))
+		db.execute("DELETE FROM gvectors WHERE run = ?", (run,))
+		db.execute("DELETE FROM grains WHERE run = ?", (run,))
+		db.execute("DELETE FROM runs WHERE id = ?", (run,))
+
+"""
+Returns the id of a run from its name, or None if it is not in the database
+"""
+def runId(db, name):
+	row = db.execute("SELECT id FROM runs WHERE name = ?", (name,)).fetchone()
+	if (row is None):
+		return None
+	return row[0]
+
+"""
+Lists all runs
+
+Returns a list of [name, phase, pressure, dataset, number of grains, number of indexed peaks]
+"""
+def listRuns(db):
+	return [list(row) for row in db.execute("""SELECT runs.name, runs.phase, runs.pressure, runs.dataset, COUNT(grains.id), COALESCE(SUM(grains.npeaks), 0)
+		FROM runs LEFT JOIN grains ON grains.run = runs.id GROUP BY runs.id ORDER BY runs.id""")]
+
+"""
+Lists grains with more than a given number of peaks
+
+Parameters:
+- db: connection to the database
+- minpeaks: minimum number of peaks
+- phase: only grains from runs for this phase (optional)
+- run: only grains from this run (optional)
+
+Returns a list of [run name, grain index in file, number of peaks, phi1, phi, phi2]
+"""
+def grainsWithPeaks(db, minpeaks, phase=None, run=None):
+	sql = "SELECT runs.name, grains.grain, grains.npeaks, grains.phi1, grains.phi, grains.phi2 FROM grains JOIN runs ON runs.id = grains.run WHERE grains.npeaks >= ?"
+	parameters = [minpeaks]
+	if (phase is not None):
+		sql += " AND runs.phase = ?"
+		parameters.append(phase)
+	if (run is not None):
+		sql += " AND runs.id = ?"
+		parameters.append(run)
+	sql += " ORDER BY runs.id, grains.grain"
+	return [list(row) for row in db.execute(sql, parameters)]
+
+"""
+Finds grains which share peaks with a given grain, in all runs indexed from the same dataset
+
+Parameters:
+- db: connection to the database
+- run: id of the run of the grain
+- grain: index of the grain in its file
+
+Returns a list of [run name, grain index in file, number of peaks of that grain, number of shared peaks], sorted by number of shared peaks
+"""
+def sharedPeaks(db, run, grain):
+	# Written so that SQLite starts from the peaks of the grain, and looks them up in the peakid index
+	return [list(row) for row in db.execute("""SELECT r2.name, g2.grain, g2.npeaks, COUNT(DISTINCT p2.peakid)
+		FROM peaks p2
+		JOIN grains g2 ON g2.id = p2.grain
+		JOIN runs r2 ON r2.id = p2.run
+		WHERE p2.peakid IN (SELECT p1.peakid FROM grains g1 JOIN peaks p1 ON p1.grain = g1.id WHERE g1.run = ?1 AND g1.grain = ?2)
+		AND r2.dataset = (SELECT dataset FROM runs WHERE id = ?1)
+		AND NOT (g2.run = ?1 AND g2.grain = ?2)
+		GROUP BY g2.id
+		ORDER BY COUNT(DISTINCT p2.peakid) DESC, r2.id, g2.grain""", (run, grain))]
+
+"""
+Runs any SQL query
+
+Returns [column names, list of rows]
+"""
+def query(db, sql, parameters=()):
+	cursor = db.execute(sql, parameters)
+	names = [] if (cursor.description is None) else [d[0] for d in cursor.description]
+	return [names, [list(row) for row in cursor]]
+
+"""
+Prints a table of results
+"""
+def printTable(names, rows):
+	print ("\t".join(names))
+	for row in rows:
+		print ("\t".join([("%.3f" % x) if isinstance(x, float) else str(x) for x in row]))
+
+
+#################################################################
+#
+# Main subroutines
+#
+#################################################################
+
+class MyParser(argparse.ArgumentParser):
+	"""
+	Extend the regular argument parser to show the full help in case of error
+	"""
+	def error(self, message):
+
+		sys.stderr.write('\nError : %s\n\n' % message)
+		self.print_help()
+		sys.exit(2)
+
+
+def main(argv):
+	"""
+	Main subroutine
+	"""
+
+	parser = MyParser(usage='%(prog)s database todo [options]', description="Database of indexed grains, peaks, and g-vectors, for queries across indexing runs\nThis is part of the TIMEleSS project\nhttp://timeless.texture.rocks\n")
+
+	# Required arguments
+	parser.add_argument('database', help="Name of the database file (SQLite, created if needed)")
+	parser.add_argument('todo', choices=['add', 'remove', 'runs', 'grains', 'shared', 'sql'], help="What shall we do? add: add a run from a grain file, remove: remove a run, runs: list runs, grains: list grains with more than --minpeaks peaks, shared: list grains sharing peaks with grain --grain of run --name, sql: run an SQL query")
+
+	parser.add_argument('-f', '--file', required=False, help="GrainSpotter log, gff, or ubi file (for add). Default is %(default)s", default=None)
+	parser.add_argument('-q', '--query', required=False, help="SQL query (for sql). Default is %(default)s", default=None)
+	parser.add_argument('-n', '--name', required=False, help="Name of the run (for add, remove, grains, and shared). Default for add is the name of the grain file", default=None)
+	parser.add_argument('-v', '--gve', required=False, help="G-vector file used for indexing (for add, optional). Default is %(default)s", default=None)
+	parser.add_argument('-p', '--phase', required=False, help="Name of the phase (for add and grains, optional). Default is %(default)s", default=None)
+	parser.add_argument('-P', '--pressure', required=False, type=float, help="Pressure (for add, optional). Default is %(default)s", default=None)
+	parser.add_argument('-d', '--dataset', required=False, help="Peak search the run was indexed from (for add). Peak ids are compared between runs with the same dataset. Default is the g-vector file", default=None)
+	parser.add_argument('-m', '--minpeaks', required=False, type=int, help="Minimum number of peaks (for grains). Default is %(default)s", default=0)
+	parser.add_argument('-g', '--grain', required=False, type=int, help="Grain number, as in the grain file (for shared). Default is %(default)s", default=None)
+
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "GrainDatabase")
+
+	todo = args['todo']
+	db = openDatabase(args['database'])
+
+	run = None
+	if ((args['name'] is not None) and (todo != 'add')):
+		run = runId(db, args['name'])
+		if (run is None):
+			print ("Error: run %s not found in %s" % (args['name'], args['database']))
+			sys.exit(2)
+
+	if (todo == 'add'):
+		if (args['file'] is None):
+			parser.error("add needs a grain file (--file)")
+		grainfile = args['file']
+		name = grainfile if (args['name'] is None) else args['name']
+		if (runId(db, name) is not None):
+			print ("Error: there is already a run named %s in %s" % (name, args['database']))
+			sys.exit(2)
+		start = time.perf_counter()
+		addRun(db, name, grainfile, gvefile=args['gve'], phase=args['phase'], pressure=args['pressure'], dataset=args['dataset'])
+		print ("Added run %s from %s in %.2f s" % (name, grainfile, time.perf_counter()-start))
+	elif (todo == 'remove'):
+		if (run is None):
+			parser.error("remove needs a run name (--name)")
+		removeRun(db, run)
+		print ("Removed run %s" % args['name'])
+	elif (todo == 'runs'):
+		printTable(["run", "phase", "pressure", "dataset", "grains", "peaks"], listRuns(db))
+	elif (todo == 'grains'):
+		printTable(["run", "grain", "npeaks", "phi1", "phi", "phi2"], grainsWithPeaks(db, args['minpeaks'], phase=args['phase'], run=run))
+	elif (todo == 'shared'):
+		if ((run is None) or (args['grain'] is None)):
+			parser.error("shared needs a run name (--name) and a grain number (--grain)")
+		printTable(["run", "grain", "npeaks", "shared"], sharedPeaks(db, run, args['grain']))
+	elif (todo == 'sql'):
+		if (args['query'] is None):
+			parser.error("sql needs a query (--query)")
+		[names, rows] = query(db, args['query'])
+		db.commit()
+		printTable(names, rows)
+
+	db.close()
+
+
+# Calling method 1 (used when generating a binary in setup.py)
+def run():
+	main(sys.argv[1:])
+
+# Calling method 2 (if run from the command line)
+if __name__ == "__main__":
+	main(sys.argv[1:])
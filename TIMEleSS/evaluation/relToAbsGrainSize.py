@@ -34,10 +34,11 @@ import argparse
 import os.path
 from argparse import RawTextHelpFormatter
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # Maths stuff
-import matplotlib
-matplotlib.use("Qt5Agg")
-import matplotlib.pyplot as plt
+# matplotlib is only needed for the histogram which is commented out in main(), it is not loaded
 import numpy
 
 # Explanation of the parameters:
@@ -175,7 +176,9 @@ This is part of the TIMEleSS project\nhttp://timeless.texture.rocks
 	parser.add_argument('-p', '--proportion', required=False, help="Gives the proportion of the phase of interest relative to the full sample volume. Example: Give 0.3 if your phase of interest makes up only 30 percent of your entire sample. Default is %(default)s.", default=1.0, type=float)
 	
 	# Parse arguments
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "RelToAbsGrainSize")
 	grainsizelist = args['grainsizelist']
 	beamsize_H = args['beamsize_H']
 	beamsize_V = args['beamsize_V']
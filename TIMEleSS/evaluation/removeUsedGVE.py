@@ -10,6 +10,9 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # Maths stuff
 import numpy
 
@@ -46,7 +49,9 @@ def main(argv):
 	parser.add_argument('-o', '--gve_output', help="Output g-vector file (.gve file)(required)")
 	
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "RemoveUsedGVE")
 
 	logfile = args['logfile']
 	gve_input = args['gve_input']
@@ -55,40 +60,45 @@ def main(argv):
     
     
 def RemoveUsedGVE(logfile,gve_input,gve_output):
+    """
+    Creates a new GVE file without the g-vectors indexed in a GrainSpotter log
+    
+    G-vectors are removed based on their spot3d_id, with a boolean mask over the typed table of g-vectors.
+    IDs of the removed g-vectors, and the grain they were assigned to, are saved next to the new GVE
+    file, in gve_output-removed-ids.dat
+    """
     # Upload .log file from GrainSpotter : 
-    grains = multigrainOutputParser.parse_GrainSpotter_log(logfile)
+    with instrumentation.stage("parse"):
+        grains = multigrainOutputParser.parse_GrainSpotter_log(logfile)
     
     # Upload .gve file from ImageD11 :
-    [peaksgve,idlist,header] = multigrainOutputParser.parseGVE(gve_input) 
+    with instrumentation.stage("parse"):
+        [peaksgve,lines,header] = multigrainOutputParser.parseGVELines(gve_input) 
     
-    # Display peak information : 
-    nb_start = len(peaksgve)
-    gveToRemove = []
-    for grain in grains : 
-        peaks = grain.peaks
-        for indexedPeak in peaks : 
-            #print 'Peak in grainFile'
-            #print indexedPeak.getPeakID()
-            #print indexedPeak.getTThetaMeasured()
-            #print indexedPeak.getOmegaMeasured()
-            #print indexedPeak.getEtaMeasured()
-            #print 'Peak in gveFile'
-            ID_grains = indexedPeak.getPeakID()
-            ID_idlist = idlist.index(ID_grains)
-            ID_gve = peaksgve[ID_idlist]
-            #print  ID_gve
-            #print ID_gve['eta']
-    # Eliminate g-vectors which correspond to already indexed peaks :        
-            gveToRemove.append(ID_gve)
-            #print nb_start
-            #print len(peaksgve)
-            #print len(gveToRemove)
+    # IDs of indexed peaks, with the first grain they were assigned to
+    with instrumentation.stage("remove"):
+        [peaks, offsets] = multigrainOutputParser.indexedPeaksTable(grains)
+        [removedIDs, first] = numpy.unique(peaks['peakid'], return_index=True)
+        removedGrains = numpy.array([grains[i].getIndexInFile() for i in peaks['grain'][first]], dtype=numpy.int64)
+        found = numpy.isin(removedIDs, peaksgve['spot3d_id'])
+        if (not numpy.all(found)):
+            missing = numpy.flatnonzero(~found)[0]
+            print("Failed removing g-vector ID %d which was found in grain %s" % (removedIDs[missing], grains[peaks['grain'][first[missing]]].getName()))
+            return
+        # Eliminate g-vectors which correspond to already indexed peaks :
+        keep = ~numpy.isin(peaksgve['spot3d_id'], removedIDs)
         
-    # Save the new list of (not indexed) peaks in .gve format : 
-    newPeakslist = [peaks for peaks in peaksgve if peaks not in gveToRemove]
-    OutputPeaks = multigrainOutputParser.saveGVE(newPeakslist, header, gve_output)
-    print('\n%s g-vectors were removed.' %len(gveToRemove))
-    print('\nThe new list contains %s g-vectors.' %len(newPeakslist))
+    # Save the new list of (not indexed) peaks in .gve format, and the list of removed IDs : 
+    with instrumentation.stage("write"):
+        f = open(gve_output, 'w')
+        f.write(header + "".join(lines[keep]))
+        f.close()
+        print ("Saved list of %i g-vectors into %s" % (numpy.count_nonzero(keep), gve_output))
+        removedfile = os.path.splitext(gve_output)[0] + "-removed-ids.dat"
+        numpy.savetxt(removedfile, numpy.column_stack((removedIDs, removedGrains)), fmt="%i", header="spot3d_id grain")
+        print ("Saved IDs of removed g-vectors into %s" % (removedfile))
+    print('\n%s g-vectors were removed.' % (len(keep)-numpy.count_nonzero(keep)))
+    print('\nThe new list contains %s g-vectors.' % numpy.count_nonzero(keep))
     print('\nSaved')
 
 
@@ -33,14 +33,16 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 
 # Maths stuff
 import numpy
-import math
-import numpy.linalg
 
 # TIMEleSS parsing utilities
 from TIMEleSS.general import multigrainOutputParser
+from TIMEleSS.general import orientation
 
 
 # The purpose of this script is to extract the Euler angles from a .log file which was created during a GrainSpotter session. We calculate a U matrix from the U angles and check against the U matrix in the log file to make sure all is consistent
@@ -50,22 +52,13 @@ def check_euler_angles(inputf):
 	grains1 = multigrainOutputParser.parseGrains(file1)
 	ngrains1 = len(grains1)
 	print ("Parsed %s, found %d grains" % (file1, len(grains1)))
-	unity = numpy.identity(3)
 	print ("Comparing Euler angles and U matrices. Making sure they match.")
-	for grain in grains1:
-		angles = grain.geteulerangles()
-		U = grain.getU()
-		cphi1 = math.cos(math.radians(angles[0]))
-		sphi1 = math.sin(math.radians(angles[0]))
-		cPhi = math.cos(math.radians(angles[1]))
-		sPhi = math.sin(math.radians(angles[1]))
-		cphi2 = math.cos(math.radians(angles[2]))
-		sphi2 = math.sin(math.radians(angles[2]))
-		U2 = numpy.matrix([[cphi1*cphi2-sphi1*sphi2*cPhi, -cphi1*sphi2-sphi1*cphi2*cPhi, sphi1*sPhi], [sphi1*cphi2+cphi1*sphi2*cPhi, -sphi1*sphi2+cphi1*cphi2*cPhi, -cphi1*sPhi], [sphi2*sPhi, cphi2*sPhi, cPhi]])
-		C = U.dot(numpy.linalg.inv(U2))
-		if (not numpy.allclose(C,unity)):
-			print ("Problem with grain %s" % grain.getName())
-			print (C)
+	# All grains are checked at once
+	euler = numpy.array([grain.geteulerangles() for grain in grains1], dtype=float).reshape(ngrains1,3)
+	[ok, C] = orientation.checkEulerAngles(euler, orientation.orientationArray(grains1))
+	for i in numpy.flatnonzero(~ok):
+		print ("Problem with grain %s" % grains1[i].getName())
+		print (C[i])
 	print ("Done.")
 	return
 
@@ -97,7 +90,9 @@ def main(argv):
 	parser.add_argument('input', help="Path and file name of the indexing log file (required)")
 	
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "TestGSEulerAngles")
 
 	inputf = args['input']
 	check_euler_angles(inputf)
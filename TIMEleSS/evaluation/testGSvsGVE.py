@@ -33,6 +33,9 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 
 # Maths stuff
 import numpy
@@ -64,7 +67,7 @@ def test_grains(grainfile,gvefile,wavelength):
 	npeakstotal = 0
 	npeakserror = 0
 	for grain in grains : 
-		peaks = grain.peaks
+		peaks = grain.getPeaks()
 		for indexedPeak in peaks : 
 			npeakstotal += 1
 			try:
@@ -85,7 +88,7 @@ def test_grains(grainfile,gvefile,wavelength):
 	
 	print ("All peaks in the grain file are in the GVE file. Now, looking for 2theta, eta, omega to see if they match...")
 	for grain in grains : 
-		peaks = grain.peaks
+		peaks = grain.getPeaks()
 		for indexedPeak in peaks : 
 			npeakstotal += 1
 			ID_grains = indexedPeak.getPeakID()
@@ -146,7 +149,9 @@ def main(argv):
 	parser.add_argument('-g','--gve', help="File name of the g-vector file (required)", required=True)
 	parser.add_argument('-w', '--wavelength', help="wavelength, in anstroms (required)", type=float, required=True)
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "TestGSvsGVE")
 
 	logfile = args['logfile']
 	gve = args['gve']
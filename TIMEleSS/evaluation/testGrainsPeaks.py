@@ -32,6 +32,9 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # Parsing tools
 from TIMEleSS.general import multigrainOutputParser
 
@@ -39,8 +42,8 @@ from TIMEleSS.general import multigrainOutputParser
 import numpy
 
 # Rely on ImageD11 for recalculating the peak positions on detector
-from ImageD11 import transform
-from ImageD11 import parameters
+# ImageD11 is slow to load, it is imported in the functions which need it, so that the
+# GUI can show up while files are being read
 
 #################################################################
 #
@@ -58,13 +61,26 @@ class grainPlotData:
 		self.imageD11Pars = "";		# ImageD11 parameters
 		self.grains = "";			# Indexed grains
 		self.ngrains = 0;			# Number of indexed grains
-		self.peaksflt = "";			# Extraction from FLT file
-		self.idlist = "";			# List of peak ID, to easily relate indexed peaks and flt information
+		self.peaksflt = "";			# Extraction from FLT file, as a typed table
+		self.header = "";			# Header of the FLT file
 		self.graintoplot = 0;		# Which grain is being plotted
 		self.plotisset = False;		# Did we start a plot window?
 		self.fig = ""				# Figure in which to plot
 		self.annotation = ""		# Annotation in the figure
 		self.whatoplot = "svsf"			# Choice of "etavsttheta", "omegavsttheta", default (svsf)
+		# Precomputed data, for all indexed peaks of all grains. Peaks for grain i are in [offsets[i]:offsets[i+1]]
+		self.peaks = ""				# Indexed peaks, as returned by multigrainOutputParser.indexedPeaksTable
+		self.offsets = ""			# Offsets of each grain in the list of indexed peaks
+		self.fsmeasured = ""		# Measured s and f of the peaks, from the FLT file
+		self.omegaexp = ""			# Measured omega of the peaks, from the FLT file
+		self.tthetaexp = ""			# Measured 2theta of the peaks, calculated from s and f
+		self.etaexp = ""			# Measured eta of the peaks, calculated from s and f
+		self.fpred = ""				# Predicted f of the peaks, calculated from predicted angles
+		self.spred = ""				# Predicted s of the peaks, calculated from predicted angles
+		self.ringcache = {}			# s vs f diffraction rings, for each 2theta
+		self.ready = numpy.zeros(0, dtype=bool)	# Grains for which the data above have been calculated
+		self.fltrow = ""			# Row of each indexed peak in the FLT file, -1 if not found
+		self.overview = {}			# Data for all peaks in the FLT file, calculated when needed
 
 	"""
 	Parse input files
@@ -73,18 +89,117 @@ class grainPlotData:
 	- gsfile: name of grainspotter log file
 	- FLT: name of flt file
 	- par: name of ImageD11 par file
+	- progress: optional function called as progress(percent, message) as files are read and processed
+	- firstgrain: grain to process first, in case someone is waiting for it
 	"""
-	def parseInputFiles(self, gsfile, FLT, par):
+	def parseInputFiles(self, gsfile, FLT, par, progress=None, firstgrain=0):
+		from ImageD11 import parameters
+		self.report(progress, 0, "Reading %s" % par)
 		self.imageD11Pars = parameters.read_par_file(par)
 
+		self.report(progress, 5, "Reading %s" % gsfile)
 		self.grains = multigrainOutputParser.parse_GrainSpotter_log(gsfile)
 		print ("Parsed grains from %s" % gsfile)
 		self.ngrains =  len(self.grains)
 		print ("Number of grains: %d" % self.ngrains)
 		
-		[self.peaksflt,self.idlist,self.header] = multigrainOutputParser.parseFLT(FLT)
+		self.report(progress, 35, "Reading %s" % FLT)
+		[self.peaksflt,self.header] = multigrainOutputParser.parseFLTTable(FLT)
 		print ("Parsed peaks from %s" % FLT)
 		print ("Number of peaks: %d" % len(self.peaksflt))
+		
+		self.precompute(progress, firstgrain)
+	
+	"""
+	Sends a message about loading to the progress function, if there is one
+	"""
+	def report(self, progress, percent, message):
+		if (progress is None):
+			return
+		progress(int(percent), message)
+	
+	"""
+	Calculates measured and predicted peak positions for all grains
+	Called after parsing input files. After this, plot data are obtained by array slicing.
+	
+	Calculations are done by chunks of grains, starting with firstgrain. Use isReady to know if 
+	data for a given grain are available.
+	
+	Parameters
+	- progress: optional function called as progress(percent, message) after each chunk of grains
+	- firstgrain: grain to process first
+	"""
+	def precompute(self, progress=None, firstgrain=0):
+		self.ready = numpy.zeros(0, dtype=bool)
+		self.report(progress, 60, "Locating indexed peaks")
+		[self.peaks, self.offsets] = multigrainOutputParser.indexedPeaksTable(self.grains)
+		npeaks = len(self.peaks)
+		# Locating indexed peaks in the FLT file, based on their peak ID
+		order = numpy.argsort(self.peaksflt['spot3d_id'], kind='stable')
+		self.fltrow = multigrainOutputParser.rowsForIDs(self.peaksflt['spot3d_id'][order], order, self.peaks['peakid'])
+		found = (self.fltrow >= 0)
+		for i in numpy.flatnonzero(~found):
+			print ("Failed to locate peak ID %d which was found in grain %s" % (self.peaks['peakid'][i], self.grains[self.peaks['grain'][i]].getName()))
+		# Measured peak positions, f, s, and omega. NaN for peaks which are not in the FLT file
+		self.fsmeasured = numpy.full([2,npeaks], numpy.nan)
+		self.fsmeasured[0,found] = self.peaksflt['sc'][self.fltrow[found]]
+		self.fsmeasured[1,found] = self.peaksflt['fc'][self.fltrow[found]]
+		self.omegaexp = numpy.full(npeaks, numpy.nan)
+		self.omegaexp[found] = self.peaksflt['omega'][self.fltrow[found]]
+		self.overview = {}
+		# Arrays filled by precomputeGrains
+		self.tthetaexp = numpy.full(npeaks, numpy.nan)
+		self.etaexp = numpy.full(npeaks, numpy.nan)
+		self.fpred = numpy.full(npeaks, numpy.nan)
+		self.spred = numpy.full(npeaks, numpy.nan)
+		self.ringcache = {}
+		self.ready = numpy.zeros(self.ngrains, dtype=bool)
+		if (self.ngrains == 0):
+			return
+		# Grain we are waiting for first, and then all grains by chunks
+		firstgrain = firstgrain % self.ngrains
+		self.precomputeGrains(firstgrain, firstgrain+1)
+		chunk = max(1, self.ngrains//20)
+		for first in range(0, self.ngrains, chunk):
+			last = min(first+chunk, self.ngrains)
+			self.report(progress, 60+40*first/self.ngrains, "Processed %d grains out of %d" % (first, self.ngrains))
+			self.precomputeGrains(first, last)
+		self.report(progress, 100, "Processed %d grains" % self.ngrains)
+	
+	"""
+	Calculates measured and predicted peak positions for grains first to last-1
+	"""
+	def precomputeGrains(self, first, last):
+		from ImageD11 import transform
+		a = self.offsets[first]
+		b = self.offsets[last]
+		if (b > a):
+			# Calculating 2theta and eta for experimental peaks
+			(ttheta, eta) = transform.compute_tth_eta(self.fsmeasured[:,a:b], **self.imageD11Pars.parameters)
+			self.tthetaexp[a:b] = ttheta
+			# Bringing eta into 0-360 range instead of -180-180
+			self.etaexp[a:b] = eta % 360
+			# Calculating predicted peak positions from angles
+			(self.fpred[a:b], self.spred[a:b]) = transform.compute_xyz_from_tth_eta(self.peaks['tth_pred'][a:b], self.peaks['eta_pred'][a:b], self.peaks['omega_pred'][a:b], **self.imageD11Pars.parameters)
+			# Diffraction rings in s vs f, for each new 2theta, all in one call
+			ringstth = numpy.setdiff1d(self.peaks['tth_pred'][a:b], numpy.array(list(self.ringcache.keys())))
+			eta = numpy.arange(0., 362., 2.)
+			ttheta = numpy.repeat(ringstth, len(eta))
+			(fring, sring) = transform.compute_xyz_from_tth_eta(ttheta, numpy.tile(eta, len(ringstth)), numpy.zeros(len(ttheta)), **self.imageD11Pars.parameters)
+			fring = fring.reshape((-1,len(eta)))
+			sring = sring.reshape((-1,len(eta)))
+			# New dictionnary, in case the cache is being read while we work
+			ringcache = dict(self.ringcache)
+			for i in range(0,len(ringstth)):
+				ringcache[ringstth[i]] = [fring[i], sring[i]]
+			self.ringcache = ringcache
+		self.ready[first:last] = True
+	
+	"""
+	Returns True if plot data for grain grainnumber have been calculated
+	"""
+	def isReady(self, grainnumber):
+		return (grainnumber < len(self.ready)) and bool(self.ready[grainnumber])
 	
 	"""
 	Returns the number of grains available
@@ -114,82 +229,128 @@ class grainPlotData:
 		- list of 2theta rings to plot, for each ring, 2 elements list of y and list of x (y comes first)
 	"""
 	def getPlotData(self, grainnumber, whattoplot):
-		grain = self.grains[grainnumber]
-		peaks = grain.getPeaks()
-		npeaks = len(peaks)
-		# Will hold predicted peak positions, ttheta, eta, omega
-		tthetaPred = numpy.zeros(npeaks)
-		etaPred =  numpy.zeros(npeaks)
-		omegaPred = numpy.zeros(npeaks)
-		# Will hold measured peak positions, f, s, and omega
-		fsmeasured = numpy.zeros([2,npeaks])
-		omegaexp = numpy.zeros([npeaks])
-		# Filling up the array
-		i = 0
-		for peak in peaks:
-			tthetaPred[i] = peak.getTThetaPred()
-			etaPred[i] = peak.getEtaPred()
-			omegaPred[i] = peak.getOmegaPred()
-			try:
-				index = self.idlist.index(peak.getPeakID())
-				fsmeasured[1,i] = self.peaksflt[index]['fc']
-				fsmeasured[0,i] = self.peaksflt[index]['sc']
-				omegaexp[i] = self.peaksflt[index]['omega']
-			except IndexError:
-				print ("Failed to locate peak ID %d which was found in grain %s" % (peak.getPeakID(), grain.getName()))
-				return
-			i += 1
+		first = self.offsets[grainnumber]
+		last = self.offsets[grainnumber+1]
+		# Predicted peak positions, ttheta, eta, omega
+		tthetaPred = self.peaks['tth_pred'][first:last]
+		etaPred = self.peaks['eta_pred'][first:last]
+		omegaPred = self.peaks['omega_pred'][first:last]
+		ringstth = numpy.unique(tthetaPred)
 			
 		# eta vs 2 theta 
 		if (whattoplot == "etavsttheta"):
-			# Calculating 2theta and eta for experimental peaks
-			(tthetaexp, etaexp) = transform. compute_tth_eta(fsmeasured, **self.imageD11Pars.parameters)
-			# Bringing eta into 0-360 range instead of -180-180
-			etaexp = etaexp % 360
 			# Preparing information to add diffraction rings
-			ringstth = numpy.unique(tthetaPred)
 			rings = []
 			for tth in ringstth:
 				eta = numpy.array([0.,180.,360.])
 				ttheta = numpy.full((len(eta)), tth)
-				omega = numpy.full((len(eta)), 0.)
 				rings.append([eta,ttheta])
 			# Ready to plot
-			return ["Grain %s" % (grainnumber+1), '2theta (degrees)', 'eta (degrees)', tthetaexp, etaexp, tthetaPred, etaPred,rings]
+			return ["Grain %s" % (grainnumber+1), '2theta (degrees)', 'eta (degrees)', self.tthetaexp[first:last], self.etaexp[first:last], tthetaPred, etaPred,rings]
 			
 		# omega vs 2 theta 
 		elif (whattoplot == "omegavsttheta"):
-			# Calculating 2theta and eta for experimental peaks
-			(tthetaexp, etaexp) = transform.compute_tth_eta(fsmeasured, **self.imageD11Pars.parameters)
-			# Bringing eta into 0-360 range instead of -180-180
-			etaexp = etaexp % 360
+			omegaexp = self.omegaexp[first:last]
 			# Preparing information to add diffraction rings
-			ringstth = numpy.unique(tthetaPred)
 			rings = []
-			omegam = min(min(omegaexp),min(omegaPred))
-			omegaM = max(max(omegaexp),max(omegaPred))
+			omegam = min(numpy.nanmin(omegaexp),min(omegaPred))
+			omegaM = max(numpy.nanmax(omegaexp),max(omegaPred))
 			for tth in ringstth:
 				omega = numpy.array([omegam-1.,omegaM+1.])
 				ttheta = numpy.full((len(omega)), tth)
 				rings.append([omega,ttheta])
 			# Ready to plot, using multithreading to be able to have multiple plots, did not work!!
-			return ["Grain %s" % (grainnumber+1), '2theta (degrees)', 'omega (degrees)', tthetaexp, omegaexp, tthetaPred, omegaPred, rings]
+			return ["Grain %s" % (grainnumber+1), '2theta (degrees)', 'omega (degrees)', self.tthetaexp[first:last], omegaexp, tthetaPred, omegaPred, rings]
 		
 		# s vs f (as on detector)
 		else:
-			# Calculating predicted peak positions from angles
-			(fpred, spred) = transform.compute_xyz_from_tth_eta(tthetaPred, etaPred, omegaPred, **self.imageD11Pars.parameters)
-			# Preparing information to add diffraction rings
-			ringstth = numpy.unique(tthetaPred)
-			rings = []
-			for tth in ringstth:
-				eta = numpy.arange(0., 362., 2.)
-				ttheta = numpy.full((len(eta)), tth)
-				omega = numpy.full((len(eta)), 0.)
-				rings.append(transform.compute_xyz_from_tth_eta(ttheta, eta, omega, **self.imageD11Pars.parameters))
+			# Diffraction rings are cached for each 2theta
+			rings = [self.ringcache[tth] for tth in ringstth]
 			# Ready to plot
-		return ["Grain %s" % (grainnumber+1), 'f (pixels)', 's (pixels)', fsmeasured[0,:], fsmeasured[1,:], spred, fpred, rings]
+		return ["Grain %s" % (grainnumber+1), 'f (pixels)', 's (pixels)', self.fsmeasured[0,first:last], self.fsmeasured[1,first:last], self.spred[first:last], self.fpred[first:last], rings]
+
+	"""
+	Extracts data for a plot background, common to all grains
+
+	Parameters:
+	- whattoplot: # Choice of "etavsttheta", "omegavsttheta", or "svsf" (default)
+
+	Returns a list with
+		- xlabel
+		- ylabel
+		- list of all 2theta rings to plot, for each ring, 2 elements list of y and list of x (y comes first)
+		- xlimits: [min, max] for the x axis, or None if the plot should be scaled to the rings
+		- ylimits: [min, max] for the y axis, or None if the plot should be scaled to the rings
+	"""
+	def getBackgroundData(self, whattoplot):
+		ringstth = numpy.array(sorted(self.ringcache.keys()))
+		if (len(self.peaks) == 0):
+			return ['', '', [], None, None]
+		tth = numpy.concatenate((self.tthetaexp, self.peaks['tth_pred']))
+		ttmin = numpy.nanmin(tth)
+		ttmax = numpy.nanmax(tth)
+		ttmargin = 0.02*(ttmax-ttmin) + 0.1
+		# eta vs 2 theta
+		if (whattoplot == "etavsttheta"):
+			rings = [[numpy.array([0.,180.,360.]), numpy.full(3, tt)] for tt in ringstth]
+			return ['2theta (degrees)', 'eta (degrees)', rings, [ttmin-ttmargin, ttmax+ttmargin], [-5., 365.]]
+		# omega vs 2 theta
+		elif (whattoplot == "omegavsttheta"):
+			omega = numpy.concatenate((self.omegaexp, self.peaks['omega_pred']))
+			omegam = numpy.nanmin(omega)
+			omegaM = numpy.nanmax(omega)
+			rings = [[numpy.array([omegam-1.,omegaM+1.]), numpy.full(2, tt)] for tt in ringstth]
+			return ['2theta (degrees)', 'omega (degrees)', rings, [ttmin-ttmargin, ttmax+ttmargin], [omegam-2., omegaM+2.]]
+		# s vs f (as on detector)
+		rings = [self.ringcache[tt] for tt in ringstth]
+		return ['f (pixels)', 's (pixels)', rings, None, None]
+
 
+	"""
+	Extracts data to plot all peaks of the FLT file, with the grain they were assigned to
+	
+	Parameters:
+	- whattoplot: # Choice of "etavsttheta", "omegavsttheta", or "svsf" (default)
+	- maxpoints: maximum number of assigned peaks to return, assigned peaks are randomly selected above this. 
+	  Unassigned peaks are all returned
+	
+	Before calling this function, all grains should have been processed.
+	If a peak was assigned to several grains, the last one is used.
+	
+	Returns a list with
+		- xlabel
+		- ylabel
+		- x: x positions of peaks
+		- y: y positions of peaks
+		- grain: grain number for each peak, -1 for unassigned peaks
+		- npeaks: total number of peaks in the FLT file, before selection
+	"""
+	def getOverviewData(self, whattoplot, maxpoints=200000):
+		if (len(self.overview) == 0):
+			# Calculated once, for all peaks in the FLT file
+			from ImageD11 import transform
+			npeaks = len(self.peaksflt)
+			fs = numpy.zeros([2,npeaks])
+			fs[0,:] = self.peaksflt['sc']
+			fs[1,:] = self.peaksflt['fc']
+			(ttheta, eta) = transform.compute_tth_eta(fs, **self.imageD11Pars.parameters)
+			grain = numpy.full(npeaks, -1, dtype=int)
+			found = (self.fltrow >= 0)
+			grain[self.fltrow[found]] = self.peaks['grain'][found]
+			self.overview = {'fs': fs, 'ttheta': ttheta, 'eta': eta % 360, 'grain': grain}
+		npeaks = len(self.overview['grain'])
+		# All unassigned peaks are kept, they are shown as a density map
+		assigned = numpy.flatnonzero(self.overview['grain'] >= 0)
+		if (len(assigned) > maxpoints):
+			# Fixed seed, so that the same peaks are shown for all types of plots
+			assigned = numpy.random.RandomState(0).choice(assigned, maxpoints, replace=False)
+		keep = numpy.sort(numpy.concatenate((assigned, numpy.flatnonzero(self.overview['grain'] < 0))))
+		grain = self.overview['grain'][keep]
+		if (whattoplot == "etavsttheta"):
+			return ['2theta (degrees)', 'eta (degrees)', self.overview['ttheta'][keep], self.overview['eta'][keep], grain, npeaks]
+		elif (whattoplot == "omegavsttheta"):
+			return ['2theta (degrees)', 'omega (degrees)', self.overview['ttheta'][keep], self.peaksflt['omega'][keep], grain, npeaks]
+		return ['f (pixels)', 's (pixels)', self.overview['fs'][0,keep], self.overview['fs'][1,keep], grain, npeaks]
 
 	"""
 	Returns information about peak peaknum in grain grainnum
@@ -240,7 +401,9 @@ def main(argv):
 	parser.add_argument('gsfile',  help="Name of GrainSpotter output file (required)")
 	parser.add_argument('FLT',  help="FLT file used to generate g-vectors for indexing (required)")
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "TestGrainsPeaks")
 
 	gsfile = args['gsfile']
 	FLT = args['FLT']
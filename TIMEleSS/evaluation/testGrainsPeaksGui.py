@@ -31,6 +31,13 @@ from __future__ import print_function
 import sys
 import argparse
 import os.path
+import time
+
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
+# Simple mathematical operations
+import numpy
 
 # Actual grain testing functions
 from . import testGrainsPeaks
@@ -85,6 +92,40 @@ NavigationToolbar.toolitems = (
 	('Save', 'Save the figure', 'filesave', 'save_figure'),
 	(None, None, None, None))
 
+#################################################################
+#
+# Thread to read input files in the background
+#
+#################################################################
+
+class loadGrainData(PyQt5.QtCore.QThread):
+	
+	"""
+	Reads and processes input files for a grainPlotData object, without blocking the GUI
+	
+	Signals:
+	- progress(percent, message): sent as files are read and grains are processed
+	- failed(message): sent if something went wrong
+	Once done, the standard QThread finished signal is sent
+	"""
+	progress = PyQt5.QtCore.pyqtSignal(int, str)
+	failed = PyQt5.QtCore.pyqtSignal(str)
+	
+	def __init__(self, grainsData, gsfile, FLT, par, firstgrain, parent=None):
+		PyQt5.QtCore.QThread.__init__(self, parent)
+		self.grainsData = grainsData
+		self.gsfile = gsfile
+		self.FLT = FLT
+		self.par = par
+		self.firstgrain = firstgrain
+	
+	def run(self):
+		try:
+			self.grainsData.parseInputFiles(self.gsfile, self.FLT, self.par, progress=self.progress.emit, firstgrain=self.firstgrain)
+		except (Exception, SystemExit) as e:
+			# Input parsers sometimes call sys.exit on errors, we do not want to lose the message
+			self.failed.emit("Error while reading input files: %s" % str(e))
+
 #################################################################
 #
 # Class to build the Graphical User Interface
@@ -101,6 +142,15 @@ class plotGrainData(PyQt5.QtWidgets.QMainWindow):
 	- grainsData: a object of type grainPlotData, defined in testGrainsPeaks, for which input files have been read
 	- grainN: the grain number to start with (put 1 if unknown)
 	- plotwhat: what to plot, choice of "etavsttheta", "omegavsttheta", or default ("svsf")
+	
+	The overview check box switches to a plot of all peaks in the FLT file, coloured by grain. Clicking 
+	on a peak in the overview moves to the corresponding grain.
+	
+	If grainsData has not been loaded yet, call loadFiles after creating the window. Files will be read 
+	in the background and the plot will show up as soon as the first grain is ready.
+	
+	Rings, axes, and legend are drawn once for each type of plot and cached as a background. Moving 
+	between grains only updates the peak positions and title, and uses blitting to refresh the plot.
 	"""
 	def __init__(self, grainsData, grainN, plotwhat, parent=None):
 		PyQt5.QtWidgets.QMainWindow.__init__(self, parent)
@@ -109,10 +159,81 @@ class plotGrainData(PyQt5.QtWidgets.QMainWindow):
 		self.ngrains = self.grainsData.getNGrains()
 		self.graintoplot = grainN-1
 		self.whatoplot = plotwhat
+		self.background = None
+		self.waiting = False
+		self.loader = None
 		self.create_main_frame()
-		self.on_draw()
+		self.setup_plot()
 		self.show()
 
+	"""
+	Reads input files in the background, showing progress in the status bar
+	
+	Parameters
+	- gsfile: name of grainspotter log file
+	- FLT: name of flt file
+	- par: name of ImageD11 par file
+	"""
+	def loadFiles(self, gsfile, FLT, par):
+		self.setNavigation(False)
+		self.overviewBox.setEnabled(False)
+		self.progressBar.setValue(0)
+		self.progressBar.show()
+		self.loadstart = time.perf_counter()
+		self.loader = loadGrainData(self.grainsData, gsfile, FLT, par, self.graintoplot, self)
+		self.loader.progress.connect(self.on_progress)
+		self.loader.failed.connect(self.on_failed)
+		self.loader.finished.connect(self.on_loaded)
+		self.loader.start()
+
+	"""
+	Enables or disables the widgets used to move between grains
+	"""
+	def setNavigation(self, enabled):
+		for widget in self.navwidgets:
+			widget.setEnabled(enabled)
+
+	"""
+	Event processing, while loading: updates progress and shows the grain as soon as possible
+	"""
+	def on_progress(self, percent, message):
+		self.progressBar.setValue(percent)
+		self.statusBar().showMessage(message)
+		if (self.ngrains == 0) and (self.grainsData.getNGrains() > 0):
+			# We now know the number of grains
+			self.ngrains = self.grainsData.getNGrains()
+			self.graintoplot = self.graintoplot % self.ngrains
+			self.grainLabel.setText("Grain (1-%d) : " % self.ngrains)
+			self.grainNBox.setText("%d" % (self.graintoplot+1))
+		if (self.ngrains > 0) and (not self.grainNBox.isEnabled()) and self.grainsData.isReady(self.graintoplot):
+			# First grain is ready, we can plot and let users move around
+			self.setNavigation(True)
+			self.setup_plot()
+		elif self.waiting and self.grainsData.isReady(self.graintoplot):
+			# Users asked for a grain that is now ready
+			self.on_draw()
+
+	"""
+	Event processing, when all files have been loaded
+	"""
+	def on_loaded(self):
+		self.progressBar.hide()
+		if (self.ngrains == 0):
+			return
+		# Background is rebuilt, with rings and limits for all grains
+		self.setNavigation(True)
+		self.overviewBox.setEnabled(True)
+		self.setup_plot()
+		self.statusBar().showMessage("Loaded %d grains in %.1f s" % (self.ngrains, time.perf_counter()-self.loadstart))
+
+	"""
+	Event processing, if loading files failed
+	"""
+	def on_failed(self, message):
+		self.progressBar.hide()
+		self.statusBar().showMessage(message)
+		PyQt5.QtWidgets.QMessageBox.critical(self, "Error", message)
+
 	"""
 	Builds up the GUI
 	"""
@@ -120,7 +241,7 @@ class plotGrainData(PyQt5.QtWidgets.QMainWindow):
 		self.main_frame = PyQt5.QtWidgets.QWidget()
 		self.fig = Figure((8.0, 8.0), dpi=100,tight_layout=True,edgecolor='w',facecolor='w')
 		
-		grainLabel = PyQt5.QtWidgets.QLabel("Grain (1-%d) : " % self.ngrains, self)
+		self.grainLabel = PyQt5.QtWidgets.QLabel("Grain (1-%d) : " % self.ngrains, self)
 		self.grainNBox = PyQt5.QtWidgets.QLineEdit("%d" % (self.graintoplot+1), self)
 		self.grainNBox.returnPressed.connect(self.new_grain)
 		buttonP = PyQt5.QtWidgets.QPushButton('Previous', self)
@@ -134,28 +255,40 @@ class plotGrainData(PyQt5.QtWidgets.QMainWindow):
 		self.plotWhatBox.addItem("s vs f", "svsf")
 		self.plotWhatBox.addItem("Eta vs. 2 theta", "etavsttheta")
 		self.plotWhatBox.addItem("Omega vs. 2 theta", "omegavsttheta")
+		index = self.plotWhatBox.findData(self.whatoplot)
+		if (index > -1):
+			self.plotWhatBox.setCurrentIndex(index)
 		self.plotWhatBox.currentIndexChanged.connect(self.plotselectionchange)
+		self.overviewBox = PyQt5.QtWidgets.QCheckBox("Overview", self)
+		self.overviewBox.setToolTip('Show all peaks, coloured by grain. Click on a peak to see its grain')
+		self.overviewBox.toggled.connect(self.overviewchange)
+		self.navwidgets = [self.grainNBox, buttonP, buttonN]
 
 		hlay = PyQt5.QtWidgets.QHBoxLayout()
-		hlay.addWidget(grainLabel)
+		hlay.addWidget(self.grainLabel)
 		hlay.addWidget(buttonP)
 		hlay.addWidget(self.grainNBox)
 		hlay.addWidget(buttonN)
 		hlay.addItem(PyQt5.QtWidgets.QSpacerItem(300, 10, PyQt5.QtWidgets.QSizePolicy.Expanding))
 		hlay.addWidget(plotLabel)
 		hlay.addWidget(self.plotWhatBox)
+		hlay.addWidget(self.overviewBox)
 		
 		self.canvas = FigureCanvas(self.fig)
 		self.canvas.setParent(self.main_frame)
 		self.canvas.setFocusPolicy(PyQt5.QtCore.Qt.StrongFocus)
 		self.canvas.setFocus()
 		self.canvas.mpl_connect('pick_event', self.on_pick) 
+		self.canvas.mpl_connect('draw_event', self.on_canvas_draw)
 		self.fig.canvas.mpl_connect('forward_event', self.handle_forward)
 		self.fig.canvas.mpl_connect('backward_event', self.handle_backward)
 
 		self.mpl_toolbar = NavigationToolbar(self.canvas, self.main_frame)
 		self.mpl_toolbar.forward = new_forward
 		self.mpl_toolbar.back = new_backward
+		# The Save button is connected to the toolbar method when the toolbar is created, it needs to be reconnected
+		self.mpl_toolbar._actions['save_figure'].triggered.disconnect()
+		self.mpl_toolbar._actions['save_figure'].triggered.connect(self.save_figure)
 
 		windowLabel = PyQt5.QtWidgets.QLabel("This is part of the TIMEleSS tools <a href=\"http://timeless.texture.rocks/\">http://timeless.texture.rocks/</a>", self)
 		windowLabel.setOpenExternalLinks(True)
@@ -169,13 +302,21 @@ class plotGrainData(PyQt5.QtWidgets.QMainWindow):
 
 		self.main_frame.setLayout(vbox)
 		self.setCentralWidget(self.main_frame)
+		self.progressBar = PyQt5.QtWidgets.QProgressBar(self)
+		self.progressBar.setRange(0, 100)
+		self.progressBar.hide()
+		self.statusBar().addPermanentWidget(self.progressBar)
+		self.statusBar().showMessage("Ready")
 		
 	"""
-	Draws or redraws the plot
+	Builds the plot for a type of plot: axes, diffraction rings for all grains, legend, and persistent 
+	artists for the peaks. Only needs to be called when the type of plot changes.
 	"""
-	def on_draw(self):
-		# Getting plot data
-		[title, xlabel, ylabel, xmeasured, ymeasured, xpred, ypred, rings] = self.grainsData.getPlotData(self.graintoplot, self.whatoplot)
+	def setup_plot(self):
+		if (self.overviewBox.isChecked()):
+			self.setup_overview()
+			return
+		[xlabel, ylabel, rings, xlimits, ylimits] = self.grainsData.getBackgroundData(self.whatoplot)
 		# Clearing plot
 		self.fig.clear()
 		self.axes = self.fig.add_subplot(111)
@@ -184,42 +325,184 @@ class plotGrainData(PyQt5.QtWidgets.QMainWindow):
 		for ring in rings:
 			self.axes.plot(ring[1], ring[0], color='black', linestyle='solid', linewidth=0.5, alpha=0.5)
 		
-		# Adding indexed peaks
-		g1 = self.axes.scatter(xmeasured, ymeasured, s=60,  marker='o', facecolors='r', edgecolors='r')
-		g2 = self.axes.scatter(xpred, ypred, s=80,  marker='s', facecolors='none', edgecolors='b', picker=5) # Picker to allow users to pick on a point
+		# Persistent artists for the indexed peaks, they are not part of the background
+		self.g1 = self.axes.scatter([], [], s=60,  marker='o', facecolors='r', edgecolors='r', animated=True)
+		self.g2 = self.axes.scatter([], [], s=80,  marker='s', facecolors='none', edgecolors='b', picker=5, animated=True) # Picker to allow users to pick on a point
 		
 		# Title and labels
 		self.axes.set_xlabel(xlabel)
 		self.axes.set_ylabel(ylabel)
-		self.axes.set_title(title, loc='left')
+		self.title = self.axes.set_title("", loc='left')
+		self.title.set_animated(True)
 		if (self.whatoplot == "svsf"):
 			self.axes.set_aspect(1.0)
 			self.axes.autoscale(tight=True)
 		else:
 			self.axes.set_aspect('auto')
-			self.axes.autoscale(tight=False)
+			self.axes.set_xlim(xlimits)
+			self.axes.set_ylim(ylimits)
 			
 		# Legend
-		self.axes.legend([g1, g2], ['Measured', 'Predicted'],
+		self.axes.legend([self.g1, self.g2], ['Measured', 'Predicted'],
 			loc = 'upper right', ncol = 2, scatterpoints = 1,
 			frameon = True, markerscale = 1,
 			borderpad = 0.2, labelspacing = 0.2, bbox_to_anchor=(1., 1.05))
 		
-		# Ready to draw
+		# Ready to draw. Background will be saved in on_canvas_draw
 		self.annotation = "" # No annotation yet. Important for dealing with picking events
+		self.update_artists()
 		self.canvas.draw()
+		self.waiting = not self.grainsData.isReady(self.graintoplot)
+
+	"""
+	Builds the overview plot, with all peaks of the FLT file coloured by grain.
+	Assigned peaks are randomly selected if there are too many. Unassigned peaks are shown as
+	a density map if there are too many.
+	"""
+	def setup_overview(self, maxpoints=200000):
+		[xlabel, ylabel, x, y, grain, npeaks] = self.grainsData.getOverviewData(self.whatoplot, maxpoints)
+		self.fig.clear()
+		self.axes = self.fig.add_subplot(111)
+		self.background = None
+		self.annotation = ""
+		
+		# Unassigned peaks, in grey
+		unassigned = (grain < 0)
+		if (numpy.count_nonzero(unassigned) > maxpoints//10):
+			self.axes.hexbin(x[unassigned], y[unassigned], gridsize=200, bins='log', mincnt=1, cmap='Greys', alpha=0.5)
+		else:
+			self.axes.scatter(x[unassigned], y[unassigned], s=4, c='0.6', linewidths=0, rasterized=True)
+		
+		# Assigned peaks, colours are recycled every 20 grains
+		self.overviewgrains = grain[~unassigned]
+		self.g1 = self.axes.scatter(x[~unassigned], y[~unassigned], s=6, c=self.overviewgrains % 20, cmap='tab20', vmin=0, vmax=19, linewidths=0, rasterized=True, picker=3)
+		
+		# Title and labels
+		self.axes.set_xlabel(xlabel)
+		self.axes.set_ylabel(ylabel)
+		self.axes.set_title("%d indexed peaks in %d grains (%d shown), %d unassigned peaks" % (len(self.grainsData.peaks), self.ngrains, len(self.overviewgrains), numpy.count_nonzero(unassigned)), loc='left')
+		if (self.whatoplot == "svsf"):
+			self.axes.set_aspect(1.0)
+		else:
+			self.axes.set_aspect('auto')
+		self.axes.autoscale(tight=True)
+		self.canvas.draw()
+
+	"""
+	Sets the data for the persistent artists, for the current grain
+	"""
+	def update_artists(self):
+		if (self.annotation != ""):
+			self.annotation.remove()
+			self.annotation = ""
+		if (not self.grainsData.isReady(self.graintoplot)):
+			# Nothing to show yet
+			self.g1.set_offsets(numpy.zeros([0,2]))
+			self.g2.set_offsets(numpy.zeros([0,2]))
+			self.title.set_text("")
+			return 0
+		[title, xlabel, ylabel, xmeasured, ymeasured, xpred, ypred, rings] = self.grainsData.getPlotData(self.graintoplot, self.whatoplot)
+		self.g1.set_offsets(numpy.column_stack((xmeasured, ymeasured)))
+		self.g2.set_offsets(numpy.column_stack((xpred, ypred)))
+		self.title.set_text(title)
+		return len(xpred)
+
+	"""
+	Draws the persistent artists on top of the background
+	"""
+	def draw_artists(self):
+		self.axes.draw_artist(self.g1)
+		self.axes.draw_artist(self.g2)
+		self.axes.draw_artist(self.title)
+		if (self.annotation != ""):
+			self.axes.draw_artist(self.annotation)
+
+	"""
+	Refreshes the plot, using the cached background
+	"""
+	def blit(self):
+		if (self.background is None):
+			self.canvas.draw()
+			return
+		self.canvas.restore_region(self.background)
+		self.draw_artists()
+		self.canvas.blit(self.fig.bbox)
+
+	"""
+	Called after each full redraw of the canvas (first draw, window resize, zoom, pan...)
+	Saves the background and adds the persistent artists on top of it
+	"""
+	def on_canvas_draw(self, event):
+		if (self.overviewBox.isChecked()):
+			# Nothing animated in the overview
+			return
+		self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+		self.draw_artists()
+
+	"""
+	Draws or redraws the plot for the current grain
+	"""
+	def on_draw(self):
+		if (self.overviewBox.isChecked()):
+			# Moving to a grain, back to grain view
+			self.overviewBox.setChecked(False)
+		start = time.perf_counter()
+		npeaks = self.update_artists()
+		self.blit()
+		elapsed = 1000.*(time.perf_counter() - start)
+		self.waiting = not self.grainsData.isReady(self.graintoplot)
+		if (self.waiting):
+			self.statusBar().showMessage("Grain %d is still being loaded" % (self.graintoplot+1))
+		else:
+			self.statusBar().showMessage("Grain %d: %d peaks, drawn in %.1f ms" % (self.graintoplot+1, npeaks, elapsed))
+
+	"""
+	Saves the figure. The persistent artists are animated, and would not be saved otherwise.
+	"""
+	def save_figure(self, *args):
+		if (self.overviewBox.isChecked()):
+			NavigationToolbar.save_figure(self.mpl_toolbar, *args)
+			return
+		artists = [self.g1, self.g2, self.title]
+		if (self.annotation != ""):
+			artists.append(self.annotation)
+		for artist in artists:
+			artist.set_animated(False)
+		try:
+			NavigationToolbar.save_figure(self.mpl_toolbar, *args)
+		finally:
+			for artist in artists:
+				artist.set_animated(True)
+			self.canvas.draw()
 
 	"""
 	Event processing to change the plot type
 	"""
 	def plotselectionchange(self,index):
 		self.whatoplot = self.plotWhatBox.itemData(index)
-		self.on_draw()
+		start = time.perf_counter()
+		self.setup_plot()
+		elapsed = 1000.*(time.perf_counter() - start)
+		self.statusBar().showMessage("Grain %d, new plot type drawn in %.1f ms" % (self.graintoplot+1, elapsed))
+
+	"""
+	Event processing to switch between the overview and a single grain
+	"""
+	def overviewchange(self, checked):
+		start = time.perf_counter()
+		self.setup_plot()
+		elapsed = 1000.*(time.perf_counter() - start)
+		if (checked):
+			self.statusBar().showMessage("Overview drawn in %.1f ms. Click on a peak to see its grain" % (elapsed))
+		else:
+			self.statusBar().showMessage("Grain %d, drawn in %.1f ms" % (self.graintoplot+1, elapsed))
 
 	"""
 	Event processing: we need to change grain based on text input
 	"""
 	def new_grain(self):
+		if (self.ngrains == 0):
+			return
 		try:
 			i = int(self.grainNBox.text())-1
 			self.graintoplot = (i) % self.ngrains
@@ -233,6 +516,8 @@ class plotGrainData(PyQt5.QtWidgets.QMainWindow):
 	Event processing when left arrow is click (move to previous grain)
 	"""
 	def handle_backward(self,evt):
+		if (self.ngrains == 0):
+			return
 		self.graintoplot = (self.graintoplot-1) % self.ngrains
 		self.grainNBox.setText("%d" % (self.graintoplot+1))
 		self.on_draw()
@@ -241,6 +526,8 @@ class plotGrainData(PyQt5.QtWidgets.QMainWindow):
 	Event processing when right arrow is click (move to next grain)
 	"""
 	def handle_forward(self,evt):
+		if (self.ngrains == 0):
+			return
 		self.graintoplot = (self.graintoplot+1) % self.ngrains
 		self.grainNBox.setText("%d" % (self.graintoplot+1))
 		self.on_draw()
@@ -256,6 +543,12 @@ class plotGrainData(PyQt5.QtWidgets.QMainWindow):
 	"""
 	def on_pick(self, event):
 		# print('you picked on data')
+		if (self.overviewBox.isChecked()):
+			# Moving to the grain of the peak
+			self.graintoplot = int(self.overviewgrains[event.ind[0]])
+			self.grainNBox.setText("%d" % (self.graintoplot+1))
+			self.on_draw()
+			return
 		thisdataset = event.artist
 		index = event.ind
 		posX = (thisdataset.get_offsets())[index][0][0]
@@ -264,8 +557,8 @@ class plotGrainData(PyQt5.QtWidgets.QMainWindow):
 		if (self.annotation != ""):
 			self.annotation.remove()
 		# Add the peak information to the plot
-		self.annotation = self.axes.text(posX, posY, text, fontsize=9, bbox=dict(boxstyle="round", ec=(1., 0.5, 0.5), fc=(1., 1., 1.), alpha=0.9))
-		self.canvas.draw()
+		self.annotation = self.axes.text(posX, posY, text, fontsize=9, bbox=dict(boxstyle="round", ec=(1., 0.5, 0.5), fc=(1., 1., 1.), alpha=0.9), animated=True)
+		self.blit()
 
 #################################################################
 #
@@ -300,7 +593,9 @@ def main(argv):
 	parser.add_argument('-p', '--plot', required=False, help="""What do you want to plot ? "svsf" for s vs f in pixels (i.e. diffraction image), etavs2theta for eta vs. 2 theta, omegavsttheta for omega vs. 2 theta. Default is svsf.""", default="svsf")
 	parser.add_argument('-g', '--grain', type=int, required=False, help="""Grain number. Default is 1.""", default=1)
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "PlotIndexedGrain")
 
 	gsfile = args['gsfile']
 	FLT = args['FLT']
@@ -309,9 +604,9 @@ def main(argv):
 	g = args['grain']
 	
 	grainCompare = testGrainsPeaks.grainPlotData()
-	test = grainCompare.parseInputFiles(gsfile, FLT, par)
 	app = PyQt5.QtWidgets.QApplication(sys.argv)	
 	form = plotGrainData(grainCompare,g,p)
+	form.loadFiles(gsfile, FLT, par)
 
 	app.exec_()
 
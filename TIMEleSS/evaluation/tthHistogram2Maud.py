@@ -32,6 +32,9 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # Maths stuff
 import numpy 
 import math 
@@ -123,7 +126,9 @@ def main(argv):
 	# Required arguments
 	parser.add_argument('-d', '--distance', required=True, help="Detector distance  (in mm, required)", type=float)
 
-	args = vars(parser.parse_args())	
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "TthHistogram2Maud")
 
 	data = args['txtdata']
 	distance = args['distance']
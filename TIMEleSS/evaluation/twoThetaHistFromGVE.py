@@ -32,12 +32,14 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # Maths stuff
 import numpy
 
 # TIMEleSS parsing utilities
 from TIMEleSS.general import multigrainOutputParser
-from six.moves import range
 
 #################################################################
 #
@@ -60,61 +62,114 @@ class twothetahistogram:
 	"""
 	Inits parameters for the calculation of 2theta histograms
 	Input: wavelength, in angstroms
+	
+	Histograms can be built in two ways
+	- call setGVE and/or addGVE and then buildHistogram. The ds of all peaks are kept in memory,
+	  and the 2theta range of the histogram is set from the data
+	- call setBinning first, to fix the bin edges, and then addGVE for as many GVE files as needed.
+	  Peaks are added to the histogram file by file, and are not kept in memory. Useful to build a 
+	  histogram for a whole beamtime
 	"""
 	def __init__(self,wavelength):
-		self.gvefile = ""				# GVE file parameters
-		self.peakList = []				# List of peaks
-		self.twothetalist = []			# List of twothetas for the peaks
+		self.gvefile = ""				# GVE file(s) used to build the histogram
+		self.ds = numpy.zeros(0)		# ds for the peaks (not kept if the bin edges are fixed)
+		self.twotheta = numpy.zeros(0)	# List of twothetas for the peaks
 		self.wavelength = wavelength	# wavelength, in angstroms
-		self.npeaks = 0					# Number ofpeaks
-		self.hist = ""					# histogram data
+		self.npeaks = 0					# Number of peaks
+		self.hist = ""					# histogram data, as [counts, bin edges]
 		self.nbins = 0					# number of bins in the histogram
 		self.set = False				# Will be set to true one we have any histogram
+		self.fixedbins = False			# Will be set to true if the bin edges are fixed, peaks are then accumulated file by file
+
+	"""
+	Calculates 2theta, in degrees, for an array of ds
+	"""
+	def twothetaFromDs(self,ds):
+		return 2.*numpy.degrees(numpy.arcsin(ds*self.wavelength/2.))
+
+	"""
+	Fixes the bin edges of the histogram, from ttmin to ttmax (in degrees) with nbins bins
+	Peaks which are later added with addGVE are accumulated in this histogram and not kept in memory
+	"""
+	def setBinning(self,ttmin,ttmax,nbins=10000):
+		self.nbins = nbins
+		self.hist = [numpy.zeros(nbins, dtype=numpy.int64), numpy.linspace(ttmin, ttmax, nbins+1)]
+		self.fixedbins = True
+		self.set = True
+		self.npeaks = 0
+		self.gvefile = ""
+		self.ds = numpy.zeros(0)
+		self.twotheta = numpy.zeros(0)
 
 	"""
 	Parses and sets peaks from a GVE file
 	"""
 	def setGVE(self,gvefile):
-		[peaksgve,idlist,header] = multigrainOutputParser.parseGVE(gvefile) 
-		self.peakList = peaksgve
-		self.npeaks = len(peaksgve)
-		self.gvefile = gvefile
-		self.twotheta = []
-		for peak in self.peakList:
-			dsPeak = float(peak['ds'])
-			self.twotheta.append(2.*numpy.degrees(numpy.arcsin(dsPeak*self.wavelength/2.)))
+		self.npeaks = 0
+		self.gvefile = ""
+		self.ds = numpy.zeros(0)
+		self.twotheta = numpy.zeros(0)
+		if (self.fixedbins):
+			self.hist[0][:] = 0
+		self.addGVE(gvefile)
+	
+	"""
+	Parses and adds peaks from a GVE file
+	"""
+	def addGVE(self,gvefile):
+		[peaksgve,header] = multigrainOutputParser.parseGVETable(gvefile)
+		ds = peaksgve['ds']
+		self.npeaks += len(ds)
+		if (self.gvefile == ""):
+			self.gvefile = gvefile
+		else:
+			self.gvefile += ", " + gvefile
+		if (self.fixedbins):
+			# Accumulate in the histogram, peaks are not kept
+			counts, edges = numpy.histogram(self.twothetaFromDs(ds), self.hist[1])
+			self.hist[0] += counts
+		else:
+			self.ds = numpy.concatenate((self.ds, ds))
+			self.twotheta = self.twothetaFromDs(self.ds)
 	
 	"""
 	Change the wavelength
+	If bin edges are fixed, peaks are not kept in memory and the histogram is reset
 	"""
 	def setWavelength(self,wavelength):
-		self.twotheta = []
-		for peak in self.peakList:
-			dsPeak = float(peak['ds'])
-			self.twotheta.append(2.*numpy.degrees(numpy.arcsin(dsPeak*self.wavelength/2.)))
+		self.wavelength = wavelength
+		self.twotheta = self.twothetaFromDs(self.ds)
+		if (self.fixedbins and (self.npeaks > 0)):
+			print ("Wavelength changed, two-theta histogram has been reset. Peaks need to be added again.")
+			self.hist[0][:] = 0
+			self.npeaks = 0
+			self.gvefile = ""
 	
 	"""
 	Generate an histograms for the number of bins
+	If bin edges are fixed, the histogram is already built and this does nothing
 	"""
 	def buildHistogram(self,nbins=10000):
+		if (self.fixedbins):
+			print ("Calculated a %d elements two-theta histograms based on peaks in %s" % (self.nbins,self.gvefile))
+			return
 		if (len(self.twotheta) == 0):
 			return
 		self.nbins = nbins
 		self.hist = numpy.histogram(self.twotheta,self.nbins)
+		self.set = True
 		print ("Calculated a %d elements two-theta histograms based on peaks in %s" % (self.nbins,self.gvefile))
 		
 	"""
 	Saves this histogram to a file
 	"""
 	def savetofile(self,output):
-		out = open(output,'w')
-		out.write ("# Histograms of two theta angles in %s\n" % self.gvefile)
-		out.write ("# Original number of peaks: %d\n" % self.npeaks)
-		out.write ("# Number of bins: %d\n" % self.nbins)
-		out.write ("# Two theta (degrees), proportion of peaks in bin\n#\n")
-		for i in range(0,self.nbins):
-			out.write ("%.4f %.4e\n" % (self.hist[1][i], (1.0*self.hist[0][i]/self.npeaks)))
-		out.close()
+		header = "# Histograms of two theta angles in %s\n" % self.gvefile
+		header += "# Original number of peaks: %d\n" % self.npeaks
+		header += "# Number of bins: %d\n" % self.nbins
+		header += "# Two theta (degrees), proportion of peaks in bin\n#"
+		data = numpy.column_stack((self.hist[1][0:self.nbins], 1.0*self.hist[0]/max(self.npeaks,1)))
+		numpy.savetxt(output, data, fmt=["%.4f", "%.4e"], header=header, comments="")
 		print ("Saved two theta histograms in %s" % (output))
 
 
@@ -141,10 +196,10 @@ def main(argv):
 	Main subroutine
 	"""
 	
-	parser = MyParser(usage='%(prog)s [options] g-vectors.gve', description="Tool to calculate a 2theta histogram based on experimental g-vectors in a GVE file.\nThis is part of the TIMEleSS project\nhttp://timeless.texture.rocks\n")
+	parser = MyParser(usage='%(prog)s [options] g-vectors.gve [g-vectors2.gve ...]', description="Tool to calculate a 2theta histogram based on experimental g-vectors in one or more GVE files.\nThis is part of the TIMEleSS project\nhttp://timeless.texture.rocks\n")
 	
 	# Positionnal arguments
-	parser.add_argument("gve", help="Name of GVE file")
+	parser.add_argument("gve", help="Name of GVE file(s). Peaks from all files are added to the same histogram", nargs='+')
 	
 	# Required arguments
 	parser.add_argument('-w', '--wavelength', required=True, help="Wavelength, in angstroms  (required)", type=float)
@@ -152,16 +207,27 @@ def main(argv):
 	
 	# Optional arguments
 	parser.add_argument('-n', '--nbins', required=False, help="Number of bins. Default is %(default)s",  type=int, default=1000)
+	parser.add_argument('-m', '--ttmin', required=False, help="Minimum 2theta for the histogram, in degrees. Must be set with ttmax. Bin edges are then fixed and GVE files are processed one at a time, without keeping peaks in memory. Default is %(default)s (from data)",  type=float, default=None)
+	parser.add_argument('-M', '--ttmax', required=False, help="Maximum 2theta for the histogram, in degrees. Only applies together with ttmin. Default is %(default)s (from data)",  type=float, default=None)
 
-	args = vars(parser.parse_args())	
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "2thetaHistFromGVE")
 
 	gve = args['gve']
 	output = args['output']
 	wavelength = args['wavelength']
 	nbins = args['nbins']
+	ttmin = args['ttmin']
+	ttmax = args['ttmax']
+	if ((ttmin == None) != (ttmax == None)):
+		parser.error("ttmin and ttmax should be set together")
 
 	histdata = twothetahistogram(wavelength)
-	histdata.setGVE(gve)
+	if ((ttmin != None) and (ttmax != None)):
+		histdata.setBinning(ttmin, ttmax, nbins)
+	for gvefile in gve:
+		histdata.addGVE(gvefile)
 	histdata.buildHistogram(nbins)
 	histdata.savetofile(output)
 
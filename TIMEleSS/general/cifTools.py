@@ -22,12 +22,13 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
-# Needs the PycifRW module
+# Needs the PycifRW module and xfab
+# They are slow to load and are imported in the functions which need them
 
-from xfab import tools,structure,sg
-from polyxsim import reflections
 import numpy
-from CifFile import ReadCif
+
+# Parsed cif files can be cached when running many commands
+from TIMEleSS.general import parserCache
 
 def open_cif(param,phase):
 	"""
@@ -46,6 +47,8 @@ def open_cif(param,phase):
 	Adapted from polyxsim.structure
 	Created: 12/2019, S. Merkel, Univ. Lille, France
 	"""
+	from CifFile import ReadCif
+	from xfab import structure,sg
 	file = param['structure_phase_%i' %phase]
 	cf = ReadCif(file) # Generate an error if reading cif fails which is not always true below
 	struct = structure.build_atomlist()
@@ -57,6 +60,7 @@ def open_cif(param,phase):
 	return struct
 
 
+@parserCache.cachedParser
 def build_B_from_Cif(ciffile):
 	"""
 	Builds a B-matrix based on information in a cif file
@@ -73,10 +77,12 @@ def build_B_from_Cif(ciffile):
 	param['structure_phase_0'] = ciffile
 	xtal_structure = open_cif(param,0)
 	unit_cell = param['unit_cell_phase_0']
+	from xfab import tools
 	B = tools.form_b_mat(unit_cell)
 	return B
 
 
+@parserCache.cachedParser
 def unit_cell_from_Cif(ciffile):
 	"""
 	Returns unit cell parameters and lattice centering (one of P,A,B,C,I,F) from a cif file
@@ -120,6 +126,7 @@ def gen_Miller_ds(param,phasenum):
 	Inspired from code in polyxsim.reflections, with the addition of ds in return value
 	Created: 12/2019, S. Merkel, Univ. Lille, France
 	"""
+	from xfab import tools
 	sintlmin = numpy.sin(numpy.radians(param['theta_min']))/param['wavelength']
 	sintlmax = numpy.sin(numpy.radians(param['theta_max']))/param['wavelength']
 	hkl  = tools.genhkl_all(param['unit_cell_phase_%i' % phasenum], \
@@ -152,6 +159,7 @@ def calc_intensity(hkl,struct,wavelength,normI=False):
 	Inspired from code in polyxsim.reflections, with the addition of Lorentz correction
 	Created: 12/2019, S. Merkel, Univ. Lille, France
 	"""
+	from xfab import structure
 	int = numpy.zeros((len(hkl),1))
 	for i in range(len(hkl)):
 		#check_input.interrupt(killfile)
@@ -171,6 +179,7 @@ def calc_intensity(hkl,struct,wavelength,normI=False):
 	return hkl
 
 
+@parserCache.cachedParser
 def peaksFromCIF(ciffile, ttheta_min,  ttheta_max, wavelength, minI = -1.0, normI = False):
 	"""
 	Calculate a list of reflections for single-crystal diffraction based on a cif file
@@ -205,6 +214,26 @@ def peaksFromCIF(ciffile, ttheta_min,  ttheta_max, wavelength, minI = -1.0, norm
 	# Reads structure from CIF file
 	xtal_structure = open_cif(param,0)
 	
+	return peaksFromStructure(param, xtal_structure, minI, normI)
+
+
+def peaksFromStructure(param, xtal_structure, minI = -1.0, normI = False):
+	"""
+	Calculate a list of reflections for single-crystal diffraction from a structure already read with open_cif
+	
+	Used by peaksFromCIF and by functions which also need the space group of the phase, so that the cif file 
+	is only read once
+	
+	Params:
+	- param: dictionnary with structure_phase_0, theta_min, theta_max, and wavelength, as in peaksFromCIF, completed by open_cif
+	- xtal_structure: structure returned by open_cif
+	- minI, normI: as in peaksFromCIF
+	
+	Returns:
+		an array of reflections, as in peaksFromCIF
+	"""
+	wavelength = param['wavelength']
+	
 	# Calculates list of reflection, ds and their intensities
 	hkls = gen_Miller_ds(param,0)
 	hkls = calc_intensity(hkls,xtal_structure, wavelength, normI) 
@@ -222,3 +251,115 @@ def peaksFromCIF(ciffile, ttheta_min,  ttheta_max, wavelength, minI = -1.0, norm
 		
 	return hkls
 	
+
+def laueRotations(sgname, cell_choice='standard'):
+	"""
+	Rotations of the Laue group of a space group, acting on hkl
+	
+	Parameter:
+	- sgname: space group name
+	- cell_choice: as in xfab.sg
+	
+	Returns
+	- an integer array of n matrices R such that R.hkl are all the reflections equivalent to hkl (Friedel pairs included)
+	
+	Symmetry operators act on fractional coordinates as x' = R.x. They act on hkl as h' = h.R, or R^T.h
+	"""
+	from xfab import sg
+	rot = numpy.asarray(sg.sg(sgname=sgname, cell_choice=cell_choice).rot, dtype=numpy.int64)
+	rot = numpy.concatenate((rot, -rot)).transpose(0,2,1)
+	# Centrosymmetric groups already include the inversion
+	return numpy.unique(rot, axis=0)
+
+
+def equivalentHKL(hkl, rotations):
+	"""
+	All reflections equivalent to a list of hkl
+	
+	Parameters:
+	- hkl: an integer array of hkl, with 3 columns
+	- rotations: array of rotations acting on hkl, from laueRotations
+	
+	Returns
+	- an integer array of len(hkl)*len(rotations) hkl. Line i*len(rotations)+j holds rotation j applied to hkl i
+	"""
+	hkl = numpy.asarray(hkl, dtype=numpy.int64).reshape(-1,3)
+	return numpy.einsum('rij,nj->nri', rotations, hkl).reshape(-1,3)
+
+
+def hklIndex(hkl, hklmin, shape):
+	"""
+	Position of hkl in a table built by hklIntensityTable
+	
+	Parameters:
+	- hkl: an integer array of hkl, with 3 columns
+	- hklmin, shape: lowest h, k, and l in the table and size of the table along h, k, and l
+	
+	Returns
+	- an array of positions in the flattened table, -1 for hkl outside of the table
+	"""
+	hkl = numpy.asarray(hkl, dtype=numpy.int64).reshape(-1,3) - hklmin
+	inside = numpy.all((hkl >= 0) & (hkl < shape), axis=1)
+	index = numpy.ravel_multi_index(tuple(numpy.where(inside[:,numpy.newaxis], hkl, 0).T), shape)
+	index[~inside] = -1
+	return index
+
+
+@parserCache.cachedParser
+def hklIntensityTable(ciffile, ttheta_min,  ttheta_max, wavelength, minI = -1.0, normI = False):
+	"""
+	Theoretical intensities for all reflections calculated from a cif file and their equivalents in the Laue group of the phase
+	
+	Reflections are stored in a flat array indexed by h, k, and l, so that intensities for many peaks can be 
+	looked up at once, without searching, with hklIntensity. Reflections missing from the list calculated 
+	by peaksFromCIF (e.g. a symmetry equivalent reported by the indexing software) get the intensity of 
+	their family. If the list holds an hkl more than once, the last one is used.
+	
+	Params are as in peaksFromCIF
+	
+	Returns
+	- [hklmin, shape, intensities] with 
+		- hklmin: lowest h, k, and l in the table
+		- shape: size of the table along h, k, and l
+		- intensities: intensities as a flat array, NaN for reflections that are not in the table
+	"""
+	param = {} 
+	param['structure_phase_0'] = ciffile
+	param['theta_min'] = ttheta_min/2.
+	param['theta_max'] = ttheta_max/2.
+	param['wavelength'] = wavelength
+	# The cif file is read once, for the reflections and for the space group
+	xtal_structure = open_cif(param,0)
+	hkls = numpy.asarray(peaksFromStructure(param, xtal_structure, minI, normI), dtype=float).reshape(-1,6)
+	rotations = laueRotations(param['sgname_phase_0'], param['cell_choice_phase_0'])
+	hkl = numpy.rint(hkls[:,0:3]).astype(numpy.int64)
+	equivalents = equivalentHKL(hkl, rotations)
+	intensity = numpy.repeat(hkls[:,4], len(rotations))
+	allhkl = numpy.concatenate((equivalents, hkl))
+	hklmin = allhkl.min(axis=0, initial=0)
+	shape = allhkl.max(axis=0, initial=0) - hklmin + 1
+	# Families first, then the reflections from the list itself. The last value for each hkl is kept
+	index = hklIndex(allhkl, hklmin, shape)[::-1]
+	intensity = numpy.concatenate((intensity, hkls[:,4]))[::-1]
+	[index, last] = numpy.unique(index, return_index=True)
+	table = numpy.full(int(numpy.prod(shape)), numpy.nan)
+	table[index] = intensity[last]
+	return [hklmin, shape, table]
+
+
+def hklIntensity(table, hkl):
+	"""
+	Looks up theoretical intensities for a list of hkl
+	
+	Parameters:
+	- table: [hklmin, shape, intensities] built by hklIntensityTable
+	- hkl: an integer array of hkl, with 3 columns
+	
+	Returns
+	- an array of intensities, NaN for hkl which are not in the table
+	"""
+	[hklmin, shape, intensities] = table
+	index = hklIndex(hkl, hklmin, shape)
+	intensity = numpy.full(len(index), numpy.nan)
+	intensity[index >= 0] = intensities[index[index >= 0]]
+	return intensity
@@ -26,9 +26,12 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 # Import libraries for mathematical operations
 import numpy
-import scipy
-import scipy.linalg
-import math
+import functools
+
+# Conversions between U matrices and Euler angles
+from TIMEleSS.general import orientation
+# Peak objects
+from TIMEleSS.general import indexedPeak3DXRD
 
 
 """
@@ -51,10 +54,13 @@ class Grain:
 		self.eulerangles_Phi = 0				# Euler angle 2 (Bunge convention)
 		self.eulerangles_phi2 = 0				# Euler angle 3 (Bunge convention)
 		self.NumbPeaks = 0						# Number of peaks
-		self.peaks = []							# Will hold a list of peaks
+		self.position = [0., 0., 0.]			# Center of mass position
+		self.peaks = []							# Will hold a list of peaks (or a function creating it, see getPeaks)
+		self.peakTable = None					# Peaks as rows of a table (see setPeakTable), None if peaks were set as a list
 		self.filename = ""						# File from which the grain was read
 		self.indexInFile = 0					# Grain number in the file
-		self.grainSpotterTxt = ""				# Full text from GrainSpotter log file
+		self.grainSpotterTxt = ""				# Full text from GrainSpotter log file (or a function creating it), only if requested
+		self.grainSpotterInfo = None			# Indexing information from GrainSpotter (see setGrainSpotterInfo)
 		
 	def setFileName(self,name):
 		self.filename = name
@@ -86,6 +92,10 @@ class Grain:
 		self.U = U
 		self.B = B
 		self.UBi = UBi
+	def setPosition(self,x,y,z):
+		self.position = [x,y,z]
+	def getPosition(self):
+		return self.position
 	def setEulerAngles(self,phi1,Phi,phi2):
 		self.eulerangles_phi1 = phi1
 		self.eulerangles_Phi = Phi
@@ -93,43 +103,57 @@ class Grain:
 	def geteulerangles(self):
 		return [self.eulerangles_phi1,self.eulerangles_Phi,self.eulerangles_phi2]
 	
+	# Peaks can be set as a list, or as a function returning the list, called the first time peaks are needed
 	def setPeaks(self,peaks):
 		self.peaks = peaks
+		self.peakTable = None
 		
 	def getPeaks(self):
+		if callable(self.peaks):
+			self.peaks = self.peaks()
 		return self.peaks
 	
+	# Peaks can also be set as rows of a table built by multigrainOutputParser.indexedPeaksTable (used for grains
+	# read from GrainSpotter logs and sidecar files). Peak objects are only created when getPeaks is called, and 
+	# indexedPeaksTable uses the rows directly
+	def setPeakTable(self,table):
+		self.peakTable = table
+		self.peaks = functools.partial(indexedPeak3DXRD.peaksFromTable, table)
+	def getPeakTable(self):
+		return self.peakTable
+	
 	def getMinTwoTheta(self):
-		return min([o.tthetameasured for o in self.peaks])
+		return min([o.tthetameasured for o in self.getPeaks()])
 	
 	def getMaxTwoTheta(self):
-		return max([o.tthetameasured for o in self.peaks])
+		return max([o.tthetameasured for o in self.getPeaks()])
 	
 	def getPeaksGVEID(self):
 		peaklist = []
-		for peak in self.peaks:
+		for peak in self.getPeaks():
 			peaklist.append(peak.getGVEID())
 		return peaklist
 	
+	# Same as peaks, can be a list of lines or a function returning it
 	def setGrainSpotterTxt(self,txt):
 		self.grainSpotterTxt = txt
 	def getGrainSpotterTxt(self):
+		if callable(self.grainSpotterTxt):
+			self.grainSpotterTxt = self.grainSpotterTxt()
 		return self.grainSpotterTxt
 	
+	# Indexing information from a GrainSpotter log, as [expected gvectors, measured gvectors, measured once, measured more than once, mean_IA, pos_chisq]
+	# None if the grain was not read from a GrainSpotter log
+	def setGrainSpotterInfo(self,info):
+		self.grainSpotterInfo = info
+	def getGrainSpotterInfo(self):
+		return self.grainSpotterInfo
+	
+	# Euler angles (Bunge convention, as in GrainSpotter), calculated from U
 	def EulerAnglesFromU(self):
-		phiRad = numpy.arccos(self.U[2,2])
-		phi1Rad = -numpy.arctan2(self.U[0,2]/numpy.sin(phiRad) , self.U[1,2]/numpy.sin(phiRad)) 
-		#phi1Rad = -numpy.arctan2(self.Grainspotter_U[1,2]/sin(phiRad) , self.Grainspotter_U[0,2]/sin(phiRad)) 
-		phi2Rad = numpy.arctan2(self.U[2,0]/numpy.sin(phiRad) , self.U[2,1]/numpy.sin(phiRad))
-		#phi2Rad = numpy.arctan2( self.Grainspotter_U[2,1]/sin(phiRad) , self.Grainspotter_U[2,0]/sin(phiRad))
-		phi = math.degrees(phiRad)
-		phi1 = math.degrees(phi1Rad)
-		phi2 = math.degrees(phi2Rad)
-		return [phi1, phi, phi2]
+		return orientation.eulerFromU(self.U)[0].tolist()
 	
 	def setEulerAnglesFromU(self):
 		eulers = self.EulerAnglesFromU()
-		self.phi1 = eulers[0]
-		self.Phi = eulers[1]
-		self.phi2 = eulers[2]
+		self.setEulerAngles(eulers[0], eulers[1], eulers[2])
 		
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+This is part of the TIMEleSS tools
+http://timeless.texture.rocks/
+
+Copyright (C) S. Merkel, Universite de Lille, France
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+"""
+Binary sidecar files for parsed grains (GrainSpotter logs, gff, and ubi files)
+
+Parsing a large GrainSpotter log takes time. Once parsed, grains can be saved in a sidecar file,
+next to the original one (grains.log -> grains.log.timeless.npz), holding U, B, UBI, Euler angles, positions, indexed
+peaks, GrainSpotter indexing information, and the compressed GrainSpotter text (if it was kept) as numpy arrays.
+Next time, grains are read from the sidecar.
+
+The sidecar is only used if the original file has the same size, modification time, and content hash. The
+hash is calculated on the beginning, end, and evenly spaced blocks of the file, so that it remains fast for
+very large files.
+
+Peaks and GrainSpotter text are only converted back into python objects when a grain needs them. Tools which
+only use orientations do not pay for the peaks.
+
+Sidecars are disabled by default. They are enabled by setting the environment variable TIMELESS_SIDECAR
+to 1, by calling enableSidecars(), or with "timeless serve --sidecar".
+"""
+
+# System functions
+import os
+import zlib
+import hashlib
+import functools
+
+# Mathematical stuff (for data array)
+import numpy
+
+# Specific TIMEleSS code
+from TIMEleSS.general import grain3DXRD
+
+# Sidecars are used if True
+enabled = (os.environ.get("TIMELESS_SIDECAR", "") not in ["", "0"])
+# Format of sidecar files, increase if the content changes
+sidecarversion = 4
+# Extension added to the original file name
+sidecarextension = ".timeless.npz"
+# Blocks used for the content hash
+hashblocksize = 65536
+hashnblocks = 32
+
+"""
+Enables sidecar files
+"""
+def enableSidecars():
+	global enabled
+	enabled = True
+
+"""
+Disables sidecar files (existing sidecars are ignored, new ones are not created)
+"""
+def disableSidecars():
+	global enabled
+	enabled = False
+
+"""
+Returns the name of the sidecar file for a grain file
+"""
+def sidecarName(fname):
+	return fname + sidecarextension
+
+"""
+Content hash of a file, based on its beginning, its end, and evenly spaced blocks
+
+Files smaller than hashnblocks*hashblocksize are hashed in full.
+
+Returns the hash, as an hexadecimal string
+"""
+def sampledHash(fname):
+	size = os.path.getsize(fname)
+	h = hashlib.blake2b(digest_size=16)
+	h.update(str(size).encode())
+	f = open(fname, 'rb')
+	if (size <= hashnblocks*hashblocksize):
+		h.update(f.read())
+	else:
+		for start in numpy.linspace(0, size-hashblocksize, hashnblocks).astype(numpy.int64):
+			f.seek(int(start))
+			h.update(f.read(hashblocksize))
+	f.close()
+	return h.hexdigest()
+
+"""
+Information used to check that a sidecar matches the original file
+
+Parameters:
+- fname: original file
+- arguments: other arguments sent to the parser, as a string
+
+Returns a dictionnary with size, mtime, hash, arguments, and version
+"""
+def sourceInfo(fname, arguments):
+	stat = os.stat(fname)
+	return {'version': sidecarversion, 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': sampledHash(fname), 'arguments': arguments}
+
+#################################################################
+#
+# Saving and loading
+#
+#################################################################
+
+"""
+Saves grains in a sidecar file
+
+Parameters:
+- fname: original file name. The sidecar will be saved next to it
+- grains: list of grains parsed from fname
+- arguments: other arguments sent to the parser, as a string
+
+Returns True if the sidecar could be saved
+"""
+def saveSidecar(fname, grains, arguments=""):
+	# Imported here, multigrainOutputParser uses this module
+	from TIMEleSS.general import multigrainOutputParser
+	ngrains = len(grains)
+	info = sourceInfo(fname, arguments)
+	[peaks, offsets] = multigrainOutputParser.indexedPeaksTable(grains)
+	# GrainSpotter text, as one compressed utf-8 buffer, with the limits for each grain in the uncompressed buffer
+	texts = [grain.getGrainSpotterTxt() for grain in grains]
+	hastext = all(isinstance(txt, list) for txt in texts)
+	# GrainSpotter indexing information, NaN for grains which do not have it
+	gsinfo = numpy.full((ngrains,6), numpy.nan)
+	for i in range(0,ngrains):
+		if (grains[i].getGrainSpotterInfo() is not None):
+			gsinfo[i] = grains[i].getGrainSpotterInfo()
+	textoffsets = numpy.zeros(ngrains+1, dtype=numpy.int64)
+	if (hastext):
+		encoded = [("\n".join(txt)).encode('utf-8') for txt in texts]
+		textoffsets[1:] = numpy.cumsum([len(txt) for txt in encoded])
+		text = numpy.frombuffer(zlib.compress(b"".join(encoded), 1), dtype=numpy.uint8)
+	else:
+		text = numpy.zeros(0, dtype=numpy.uint8)
+	data = {
+		'version': numpy.array(info['version']),
+		'size': numpy.array(info['size']),
+		'mtime': numpy.array(info['mtime']),
+		'hash': numpy.array(info['hash']),
+		'arguments': numpy.array(info['arguments']),
+		'index': numpy.array([grain.getIndexInFile() for grain in grains], dtype=numpy.int64),
+		'npeaks': numpy.array([grain.getNPeaks() for grain in grains], dtype=numpy.int64),
+		'U': numpy.array([grain.getU() for grain in grains], dtype=float).reshape(ngrains,3,3),
+		'B': numpy.array([grain.getB() for grain in grains], dtype=float).reshape(ngrains,3,3),
+		'UBI': numpy.array([grain.getUBi() for grain in grains], dtype=float).reshape(ngrains,3,3),
+		'euler': numpy.array([grain.geteulerangles() for grain in grains], dtype=float).reshape(ngrains,3),
+		'position': numpy.array([grain.getPosition() for grain in grains], dtype=float).reshape(ngrains,3),
+		'gsinfo': gsinfo,
+		'peaks': peaks,
+		'peakoffsets': offsets,
+		'hastext': numpy.array(hastext),
+		'text': text,
+		'textoffsets': textoffsets,
+	}
+	# Write in a temporary file and rename, so that other processes never see a partial sidecar
+	name = sidecarName(fname)
+	tmpname = "%s.%d.tmp" % (name, os.getpid())
+	try:
+		f = open(tmpname, 'wb')
+		numpy.savez(f, **data)
+		f.close()
+		os.replace(tmpname, name)
+	except OSError:
+		# Read-only directory, full disk... We just do not have a sidecar
+		if os.path.exists(tmpname):
+			os.remove(tmpname)
+		return False
+	return True
+
+"""
+Loads grains from a sidecar file, if it exists and matches the original file
+
+Parameters:
+- fname: original file name
+- arguments: other arguments sent to the parser, as a string
+
+Returns a list of grains, or None if there is no valid sidecar
+"""
+def loadSidecar(fname, arguments=""):
+	name = sidecarName(fname)
+	if (not os.path.isfile(name)):
+		return None
+	try:
+		with numpy.load(name) as data:
+			stat = os.stat(fname)
+			if ((int(data['version']) != sidecarversion) or (int(data['size']) != stat.st_size) or (int(data['mtime']) != stat.st_mtime_ns) or (str(data['arguments']) != arguments)):
+				return None
+			if (str(data['hash']) != sampledHash(fname)):
+				return None
+			index = data['index']
+			npeaks = data['npeaks']
+			U = data['U']
+			B = data['B']
+			UBI = data['UBI']
+			euler = data['euler'].tolist()
+			position = data['position'].tolist()
+			gsinfo = data['gsinfo']
+			peaks = data['peaks']
+			offsets = data['peakoffsets']
+			hastext = bool(data['hastext'])
+	except Exception:
+		# Truncated, corrupted, or old sidecar... We will parse the original file
+		return None
+	text = sidecarText(name)
+	grains = []
+	for i in range(0,len(index)):
+		grain = grain3DXRD.Grain()
+		grain.setFileName(fname)
+		grain.setFileIndex(int(index[i]))
+		grain.setNPeaks(int(npeaks[i]))
+		grain.setUBBi(U[i], B[i], UBI[i])
+		grain.setEulerAngles(euler[i][0], euler[i][1], euler[i][2])
+		grain.setPosition(position[i][0], position[i][1], position[i][2])
+		if (not numpy.isnan(gsinfo[i,0])):
+			grain.setGrainSpotterInfo([int(n) for n in gsinfo[i,0:4]] + gsinfo[i,4:6].tolist())
+		if (offsets[i+1] > offsets[i]):
+			grain.setPeakTable(peaks[offsets[i]:offsets[i+1]])
+		if (hastext):
+			grain.setGrainSpotterTxt(functools.partial(text.lines, i))
+		grains.append(grain)
+	return grains
+
+class sidecarText:
+	"""
+	GrainSpotter text stored in a sidecar, read from the file the first time a grain needs it
+	"""
+	def __init__(self, fname):
+		self.fname = fname
+		self.text = None
+		self.offsets = None
+
+	def lines(self, i):
+		if (self.text is None):
+			with numpy.load(self.fname) as data:
+				self.text = zlib.decompress(data['text'].tobytes())
+				self.offsets = data['textoffsets']
+		txt = self.text[self.offsets[i]:self.offsets[i+1]].decode('utf-8')
+		if (txt == ""):
+			return []
+		return txt.split("\n")
+
+"""
+Decorator for functions parsing grain files. The file name should be the first argument of the function.
+
+If sidecars are enabled, grains are loaded from the sidecar when it is valid. Otherwise, the file is parsed
+and a new sidecar is saved.
+"""
+def sidecarParser(function):
+	@functools.wraps(function)
+	def wrapper(fname, *args, **kwargs):
+		if ((not enabled) or (not isinstance(fname, str)) or (not os.path.isfile(fname))):
+			return function(fname, *args, **kwargs)
+		arguments = "%s %s %s" % (function.__name__, repr(args), repr(sorted(kwargs.items())))
+		grains = loadSidecar(fname, arguments)
+		if (grains is not None):
+			return grains
+		grains = function(fname, *args, **kwargs)
+		saveSidecar(fname, grains, arguments)
+		return grains
+	return wrapper
@@ -26,8 +26,6 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 # Import libraries for mathematical operations
 import numpy
-import scipy
-import scipy.linalg
 import math
 
 
@@ -60,6 +58,15 @@ class indexedPeak:
 		self.dh = 0.0
 		self.dk = 0.0
 		self.dl = 0.0
+		# Predicted hkl, differences between measured and predicted angles, and internal angle, as in GrainSpotter logs
+		# NaN if unknown
+		self.hpred = numpy.nan
+		self.kpred = numpy.nan
+		self.lpred = numpy.nan
+		self.dttheta = numpy.nan
+		self.domega = numpy.nan
+		self.deta = numpy.nan
+		self.ia = numpy.nan
 	
 	def setNum(self,n):
 		self.num = n
@@ -112,4 +119,58 @@ class indexedPeak:
 	def getHKL(self):
 		return [self.h, self.k, self.l]
 	
+	def setHKLPred(self,h,k,l):
+		self.hpred = h
+		self.kpred = k
+		self.lpred = l
+	
+	def getHKLPred(self):
+		return [self.hpred, self.kpred, self.lpred]
+	
+	def setDHKL(self,dh,dk,dl):
+		self.dh = dh
+		self.dk = dk
+		self.dl = dl
+	
+	def getDHKL(self):
+		return [self.dh, self.dk, self.dl]
+	
+	def setDeltaAngles(self,dttheta,domega,deta):
+		self.dttheta = dttheta
+		self.domega = domega
+		self.deta = deta
+	
+	def getDeltaAngles(self):
+		return [self.dttheta, self.domega, self.deta]
+	
+	def setIA(self,ia):
+		self.ia = ia
+	def getIA(self):
+		return self.ia
+	
 		
+
+
+"""
+Creates indexed peak objects from rows of a table built by multigrainOutputParser.indexedPeaksTable
+"""
+def peaksFromTable(table):
+	peakList = []
+	for [g, num, gveid, peakid, h, k, l, tthmeas, tthpred, omegameas, omegapred, etameas, etapred, hpred, kpred, lpred, dh, dk, dl, dtth, domega, deta, ia] in table.tolist():
+		thispeak = indexedPeak()
+		thispeak.setNum(num)
+		thispeak.setGVEID(gveid)
+		thispeak.setPeakID(peakid)
+		thispeak.setHKL(h, k, l)
+		thispeak.setTThetaMeasured(tthmeas)
+		thispeak.setTThetaPred(tthpred)
+		thispeak.setOmegaMeasured(omegameas)
+		thispeak.setOmegaPred(omegapred)
+		thispeak.setEtaMeasured(etameas)
+		thispeak.setEtaPred(etapred)
+		thispeak.setHKLPred(hpred, kpred, lpred)
+		thispeak.setDHKL(dh, dk, dl)
+		thispeak.setDeltaAngles(dtth, domega, deta)
+		thispeak.setIA(ia)
+		peakList.append(thispeak)
+	return peakList
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+This is part of the TIMEleSS tools
+http://timeless.texture.rocks/
+
+Copyright (C) S. Merkel, Universite de Lille, France
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+"""
+Driver for iterative multigrain indexing
+
+The usual workflow alternates GrainSpotter runs with timelessClearGVEGrains or timelessRemoveUsedGVE,
+which parse and rewrite the full g-vector file at each iteration. Here, the g-vector file is parsed once,
+and g-vectors which are still unassigned are tracked with a mask:
+	loop = indexingLoop.indexingLoop("peaks.gve")
+	loop.saveGVE("peaks-1.gve")
+	# run GrainSpotter on peaks-1.gve, creates grains-1.log
+	loop.applyLog("grains-1.log")
+	loop.saveGVE("peaks-2.gve")
+	# run GrainSpotter on peaks-2.gve, creates grains-2.log
+	loop.applyLog("grains-2.log")
+	...
+	loop.printStatistics()
+
+Applying a log only costs the peaks of the new grains. G-vector files are written from preformatted lines,
+in the same format as saveGVE.
+"""
+
+# Mathematical stuff (for data array)
+import numpy
+
+# Specific TIMEleSS code
+from TIMEleSS.general import multigrainOutputParser
+
+class indexingLoop:
+
+	def __init__(self, gvefile):
+		[self.peaks, self.lines, self.header] = multigrainOutputParser.parseGVELines(gvefile)
+		self.gvefile = gvefile				# Original g-vector file
+		self.order = numpy.argsort(self.peaks['spot3d_id'], kind='stable')	# Rows of g-vectors, sorted by ID
+		self.sortedid = self.peaks['spot3d_id'][self.order]				# IDs of g-vectors, sorted
+		self.unassigned = numpy.ones(len(self.peaks), dtype=bool)			# G-vectors which have not been assigned to a grain
+		self.nunassigned = len(self.peaks)	# Number of unassigned g-vectors
+		self.iteration = 0					# Number of logs applied so far
+		self.ngrains = 0					# Total number of grains
+		# Statistics for each iteration, as [iteration, name, grains, indexed peaks, newly assigned g-vectors, already assigned, not in gve file, unassigned]
+		self.statistics = []
+
+	"""
+	Rows in the g-vector table for a list of g-vector IDs
+
+	Returns
+	- rows: position of each ID in the table, -1 if the ID is not in the g-vector file
+	"""
+	def rows(self, ids):
+		return multigrainOutputParser.rowsForIDs(self.sortedid, self.order, ids)
+
+	"""
+	Marks g-vectors indexed in a list of grains as assigned
+
+	Parameters
+	- grains: list of grains, e.g. from a GrainSpotter log
+	- name: name of the iteration, for the statistics
+
+	Returns
+	- the number of g-vectors which were assigned in this iteration
+	"""
+	def applyGrains(self, grains, name=""):
+		[peaks, offsets] = multigrainOutputParser.indexedPeaksTable(grains)
+		# Sometimes, GrainSpotter indexes the same peak twice
+		ids = numpy.unique(peaks['peakid'])
+		rows = self.rows(ids)
+		missing = numpy.count_nonzero(rows < 0)
+		rows = rows[rows >= 0]
+		new = rows[self.unassigned[rows]]
+		self.unassigned[new] = False
+		self.nunassigned -= len(new)
+		self.iteration += 1
+		self.ngrains += len(grains)
+		self.statistics.append([self.iteration, name, len(grains), len(peaks), len(new), len(rows)-len(new), missing, self.nunassigned])
+		if (missing > 0):
+			print ("Warning: %d peaks indexed in %s are not in %s" % (missing, name, self.gvefile))
+		return len(new)
+
+	"""
+	Marks g-vectors indexed in a GrainSpotter log as assigned
+
+	Parameters
+	- logfile: GrainSpotter log
+	- stoponerror: as in multigrainOutputParser.parse_GrainSpotter_log
+
+	Returns
+	- the number of g-vectors which were assigned in this iteration
+	"""
+	def applyLog(self, logfile, stoponerror=True):
+		grains = multigrainOutputParser.parse_GrainSpotter_log(logfile, stoponerror)
+		print ("Parsed grains from %s" % logfile)
+		print ("Number of grains: %d" % len(grains))
+		return self.applyGrains(grains, logfile)
+
+	"""
+	Saves the g-vectors which are still unassigned, for the next indexing run
+	"""
+	def saveGVE(self, fname):
+		f = open(fname, 'w')
+		f.write(self.header + "".join(self.lines[self.unassigned]))
+		f.close()
+		print ("Saved list of %i g-vectors into %s" % (self.nunassigned, fname))
+
+	"""
+	Saves the g-vectors which have been assigned to grains
+	"""
+	def saveAssignedGVE(self, fname):
+		f = open(fname, 'w')
+		f.write(self.header + "".join(self.lines[~self.unassigned]))
+		f.close()
+		print ("Saved list of %i g-vectors into %s" % (len(self.peaks)-self.nunassigned, fname))
+
+	"""
+	Returns the IDs of g-vectors which are still unassigned, sorted
+	"""
+	def unassignedIDs(self):
+		return self.sortedid[self.unassigned[self.order]]
+
+	"""
+	Returns the IDs of g-vectors which have been assigned to grains, sorted
+	"""
+	def assignedIDs(self):
+		return self.sortedid[~self.unassigned[self.order]]
+
+	"""
+	Returns the fraction of g-vectors assigned to grains
+	"""
+	def getIndexedFraction(self):
+		if (len(self.peaks) == 0):
+			return 0.
+		return 1.-float(self.nunassigned)/len(self.peaks)
+
+	"""
+	Prints cumulative statistics, one line per iteration
+	"""
+	def printStatistics(self):
+		print ("\nIndexing statistics for %s, %d g-vectors" % (self.gvefile, len(self.peaks)))
+		print ("%5s %8s %10s %10s %10s %10s %12s  %s" % ("Iter", "Grains", "Indexed", "New", "Doubles", "Missing", "Unassigned", "Name"))
+		for [iteration, name, ngrains, npeaks, nnew, ndoubles, nmissing, nunassigned] in self.statistics:
+			print ("%5d %8d %10d %10d %10d %10d %12d  %s" % (iteration, ngrains, npeaks, nnew, ndoubles, nmissing, nunassigned, name))
+		print ("Total: %d grains, %d g-vectors assigned (%.1f%%), %d unassigned" % (self.ngrains, len(self.peaks)-self.nunassigned, 100.*self.getIndexedFraction(), self.nunassigned))
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+This is part of the TIMEleSS tools
+http://timeless.texture.rocks/
+
+Copyright (C) S. Merkel, Universite de Lille, France
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+"""
+Profiling and timing instrumentation, shared by all TIMEleSS tools
+
+Each tool adds the options to its argument parser and starts the instrumentation once arguments are parsed:
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "GrainSpotterMerge")
+and marks its main stages with
+	with instrumentation.stage("parse"):
+		...
+
+Options are
+- --profile file.prof: runs the tool under cProfile, saves the statistics in file.prof, and prints the slowest functions
+- --timings: prints wall time, CPU time, and peak memory (RSS) for each stage
+- --timings-log file.jsonl: appends the timings to file.jsonl, as one JSON line per run
+
+Summaries are printed when the tool exits (or after each command, in "timeless serve" mode). Stages can be
+entered many times (e.g. once per image); times are summed. When no option is set, stages cost nothing.
+"""
+
+# System functions
+import sys
+import os
+import time
+import json
+import atexit
+import collections
+import contextlib
+
+# Resident memory is not available on Windows
+try:
+	import resource
+except ImportError:
+	resource = None
+
+# True if timings are recorded
+enabled = False
+# Timings for each stage, name: [number of calls, wall time, cpu time, peak RSS in Mb]
+stages = collections.OrderedDict()
+# Name of the current tool, start times, profiler, options
+tool = None
+starttime = None
+startcpu = None
+profiler = None
+options = {}
+registered = False
+# Returned by stage() when timings are disabled
+nostage = contextlib.nullcontext()
+
+"""
+Adds the --profile, --timings, and --timings-log options to an argument parser
+"""
+def addArguments(parser):
+	group = parser.add_argument_group('Instrumentation')
+	group.add_argument('--profile', required=False, help="Run under the python profiler and save the statistics in this file (can be read with python -m pstats). Default is %(default)s", default=None)
+	group.add_argument('--timings', required=False, action='store_true', help="Print wall time, CPU time, and memory for each stage of the calculation")
+	group.add_argument('--timings-log', dest='timings_log', required=False, help="Append timings to this file, as JSON lines. Default is %(default)s", default=None)
+
+"""
+Returns the peak resident memory of the process, in Mb, or None if not available
+"""
+def peakMemory():
+	if (resource is None):
+		return None
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# ru_maxrss is in bytes on MacOS, kilobytes on linux
+	if (sys.platform == 'darwin'):
+		return rss/1048576.
+	return rss/1024.
+
+"""
+Starts the instrumentation of a tool
+
+Parameters:
+- args: dictionnary of parsed arguments, with profile, timings, and timings_log
+- name: name of the tool, for the summary and log file
+"""
+def start(args, name):
+	global enabled, tool, starttime, startcpu, profiler, options, registered
+	options = {'profile': args.get('profile'), 'timings': args.get('timings', False), 'timings_log': args.get('timings_log')}
+	if ((options['profile'] is None) and (not options['timings']) and (options['timings_log'] is None)):
+		return
+	tool = name
+	enabled = True
+	stages.clear()
+	if (not registered):
+		atexit.register(finish)
+		registered = True
+	if (options['profile'] is not None):
+		import cProfile
+		profiler = cProfile.Profile()
+		profiler.enable()
+	starttime = time.perf_counter()
+	startcpu = time.process_time()
+
+"""
+Context manager to time one stage of a calculation
+
+Parameters:
+- name: name of the stage
+"""
+def stage(name):
+	if (not enabled):
+		return nostage
+	return timedStage(name)
+
+@contextlib.contextmanager
+def timedStage(name):
+	wall = time.perf_counter()
+	cpu = time.process_time()
+	try:
+		yield
+	finally:
+		wall = time.perf_counter() - wall
+		cpu = time.process_time() - cpu
+		if (name not in stages):
+			stages[name] = [0, 0., 0., None]
+		stages[name][0] += 1
+		stages[name][1] += wall
+		stages[name][2] += cpu
+		stages[name][3] = peakMemory()
+
+"""
+Stops the instrumentation, prints the summary, saves the profile and log. Does nothing if the instrumentation was not started.
+"""
+def finish():
+	global enabled, profiler, tool
+	if (tool is None):
+		return
+	wall = time.perf_counter() - starttime
+	cpu = time.process_time() - startcpu
+	if (profiler is not None):
+		profiler.disable()
+		profiler.dump_stats(options['profile'])
+		printProfile(profiler)
+		print ("Profile saved in %s" % options['profile'])
+		profiler = None
+	if (options['timings']):
+		printTimings(wall, cpu)
+	if (options['timings_log'] is not None):
+		appendLog(options['timings_log'], wall, cpu)
+	enabled = False
+	tool = None
+
+"""
+Prints the 20 functions with the largest cumulative time
+"""
+def printProfile(profiler):
+	import pstats
+	print ("\nProfile for %s" % tool)
+	stats = pstats.Stats(profiler, stream=sys.stdout)
+	stats.sort_stats('cumulative').print_stats(20)
+
+"""
+Prints timings for each stage
+"""
+def printTimings(wall, cpu):
+	print ("\nTimings for %s" % tool)
+	print ("%-25s %8s %12s %12s %14s" % ("Stage", "Calls", "Wall (s)", "CPU (s)", "Peak RSS (Mb)"))
+	for name in stages:
+		[n, stagewall, stagecpu, rss] = stages[name]
+		print ("%-25s %8d %12.3f %12.3f %14s" % (name, n, stagewall, stagecpu, "-" if (rss is None) else "%.1f" % rss))
+	rss = peakMemory()
+	print ("%-25s %8s %12.3f %12.3f %14s" % ("Total", "", wall, cpu, "-" if (rss is None) else "%.1f" % rss))
+
+"""
+Appends timings to a JSON lines file
+"""
+def appendLog(fname, wall, cpu):
+	entry = collections.OrderedDict()
+	entry['tool'] = tool
+	entry['date'] = time.strftime("%Y-%m-%d %H:%M:%S")
+	entry['cwd'] = os.getcwd()
+	entry['wall'] = wall
+	entry['cpu'] = cpu
+	entry['peak_rss_mb'] = peakMemory()
+	entry['stages'] = [{'stage': name, 'calls': stages[name][0], 'wall': stages[name][1], 'cpu': stages[name][2], 'peak_rss_mb': stages[name][3]} for name in stages]
+	f = open(fname, 'a')
+	f.write(json.dumps(entry) + "\n")
+	f.close()
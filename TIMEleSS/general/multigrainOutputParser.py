@@ -33,18 +33,18 @@ import sys
 
 # Mathematical stuff (for data array)
 import numpy
-import scipy
-import scipy.linalg
 
 # OS and file names
 import os
 
 # Specific TIMEleSS code
 from TIMEleSS.general import grain3DXRD
-from TIMEleSS.general import indexedPeak3DXRD
+from TIMEleSS.general import parserCache
+from TIMEleSS.general import grainSidecar
+from TIMEleSS.general import orientation
 
-# Import indexing from ImageD11, has stuff to go from UBi to U, etc
-import ImageD11.indexing
+# ImageD11.indexing has stuff to go from UBi to U, etc
+# It is slow to load and only imported in parse_ubi, when needed
 
 ############################################################################################# 
 
@@ -61,6 +61,9 @@ Returns
 Parameters
 	filename: name and path to the gff or the GrainSpotter log file
 	stoponerror: set to false if you do not want to stop on errors (0 peaks in a grain for grainspotter, for instance)
+
+If sidecars are enabled (see grainSidecar.py), parsed grains are saved in a binary file next to the original
+one, and loaded from there as long as the original file does not change.
 """
 
 def parseGrains(filename,stoponerror=True):
@@ -88,8 +91,12 @@ Returns
 Parameters
 	logfile: name and path to GrainSpotter log file
 	stoponerror: set to false if you do not want to stop on errors (0 peaks in a grain for grainspotter, for instance)
+	keeptext: set to true to keep the original text of each grain (see getGrainSpotterTxt). Not needed to save 
+	   grains with saveGrainSpotter, which regenerates the text.
 """
-def parse_GrainSpotter_log(logfile,stoponerror=True):
+@parserCache.cachedParser
+@grainSidecar.sidecarParser
+def parse_GrainSpotter_log(logfile,stoponerror=True,keeptext=False):
 	# Read LOG file
 	f = open(logfile, 'r')
 	# reads number of grains found
@@ -105,6 +112,9 @@ def parse_GrainSpotter_log(logfile,stoponerror=True):
 	logpeakid = []
 	# Parsing data for each grain and putting them in a f list
 	grainList = []
+	# Lines with peak information, and number of peaks for each grain
+	peaklines = []
+	npeaks = []
 
 	# looks for the word "grain" in the file by scaning each line (starting from line 20 see above) and its corresponding line number
 	i=0
@@ -142,6 +152,11 @@ def parse_GrainSpotter_log(logfile,stoponerror=True):
 		grain.setFileName(logfile)
 		grain.setNPeaks(numbpeaks)
 		grain.setFileIndex(int(GrainNum))
+		# Extracting grain position (mean_IA position_x position_y position_z pos_chisq)
+		counts = logcontent[lineindex+1].split()
+		line = logcontent[lineindex+2].split()
+		grain.setPosition(float(line[1]), float(line[2]), float(line[3]))
+		grain.setGrainSpotterInfo([int(counts[0]), int(counts[1]), int(counts[2]), int(counts[3]), float(line[0]), float(line[4])])
 		# Extracting U matrix
 		U = numpy.empty([3,3])
 		line1 = logcontent[lineindex+3].split()
@@ -162,50 +177,56 @@ def parse_GrainSpotter_log(logfile,stoponerror=True):
 			UBI[2,i] = float(line3[i])
 		#print ("UBI = ", UBI)
 		#print ("BI = ", numpy.dot(UBI,U))
-		B =scipy.linalg.inv(numpy.dot(UBI,U))
+		B =numpy.linalg.inv(numpy.dot(UBI,U))
 		#print ("B = ", B)
 		# Setting information
 		grain.setUBBi(U,B,UBI)
 		# extracting the Euler angles phi1 phi phi2
 		euler = logcontent[lineindex+13].split()
 		grain.setEulerAngles(float(euler[0]),float(euler[1]),float(euler[2]))
-		# Reading and storing some of the peak information
-		peakList = []
-		for i in range (0,numbpeaks):
-			thispeak = indexedPeak3DXRD.indexedPeak()
-			peakinfo = logcontent[lineindex+17+i].split()
-			thispeak.setNum(int(peakinfo[0]))
-			thispeak.setGVEID(int(peakinfo[1]))
-			thispeak.setPeakID(int(peakinfo[2]))
-			thispeak.setHKL(int(peakinfo[3]), int(peakinfo[4]), int(peakinfo[5]))
-			thispeak.setTThetaMeasured(float(peakinfo[12]))
-			thispeak.setTThetaPred(float(peakinfo[13]))
-			thispeak.setOmegaMeasured(float(peakinfo[15]))
-			thispeak.setOmegaPred(float(peakinfo[16]))
-			thispeak.setEtaMeasured(float(peakinfo[18]))
-			thispeak.setEtaPred(float(peakinfo[19]))
-			peakList.append(thispeak)
-		grain.setPeaks(peakList)
-		# Extracting the full text from the GrainSpotter logfile. Can be useful to generate new files
-		if (grainnn < (len(headgrains)-1)):
-			lineindex1 = headgrains[grainnn]
-			lineindex2 = headgrains[grainnn+1]
-		else:
-			lineindex1 = headgrains[grainnn]
-			lineindex2 = len(logcontent)-2
-		txt = logcontent[lineindex1:lineindex2]
-		grain.setGrainSpotterTxt(txt)
+		# Lines with peak information, parsed for all grains at once below
+		peaklines += logcontent[lineindex+17:lineindex+17+numbpeaks]
+		npeaks.append(numbpeaks)
+		# Extracting the full text from the GrainSpotter logfile, if requested
+		if (keeptext):
+			if (grainnn < (len(headgrains)-1)):
+				lineindex1 = headgrains[grainnn]
+				lineindex2 = headgrains[grainnn+1]
+			else:
+				lineindex1 = headgrains[grainnn]
+				lineindex2 = len(logcontent)-2
+			txt = logcontent[lineindex1:lineindex2]
+			grain.setGrainSpotterTxt(txt)
 		
 		# Adding the grain the the grain list
 		grainList.append(grain)
 	
+	# Peak information, as a table. Peak objects are only created when a grain needs them
+	# Columns are num gvector_id peak_id h k l h_pred k_pred l_pred dh dk dl tth_meas tth_pred dtth omega_meas omega_pred domega eta_meas eta_pred deta IA
+	# Lines are converted by blocks, to limit memory usage for large logs
+	peaks = numpy.empty(len(peaklines), dtype=indexedPeaksDType)
+	peaks['grain'] = numpy.repeat(numpy.arange(len(grainList)), npeaks)
+	for start in range(0,len(peaklines),100000):
+		values = numpy.array(" ".join(peaklines[start:start+100000]).split(), dtype=float).reshape((-1,22))
+		for [name, column] in [['num', 0], ['gveid', 1], ['peakid', 2], ['h', 3], ['k', 4], ['l', 5], ['h_pred', 6], ['k_pred', 7], ['l_pred', 8], ['dh', 9], ['dk', 10], ['dl', 11], ['tth_meas', 12], ['tth_pred', 13], ['dtth', 14], ['omega_meas', 15], ['omega_pred', 16], ['domega', 17], ['eta_meas', 18], ['eta_pred', 19], ['deta', 20], ['ia', 21]]:
+			peaks[name][start:start+len(values)] = values[:,column]
+	offsets = numpy.zeros(len(grainList)+1, dtype=numpy.int64)
+	offsets[1:] = numpy.cumsum(npeaks)
+	for i in range(0,len(grainList)):
+		grainList[i].setPeakTable(peaks[offsets[i]:offsets[i+1]])
+	
 	return grainList
 
 ############################################################################################# 
 
 
 """
-Save grains (read from a GrainSpotter log) into a new GrainSpotter log file
+Save grains into a new GrainSpotter log file
+
+Grain blocks are generated from the grain and peak information, so grains read from gff or ubi files
+can be saved as well. Information which is not available for those (predicted hkl, differences between 
+measured and predicted angles, mean_IA...) is calculated from what we have or set to 0. Rodrigues vectors
+and quaternions are calculated from U, with the conventions of GrainSpotter.
 
 Returns 
 	Nothing
@@ -215,7 +236,7 @@ Parameters
 	grains: a list of grains
 """
 def saveGrainSpotter(outputname,grains):
-	output = open(outputname,'w')
+	output = open(outputname,'w',buffering=1048576)
 	text = """Found %d grains
 Syntax:
 Grain nr
@@ -241,24 +262,75 @@ q0 qx qy qz
 """ % len(grains)
 	output.write(text)
 	output.write("\n")
-	i = 0
 	totalgve = 0
-	for grain in grains:
-		i += 1
-		text = (grain.getGrainSpotterTxt())[:] # we make a copy of the array, this is important
-		# Remove first line (it includes the grain number, which we need to change)
-		del text[0]
-		output.write("Grain    %d, %d\n" % (i, grain.getNPeaks()))
-		for line in text:
-			output.write(line)
-			output.write("\n")
-		totalgve += grain.getNPeaks()
+	# Grains are formatted by chunks, to limit memory use
+	chunk = 1000
+	for start in range(0,len(grains),chunk):
+		chunkgrains = grains[start:start+chunk]
+		peaklines = grainSpotterPeakLines(chunkgrains)
+		# GrainSpotter gives r and q for the transpose of U, with the opposite sign for qy
+		Ut = orientation.orientationArray(chunkgrains).transpose(0,2,1)
+		rodrigues = orientation.rodriguesFromU(Ut).tolist()
+		quaternions = orientation.quaternionFromU(Ut)
+		quaternions[:,2] = -quaternions[:,2]
+		quaternions = quaternions.tolist()
+		block = []
+		for i in range(0,len(chunkgrains)):
+			grain = chunkgrains[i]
+			npeaks = grain.getNPeaks()
+			info = grain.getGrainSpotterInfo()
+			if (info is None):
+				ia = [peak.getIA() for peak in grain.getPeaks()]
+				meanIA = numpy.nanmean(ia) if ((len(ia) > 0) and not numpy.all(numpy.isnan(ia))) else 0.
+				info = [npeaks, npeaks, npeaks, 0, meanIA, 0.]
+			position = grain.getPosition()
+			block.append("Grain %4d, %d\n" % (start+i+1, npeaks))
+			block.append("%4d %4d %4d %4d\n" % tuple(info[0:4]))
+			block.append("%7.4f %10.3f %7.3f %7.3f %9.3f\n" % (info[4], position[0], position[1], position[2], info[5]))
+			block.append("%.9f %.9f %.9f\n%.9f %.9f %.9f\n%.9f %.9f %.9f\n\n" % tuple(numpy.ravel(grain.getU()).tolist()))
+			block.append("%.9f %.9f %.9f\n%.9f %.9f %.9f\n%.9f %.9f %.9f\n\n" % tuple(numpy.ravel(grain.getUBi()).tolist()))
+			block.append("%.9f %.9f %.9f\n\n" % tuple(rodrigues[i]))
+			block.append("%.9f %.9f %.9f\n\n" % tuple(grain.geteulerangles()))
+			block.append("%.9f %.9f %.9f %.9f\n\n" % tuple(quaternions[i]))
+			block += peaklines[i]
+			block.append("\n")
+			totalgve += npeaks
+		output.write("".join(block))
 	textsummary = """In total %d gvectors of which %d (%d%%) were assigned:
 %d (%d%%) was not assigned, something once, something more than once.""" % (len(grains), totalgve, totalgve/len(grains)*100, len(grains)-totalgve, 100-totalgve/len(grains)*100) #FIXME The words "something" have to be changed. The term "grains" is still wrong (must be G-vectors instead).
 	output.write(textsummary)
 	output.write("\n")
 	output.close()
 
+"""
+Formatted GrainSpotter lines for the peaks of a list of grains, all formatted at once from indexedPeaksTable
+
+Returns
+	A list with, for each grain, a list of lines
+
+Parameters
+	grains: a list of grains
+"""
+def grainSpotterPeakLines(grains):
+	[peaks, offsets] = indexedPeaksTable(grains)
+	hkl = numpy.column_stack((peaks['h'], peaks['k'], peaks['l'])).astype(float)
+	# Information which is not known is calculated from what we have, or set to 0
+	hklpred = numpy.column_stack((peaks['h_pred'], peaks['k_pred'], peaks['l_pred']))
+	hklpred = numpy.where(numpy.isnan(hklpred), hkl, hklpred)
+	dhkl = numpy.column_stack((peaks['dh'], peaks['dk'], peaks['dl']))
+	measured = numpy.column_stack((peaks['tth_meas'], peaks['omega_meas'], peaks['eta_meas']))
+	predicted = numpy.column_stack((peaks['tth_pred'], peaks['omega_pred'], peaks['eta_pred']))
+	delta = numpy.column_stack((peaks['dtth'], peaks['domega'], peaks['deta']))
+	delta = numpy.where(numpy.isnan(delta), measured-predicted, delta)
+	ia = numpy.where(numpy.isnan(peaks['ia']), 0., peaks['ia'])
+	columns = [peaks['num'], peaks['gveid'], peaks['peakid'], peaks['h'], peaks['k'], peaks['l']] + [hklpred[:,i] for i in range(0,3)] + [dhkl[:,i] for i in range(0,3)]
+	for i in range(0,3):
+		columns += [measured[:,i], predicted[:,i], delta[:,i]]
+	columns.append(ia)
+	fmt = "%5d %8d %7d %5d %3d %3d %8.2f %7.2f %7.2f %8.2f %7.2f %7.2f %8.2f %7.2f %7.2f %8.2f %7.2f %7.2f %8.2f %7.2f %7.2f %8.2f\n"
+	lines = [fmt % row for row in zip(*[column.tolist() for column in columns])]
+	return [lines[offsets[i]:offsets[i+1]] for i in range(0,len(grains))]
+
 
 #############################################################################################     
 
@@ -272,6 +344,8 @@ Returns
 Parameters
 	logfile: name and path to the GFF file
 """
+@parserCache.cachedParser
+@grainSidecar.sidecarParser
 def parse_gff(gfffile):
 
 
@@ -293,6 +367,7 @@ def parse_gff(gfffile):
 		grain = grain3DXRD.Grain()
 		grain.setFileName(gfffile)
 		grain.setFileIndex(int(j))
+		grain.setPosition(float(line[4]), float(line[5]), float(line[6]))
 		# Extracting U matrix
 		U = numpy.empty([3,3])
 		for i in range (0,3):
@@ -304,9 +379,9 @@ def parse_gff(gfffile):
 		for i in range (0,3):
 			UBI[0,i] = float(line[19+i])
 			UBI[1,i] = float(line[22+i])
-			UBI[2,i] = float(line[23+i])
+			UBI[2,i] = float(line[25+i])
 		# Extracting B
-		B =scipy.linalg.inv( numpy.dot(UBI,U))
+		B =numpy.linalg.inv( numpy.dot(UBI,U))
 		# Setting information
 		grain.setUBBi(U,B,UBI)
 		# extracting the Euler angles phi1 phi phi2
@@ -329,8 +404,12 @@ Returns
 Parameters
 	logfile: name and path to the UBI file
 """
+@parserCache.cachedParser
+@grainSidecar.sidecarParser
 def parse_ubi(ubifile):
 
+	# Conversion from UBi to U in ImageD11
+	import ImageD11.indexing
 
 	# Read ubi file
 	g = open(ubifile, 'r')
@@ -342,7 +421,7 @@ def parse_ubi(ubifile):
 	for line in ubicontent:
 		if (line != ""):
 			ndata += 1
-	ngrains = ndata/3
+	ngrains = ndata//3
 	
 	# Parsing data for each grain and putting them in a f list
 	grainList = []
@@ -362,7 +441,7 @@ def parse_ubi(ubifile):
 		# Extracting U from UBi
 		U = ImageD11.indexing.ubitoU(UBI)
 		# Extracting B
-		B =scipy.linalg.inv( numpy.dot(UBI,U))
+		B =numpy.linalg.inv( numpy.dot(UBI,U))
 		# Setting information
 		grain.setUBBi(U,B,UBI)
 		# extracting the Euler angles phi1 phi phi2
@@ -373,6 +452,63 @@ def parse_ubi(ubifile):
 
 #############################################################################################
 
+"""
+Numpy data type for tables of indexed peaks
+"""
+indexedPeaksDType = numpy.dtype([('grain', numpy.int64), ('num', numpy.int64), ('gveid', numpy.int64), ('peakid', numpy.int64), ('h', numpy.int64), ('k', numpy.int64), ('l', numpy.int64), ('tth_meas', float), ('tth_pred', float), ('omega_meas', float), ('omega_pred', float), ('eta_meas', float), ('eta_pred', float), ('h_pred', float), ('k_pred', float), ('l_pred', float), ('dh', float), ('dk', float), ('dl', float), ('dtth', float), ('domega', float), ('deta', float), ('ia', float)])
+
+"""
+Collects the indexed peaks of a list of grains into a single typed array
+
+Returns
+	A table
+	- peaks: a numpy structured array with one line per indexed peak and the fields grain (index of
+	  the grain in the list), num, gveid, peakid, h, k, l, tth_meas, tth_pred, omega_meas, omega_pred,
+	  eta_meas, eta_pred, and the GrainSpotter fields h_pred, k_pred, l_pred, dh, dk, dl, dtth, domega, 
+	  deta, ia (NaN if unknown)
+	A list of offsets
+	- offsets: peaks of grain i are in peaks[offsets[i]:offsets[i+1]]
+
+Parameters
+	grains: a list of grains
+"""
+def indexedPeaksTable(grains):
+	npeaks = numpy.array([len(grain.getPeaks()) if (grain.getPeakTable() is None) else len(grain.getPeakTable()) for grain in grains], dtype=numpy.int64)
+	offsets = numpy.zeros(len(grains)+1, dtype=numpy.int64)
+	offsets[1:] = numpy.cumsum(npeaks)
+	if (all((grain.getPeakTable() is not None) for grain in grains) and (len(grains) > 0)):
+		# Peaks are already in tables, we do not need the peak objects
+		peaks = numpy.concatenate([grain.getPeakTable() for grain in grains])
+	else:
+		rows = [(i, peak.num, peak.gvpeakid, peak.peakid, peak.h, peak.k, peak.l, peak.tthetameasured, peak.tthetapred, peak.omegameasured, peak.omegapred, peak.etameasured, peak.etapred, peak.hpred, peak.kpred, peak.lpred, peak.dh, peak.dk, peak.dl, peak.dttheta, peak.domega, peak.deta, peak.ia) for i in range(0,len(grains)) for peak in grains[i].getPeaks()]
+		peaks = numpy.array(rows, dtype=indexedPeaksDType)
+	peaks['grain'] = numpy.repeat(numpy.arange(len(grains)), npeaks)
+	return [peaks, offsets]
+
+"""
+Locates IDs in a table (e.g. peak IDs of indexed peaks in a FLT or GVE table), using the IDs of the table sorted once
+
+Returns
+	- rows: row in the table for each ID, -1 if the ID is not in the table
+
+Parameters
+	sortedids: IDs of the table, sorted
+	order: row in the table for each sorted ID (e.g. from numpy.argsort), None if the table itself is sorted by ID
+	ids: IDs to locate
+"""
+def rowsForIDs(sortedids, order, ids):
+	ids = numpy.asarray(ids, dtype=numpy.int64)
+	if (len(sortedids) == 0):
+		return numpy.full(ids.shape, -1, dtype=numpy.int64)
+	index = numpy.clip(numpy.searchsorted(sortedids, ids), 0, len(sortedids)-1)
+	found = (sortedids[index] == ids)
+	if (order is not None):
+		index = order[index]
+	return numpy.where(found, index, -1)
+
+
+#############################################################################################
+
 """
 Parser for FLT (peaks from diffraction data)
 
@@ -388,6 +524,7 @@ Returns
 Parameters
 	fname: name and path to the FLT file
 """
+@parserCache.cachedParser
 def parseFLT(fname):
 	peaks = []
 	idlist = []
@@ -460,6 +597,225 @@ def saveFLT(peaks, header, fname):
 
 #############################################################################################
 
+"""
+Filters peaks in a FLT file based on their spot3d_id, without loading the file in memory
+
+The file is read and written by blocks of lines, so that memory is bounded by the list of
+peak IDs and not by the size of the file. Peaks are written in the same order and format as
+with parseFLT and saveFLT (header line, then one line per peak).
+
+Returns
+	- found: sorted array of IDs from peakids which were found in the FLT file
+	- header: the header line of the FLT file
+	- lines: if collect is True, a dictionnary with the formatted line of each peak in peakids, key is the spot3d_id.
+	  None otherwise
+
+Parameters
+	fname: name and path to the FLT file
+	peakids: list or array of spot3d_id
+	output: name of the FLT file to create
+	keep: if True, only peaks in peakids are saved. If False, peaks in peakids are removed
+	collect: if True, also returns the lines for peaks in peakids (e.g. to save them in other files)
+	blocksize: approximate number of bytes read at once
+"""
+def filterFLT(fname, peakids, output, keep=True, collect=False, blocksize=1048576):
+	ids = set(numpy.asarray(peakids, dtype=numpy.int64).tolist())
+	found = set()
+	lines = {} if collect else None
+	nsaved = 0
+	fin = open(fname, 'r')
+	fout = open(output, 'w', buffering=blocksize)
+	# Header is the last line with a pound symbol
+	header = ""
+	line = fin.readline()
+	while (line.strip().startswith("#")):
+		header = line
+		line = fin.readline()
+	stringlist = header.split()
+	del stringlist[0]
+	column = stringlist.index("spot3d_id")
+	fout.write(header)
+	block = [line]
+	while (len(block) > 0):
+		txt = []
+		for line in block:
+			items = line.split()
+			if (len(items) == 0):
+				continue
+			thisid = int(items[column])
+			if (thisid in ids):
+				found.add(thisid)
+				line = " ".join(items) + " \n"
+				if (collect):
+					lines[thisid] = line
+				if (keep):
+					txt.append(line)
+			elif (not keep):
+				txt.append(" ".join(items) + " \n")
+		fout.write("".join(txt))
+		nsaved += len(txt)
+		block = fin.readlines(blocksize)
+	fin.close()
+	fout.close()
+	print ("Saved list of %i peaks into flt file %s" % (nsaved, output))
+	return [numpy.array(sorted(found), dtype=numpy.int64), header, lines]
+
+
+#############################################################################################
+
+"""
+Parser for FLT, returning typed arrays instead of a list of dictionnaries. Much faster and
+lighter on memory for large files.
+
+Returns
+	A table
+	- peaks: a numpy structured array with one field per column in the FLT file
+	A header
+	- header: anyting that is before the list of peaks (all lines starting with a pound symbol)
+
+	All fields are stored as floats, except for spot3d_id which is stored as an integer
+
+Parameters
+	fname: name and path to the FLT file
+"""
+@parserCache.cachedParser
+def parseFLTTable(fname):
+	header = ""
+	# Read file
+	f = open(fname, 'r')
+	lines = f.read().split("\n")
+	f.close()
+	# Dealing with header, so we know what we are reading
+	# Header is the last line with a pound symbol
+	nheader = 0
+	for line in lines:
+		if not line.strip().startswith("#"):
+			break
+		nheader += 1
+	header = "\n".join(lines[0:nheader]) + "\n"
+	stringlist = lines[nheader-1].split()
+	del stringlist[0]
+	# Reading peak information, all at once
+	values = numpy.array(" ".join(lines[nheader:]).split(), dtype=float).reshape((-1,len(stringlist)))
+	peaks = numpy.empty(len(values), dtype=gveTableDType(stringlist))
+	for i in range(0,len(stringlist)):
+		peaks[stringlist[i]] = values[:,i]
+	print ("Parsed list of peaks from flt file %s, found %i peaks" % ( fname, len(peaks)))
+	return [peaks,header]
+
+
+#############################################################################################
+
+"""
+Parser for FLT, returning a typed table together with the lines of the file, formatted as in saveFLT.
+Used to save subsets of peaks quickly, by selecting lines instead of rebuilding them.
+
+Returns
+	- peaks: a numpy structured array with one field per column in the FLT file, as in parseFLTTable
+	- lines: a numpy array of strings, one formatted line per peak, ending with a new line
+	- header: the header line (last line with a pound symbol)
+
+Parameters
+	fname: name and path to the FLT file
+"""
+@parserCache.cachedParser
+def parseFLTLines(fname):
+	# Read file
+	f = open(fname, 'r')
+	lines = f.read().split("\n")
+	f.close()
+	# Header is the last line with a pound symbol
+	nheader = 0
+	for line in lines:
+		if not line.strip().startswith("#"):
+			break
+		nheader += 1
+	header = lines[nheader-1] + "\n"
+	lines = [" ".join(line.split()) + " \n" for line in lines[nheader:] if (line.strip() != "")]
+	peaks = fltTableFromLines(lines, header)
+	print ("Parsed list of peaks from flt file %s, found %i peaks" % ( fname, len(peaks)))
+	return [peaks, numpy.array(lines, dtype=object), header]
+
+"""
+Converts lines of a FLT file into a typed table, with one field per column in the header line
+"""
+def fltTableFromLines(lines, header):
+	stringlist = header.split()
+	del stringlist[0]
+	values = numpy.array(" ".join(lines).split(), dtype=float).reshape((-1,len(stringlist)))
+	peaks = numpy.empty(len(values), dtype=gveTableDType(stringlist))
+	for i in range(0,len(stringlist)):
+		peaks[stringlist[i]] = values[:,i]
+	return peaks
+
+
+#############################################################################################
+
+"""
+Saves peaks for many grains in a single container file, for tools which read grains in random order
+
+Two formats are available, based on the file extension
+- .h5 or .hdf5: one HDF5 group per grain, holding a "peaks" table (needs h5py)
+- anything else: a numpy npz file, with all peaks in one table and a grain-offset index
+
+Parameters
+	fname: name of the container file
+	peaks: typed table of peaks (as from parseFLTTable), sorted by grain
+	offsets: peaks of grain i are in peaks[offsets[i]:offsets[i+1]]
+	names: list of grain names
+	header: FLT header line
+"""
+def saveFLTGrains(fname, peaks, offsets, names, header):
+	offsets = numpy.asarray(offsets, dtype=numpy.int64)
+	if (os.path.splitext(fname)[1].lower() in [".h5", ".hdf5"]):
+		# h5py is only needed for this format
+		import h5py
+		f = h5py.File(fname, 'w')
+		f.attrs['header'] = header
+		f.create_dataset('names', data=numpy.array(names, dtype=object), dtype=h5py.string_dtype())
+		f.create_dataset('offsets', data=offsets)
+		for i in range(0,len(names)):
+			group = f.create_group(names[i])
+			group.create_dataset('peaks', data=peaks[offsets[i]:offsets[i+1]])
+		f.close()
+	else:
+		f = open(fname, 'wb')
+		numpy.savez(f, peaks=peaks, offsets=offsets, names=numpy.array(names, dtype=str), header=numpy.array(header))
+		f.close()
+	print ("Saved peaks of %i grains into %s" % (len(names), fname))
+	return
+
+"""
+Reads a container file created by saveFLTGrains
+
+Returns
+	- peaks: typed table of peaks, sorted by grain
+	- offsets: peaks of grain i are in peaks[offsets[i]:offsets[i+1]]
+	- names: list of grain names
+	- header: FLT header line
+
+Parameters
+	fname: name of the container file
+"""
+def parseFLTGrains(fname):
+	if (os.path.splitext(fname)[1].lower() in [".h5", ".hdf5"]):
+		import h5py
+		f = h5py.File(fname, 'r')
+		header = str(f.attrs['header'])
+		names = [name.decode('utf-8') for name in f['names'][()]]
+		offsets = f['offsets'][()]
+		peaks = numpy.concatenate([f[name]['peaks'][()] for name in names]) if (len(names) > 0) else numpy.zeros(0, dtype=gveTableDType(header.split()[1:]))
+		f.close()
+	else:
+		with numpy.load(fname) as data:
+			peaks = data['peaks']
+			offsets = data['offsets']
+			names = data['names'].tolist()
+			header = str(data['header'])
+	return [peaks, offsets, names, header]
+
+#############################################################################################
+
 """
 Parser for GVE (peaks from diffraction data, peaks coordinate have been converted into ds, eta, and etc already)
 
@@ -476,6 +832,7 @@ Returns
 Parameters
 	fname: name and path to the GVE file
 """
+@parserCache.cachedParser
 def parseGVE(fname):
 	peaks = []
 	idlist = []
@@ -540,6 +897,126 @@ def saveGVE(peaks, header, fname):
 	return
 
 
+#############################################################################################
+
+"""
+Parser for GVE, returning typed arrays instead of a list of dictionnaries. Much faster and
+lighter on memory for large files.
+
+Returns
+	A table
+	- peaks: a numpy structured array with one field per column in the GVE file (gx, gy, gz, xc, yc, ds, eta, omega, spot3d_id, xl, yl, zl)
+	A header
+	- header: anyting that is before the list of peaks
+
+	All fields are stored as floats, except for spot3d_id which is stored as an integer
+
+Raises
+	ValueError if the line with the g-vector column names can not be found
+
+Parameters
+	fname: name and path to the GVE file
+"""
+@parserCache.cachedParser
+def parseGVETable(fname):
+	header = "";
+	stringlist = []
+	# Read header
+	f = open(fname, 'r')
+	for line in f:
+		header += line
+		if ((line.strip() == "# xr yr zr xc yc ds eta omega spot3d_id xl yl zl") or (line.strip() == "#  gx  gy  gz  xc  yc  ds  eta  omega  spot3d_id  xl  yl  zl")):
+			stringlist = line.split()
+			del stringlist[0]
+			break
+	# Read all g-vectors at once
+	values = numpy.array(f.read().split(), dtype=float)
+	f.close()
+	ncols = len(stringlist)
+	if (ncols == 0):
+		raise ValueError("Error parsing %s. Could not locate the g-vector column names." % fname)
+	values = values.reshape((-1,ncols))
+	peaks = numpy.empty(len(values), dtype=gveTableDType(stringlist))
+	for i in range(0,ncols):
+		peaks[stringlist[i]] = values[:,i]
+	print ("Parsed list of %i g-vectors from %s" % (len(peaks), fname))
+	return [peaks,header]
+
+"""
+Parser for GVE, returning a typed table together with the lines of the file, formatted as in saveGVE.
+Used to save subsets of g-vectors quickly, by selecting lines instead of rebuilding them.
+
+Returns
+	- peaks: a numpy structured array with one field per column in the GVE file, as in parseGVETable
+	- lines: a numpy array of strings, one formatted line per g-vector, ending with a new line
+	- header: anyting that is before the list of g-vectors
+
+Raises
+	ValueError if the line with the g-vector column names can not be found
+
+Parameters
+	fname: name and path to the GVE file
+"""
+@parserCache.cachedParser
+def parseGVELines(fname):
+	header = "";
+	stringlist = []
+	# Read header
+	f = open(fname, 'r')
+	for line in f:
+		header += line
+		if ((line.strip() == "# xr yr zr xc yc ds eta omega spot3d_id xl yl zl") or (line.strip() == "#  gx  gy  gz  xc  yc  ds  eta  omega  spot3d_id  xl  yl  zl")):
+			stringlist = line.split()
+			del stringlist[0]
+			break
+	lines = [" ".join(line.split()) + " \n" for line in f if (line.strip() != "")]
+	f.close()
+	ncols = len(stringlist)
+	if (ncols == 0):
+		raise ValueError("Error parsing %s. Could not locate the g-vector column names." % fname)
+	values = numpy.array(" ".join(lines).split(), dtype=float).reshape((-1,ncols))
+	peaks = numpy.empty(len(values), dtype=gveTableDType(stringlist))
+	for i in range(0,ncols):
+		peaks[stringlist[i]] = values[:,i]
+	print ("Parsed list of %i g-vectors from %s" % (len(peaks), fname))
+	return [peaks, numpy.array(lines, dtype=object), header]
+
+"""
+Numpy data type for a table of g-vectors with the column names in stringlist
+spot3d_id is stored as an integer, everything else as a float
+"""
+def gveTableDType(stringlist):
+	return numpy.dtype([(name, numpy.int64 if (name == "spot3d_id") else numpy.float64) for name in stringlist])
+
+
+#############################################################################################
+
+"""
+Merges multiple tables of g-vectors, as read with parseGVETable, removing doubles.
+
+G-vectors are identified by their spot3d_id. If a g-vector is present in more than one table,
+the first occurence is kept. Columns are matched by position, using the column names of the
+first table.
+
+Returns
+	A table of g-vectors, sorted by spot3d_id
+
+Parameters
+	tables: a list of tables of g-vectors
+"""
+def mergeGVETables(tables):
+	dtype = tables[0].dtype
+	nrows = sum([len(table) for table in tables])
+	allpeaks = numpy.empty(nrows, dtype=dtype)
+	i = 0
+	for table in tables:
+		allpeaks[i:i+len(table)] = table # Assignement between structured arrays is by position
+		i += len(table)
+	# numpy.unique returns the index of the first occurence of each id
+	ids, first = numpy.unique(allpeaks["spot3d_id"], return_index=True)
+	return allpeaks[first]
+
+
 #############################################################################################
 
 """
@@ -559,6 +1036,7 @@ Returns
 	A dictionnary with the GS input file information
 
 """
+@parserCache.cachedParser
 def parseGSInput(fname):
 	gsInput = {}
 	gsInput["tthranges"] = []
@@ -0,0 +1,518 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+This is part of the TIMEleSS tools
+http://timeless.texture.rocks/
+
+Copyright (C) S. Merkel, Universite de Lille, France
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+"""
+Orientations and misorientations of grains, for whole arrays of grains at once
+
+Orientations are U matrices, stored in (N,3,3) arrays. Functions accept a single (3,3) matrix as well.
+Conversions to and from Euler angles (Bunge convention, as in GrainSpotter), quaternions (w, x, y, z), 
+and Rodrigues vectors work on (N,3) and (N,4) arrays.
+
+crystal_system can be one of the following values
+	1: Triclinic
+	2: Monoclinic
+	3: Orthorhombic
+	4: Tetragonal
+	5: Trigonal
+	6: Hexagonal
+	7: Cubic
+
+Symmetry operators are the rotations from xfab.symmetry, so that misorientations are identical to those
+of xfab.symmetry.Umis. They are calculated once for each crystal system and kept in memory.
+
+Misorientations are in degrees.
+"""
+
+# Maths stuff
+import numpy
+
+# Will use to crystallography functions in xfab.symmetry
+# xfab is slow to load, it is imported in the functions which need it
+
+# Names of crystal systems
+crystalSystems = {1: "Triclinic", 2: "Monoclinic", 3: "Orthorhombic", 4: "Tetragonal", 5: "Trigonal", 6: "Hexagonal", 7: "Cubic"}
+# Symmetry operators for each crystal system, filled the first time they are needed
+rotationTables = {}
+quaternionTables = {}
+
+#################################################################
+#
+# Symmetry operators
+#
+#################################################################
+
+"""
+Rotation matrices of the symmetry operators of a crystal system, as a (N,3,3) array
+"""
+def symmetryRotations(crystal_system):
+	if (crystal_system not in rotationTables):
+		if (crystal_system not in crystalSystems):
+			raise ValueError("Crystal system should have a value between 1 and 7")
+		import xfab.symmetry
+		rotationTables[crystal_system] = numpy.array(xfab.symmetry.rotations(crystal_system), dtype=float)
+	return rotationTables[crystal_system]
+
+"""
+Unit quaternions of the symmetry operators of a crystal system, as a (N,4) array
+"""
+def symmetryQuaternions(crystal_system):
+	if (crystal_system not in quaternionTables):
+		quaternionTables[crystal_system] = quaternionFromU(symmetryRotations(crystal_system))
+	return quaternionTables[crystal_system]
+
+#################################################################
+#
+# Quaternions
+#
+#################################################################
+
+"""
+Unit quaternions (w, x, y, z), with w >= 0, from rotation matrices
+
+Parameters:
+- U: (N,3,3) array, or a single (3,3) matrix
+
+Returns a (N,4) array
+"""
+def quaternionFromU(U):
+	U = numpy.asarray(U, dtype=float).reshape(-1,3,3)
+	n = len(U)
+	# Shepperd's method: start from the largest of the 4 components, for numerical stability
+	diag = numpy.stack([1.+U[:,0,0]+U[:,1,1]+U[:,2,2], 1.+U[:,0,0]-U[:,1,1]-U[:,2,2], 1.-U[:,0,0]+U[:,1,1]-U[:,2,2], 1.-U[:,0,0]-U[:,1,1]+U[:,2,2]], axis=1)
+	largest = numpy.argmax(diag, axis=1)
+	s = 2.*numpy.sqrt(numpy.maximum(diag[numpy.arange(n),largest], 1.e-300))
+	q = numpy.zeros((n,4))
+	# Largest component is w
+	k = (largest == 0)
+	q[k,0] = s[k]/4.
+	q[k,1] = (U[k,2,1]-U[k,1,2])/s[k]
+	q[k,2] = (U[k,0,2]-U[k,2,0])/s[k]
+	q[k,3] = (U[k,1,0]-U[k,0,1])/s[k]
+	# Largest component is x
+	k = (largest == 1)
+	q[k,0] = (U[k,2,1]-U[k,1,2])/s[k]
+	q[k,1] = s[k]/4.
+	q[k,2] = (U[k,0,1]+U[k,1,0])/s[k]
+	q[k,3] = (U[k,0,2]+U[k,2,0])/s[k]
+	# Largest component is y
+	k = (largest == 2)
+	q[k,0] = (U[k,0,2]-U[k,2,0])/s[k]
+	q[k,1] = (U[k,0,1]+U[k,1,0])/s[k]
+	q[k,2] = s[k]/4.
+	q[k,3] = (U[k,1,2]+U[k,2,1])/s[k]
+	# Largest component is z
+	k = (largest == 3)
+	q[k,0] = (U[k,1,0]-U[k,0,1])/s[k]
+	q[k,1] = (U[k,0,2]+U[k,2,0])/s[k]
+	q[k,2] = (U[k,1,2]+U[k,2,1])/s[k]
+	q[k,3] = s[k]/4.
+	q[q[:,0] < 0.] *= -1.
+	return q / numpy.linalg.norm(q, axis=1)[:,numpy.newaxis]
+
+"""
+Rotation matrices from quaternions (w, x, y, z)
+
+Parameters:
+- q: (N,4) array, or a single quaternion. Quaternions are normalized first
+
+Returns a (N,3,3) array
+"""
+def UFromQuaternion(q):
+	q = numpy.asarray(q, dtype=float).reshape(-1,4)
+	q = q / numpy.linalg.norm(q, axis=1)[:,numpy.newaxis]
+	[w, x, y, z] = [q[:,0], q[:,1], q[:,2], q[:,3]]
+	U = numpy.empty((len(q),3,3))
+	U[:,0,0] = 1.-2.*(y*y+z*z)
+	U[:,0,1] = 2.*(x*y-w*z)
+	U[:,0,2] = 2.*(x*z+w*y)
+	U[:,1,0] = 2.*(x*y+w*z)
+	U[:,1,1] = 1.-2.*(x*x+z*z)
+	U[:,1,2] = 2.*(y*z-w*x)
+	U[:,2,0] = 2.*(x*z-w*y)
+	U[:,2,1] = 2.*(y*z+w*x)
+	U[:,2,2] = 1.-2.*(x*x+y*y)
+	return U
+
+#################################################################
+#
+# Euler angles and Rodrigues vectors
+#
+#################################################################
+
+"""
+Rotation matrices from Euler angles (phi1, Phi, phi2), Bunge convention, in degrees
+
+This is the convention of GrainSpotter and gff files: U = Rz(phi1).Rx(Phi).Rz(phi2)
+
+Parameters:
+- euler: (N,3) array, or a single set of 3 angles
+
+Returns a (N,3,3) array
+"""
+def UFromEuler(euler):
+	euler = numpy.radians(numpy.asarray(euler, dtype=float).reshape(-1,3))
+	[c1, cP, c2] = [numpy.cos(euler[:,0]), numpy.cos(euler[:,1]), numpy.cos(euler[:,2])]
+	[s1, sP, s2] = [numpy.sin(euler[:,0]), numpy.sin(euler[:,1]), numpy.sin(euler[:,2])]
+	U = numpy.empty((len(euler),3,3))
+	U[:,0,0] = c1*c2-s1*s2*cP
+	U[:,0,1] = -c1*s2-s1*c2*cP
+	U[:,0,2] = s1*sP
+	U[:,1,0] = s1*c2+c1*s2*cP
+	U[:,1,1] = -s1*s2+c1*c2*cP
+	U[:,1,2] = -c1*sP
+	U[:,2,0] = s2*sP
+	U[:,2,1] = c2*sP
+	U[:,2,2] = cP
+	return U
+
+"""
+Euler angles (phi1, Phi, phi2), Bunge convention as in UFromEuler, from rotation matrices
+
+phi1 and phi2 are between -180 and 180 degrees, Phi between 0 and 180 degrees. When Phi is 0 or 180, 
+only phi1+phi2 (or phi1-phi2) is defined, and phi2 is set to 0.
+
+Parameters:
+- U: (N,3,3) array, or a single (3,3) matrix
+
+Returns a (N,3) array, in degrees
+"""
+def eulerFromU(U):
+	U = numpy.asarray(U, dtype=float).reshape(-1,3,3)
+	euler = numpy.zeros((len(U),3))
+	euler[:,1] = numpy.arccos(numpy.clip(U[:,2,2], -1., 1.))
+	sP = numpy.sqrt(U[:,0,2]**2 + U[:,1,2]**2)
+	k = (sP > 1.e-9)
+	euler[k,0] = numpy.arctan2(U[k,0,2], -U[k,1,2])
+	euler[k,2] = numpy.arctan2(U[k,2,0], U[k,2,1])
+	euler[~k,0] = numpy.arctan2(U[~k,1,0], U[~k,0,0])
+	return numpy.degrees(euler)
+
+"""
+Quaternions (w, x, y, z) from Euler angles, in degrees, see UFromEuler
+"""
+def quaternionFromEuler(euler):
+	return quaternionFromU(UFromEuler(euler))
+
+"""
+Euler angles, in degrees, from quaternions (w, x, y, z), see eulerFromU
+"""
+def eulerFromQuaternion(q):
+	return eulerFromU(UFromQuaternion(q))
+
+"""
+Rodrigues vectors, axis*tan(angle/2), from quaternions (w, x, y, z)
+
+Rotations of 180 degrees have an infinite Rodrigues vector
+
+Returns a (N,3) array
+"""
+def rodriguesFromQuaternion(q):
+	q = numpy.asarray(q, dtype=float).reshape(-1,4)
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		return q[:,1:] / q[:,0][:,numpy.newaxis]
+
+"""
+Quaternions (w, x, y, z), with w >= 0, from Rodrigues vectors
+
+Returns a (N,4) array
+"""
+def quaternionFromRodrigues(r):
+	r = numpy.asarray(r, dtype=float).reshape(-1,3)
+	q = numpy.ones((len(r),4))
+	q[:,1:] = r
+	return q / numpy.linalg.norm(q, axis=1)[:,numpy.newaxis]
+
+"""
+Rodrigues vectors from rotation matrices
+
+Returns a (N,3) array
+"""
+def rodriguesFromU(U):
+	return rodriguesFromQuaternion(quaternionFromU(U))
+
+"""
+Rotation matrices from Rodrigues vectors
+
+Returns a (N,3,3) array
+"""
+def UFromRodrigues(r):
+	return UFromQuaternion(quaternionFromRodrigues(r))
+
+#################################################################
+#
+# Consistency checks
+#
+#################################################################
+
+"""
+Angle of the rotation between pairs of orientations, without symmetry, in degrees
+
+Parameters:
+- U1: (N,3,3) array, or a single (3,3) matrix
+- U2: (N,3,3) array, or a single (3,3) matrix. U1 and U2 are broadcast against each other
+
+Returns a (N,) array
+"""
+def rotationAngle(U1, U2):
+	U1 = numpy.asarray(U1, dtype=float).reshape(-1,3,3)
+	U2 = numpy.asarray(U2, dtype=float).reshape(-1,3,3)
+	return angleFromTrace(numpy.einsum('nij,nij->n', *numpy.broadcast_arrays(U1, U2)))
+
+"""
+Checks that matrices are rotations: orthonormal, with a determinant of 1
+
+Parameters:
+- U: (N,3,3) array, or a single (3,3) matrix
+- tolerance: maximal error on each element of U.U^T
+
+Returns a (N,) array of booleans
+"""
+def isRotation(U, tolerance=1.e-5):
+	U = numpy.asarray(U, dtype=float).reshape(-1,3,3)
+	error = numpy.abs(numpy.einsum('nij,nkj->nik', U, U) - numpy.identity(3)).max(axis=(1,2))
+	return (error <= tolerance) & (numpy.linalg.det(U) > 0.)
+
+"""
+Checks that Euler angles and U matrices describe the same orientations
+
+U is compared with the matrix built from the Euler angles, C = U.inv(UFromEuler(euler)), which should be 
+the identity (same tolerances as numpy.allclose).
+
+Parameters:
+- euler: (N,3) array, in degrees
+- U: (N,3,3) array
+
+Returns [ok, C]
+- ok: (N,) array of booleans, True if C is the identity
+- C: (N,3,3) array
+"""
+def checkEulerAngles(euler, U):
+	U = numpy.asarray(U, dtype=float).reshape(-1,3,3)
+	C = numpy.matmul(U, numpy.linalg.inv(UFromEuler(euler)))
+	unity = numpy.identity(3)
+	ok = numpy.all(numpy.abs(C - unity) <= 1.e-8 + 1.e-5*unity, axis=(1,2))
+	return [ok, C]
+
+#################################################################
+#
+# Equivalent orientations and fundamental zone
+#
+#################################################################
+
+"""
+All orientations equivalent to U by symmetry, U.R for each symmetry operator R
+
+Parameters:
+- U: (N,3,3) array, or a single (3,3) matrix
+- crystal_system
+
+Returns a (N,M,3,3) array, with M the number of symmetry operators
+"""
+def equivalentOrientations(U, crystal_system):
+	U = numpy.asarray(U, dtype=float).reshape(-1,3,3)
+	return numpy.einsum('nij,rjk->nrik', U, symmetryRotations(crystal_system))
+
+"""
+Reduces orientations to the fundamental zone: the equivalent orientation with the smallest rotation angle
+
+Parameters:
+- U: (N,3,3) array, or a single (3,3) matrix
+- crystal_system
+
+Returns a (N,3,3) array
+"""
+def fundamentalZone(U, crystal_system):
+	U = numpy.asarray(U, dtype=float).reshape(-1,3,3)
+	rot = symmetryRotations(crystal_system)
+	# trace(U.R), for all grains and operators
+	traces = numpy.einsum('nij,rji->nr', U, rot)
+	best = numpy.argmax(traces, axis=1)
+	return numpy.einsum('nij,njk->nik', U, rot[best])
+
+#################################################################
+#
+# Misorientations between pairs of grains
+#
+#################################################################
+
+"""
+Largest trace of (U1.R)^T.U2 over symmetry operators R, and the corresponding operator, for pairs of orientations
+"""
+def bestTraces(U1, U2, crystal_system):
+	U1 = numpy.asarray(U1, dtype=float).reshape(-1,3,3)
+	U2 = numpy.asarray(U2, dtype=float).reshape(-1,3,3)
+	[U1, U2] = numpy.broadcast_arrays(U1, U2)
+	M = numpy.einsum('nki,nkj->nij', U1, U2)
+	traces = numpy.einsum('rab,nab->nr', symmetryRotations(crystal_system), M)
+	best = numpy.argmax(traces, axis=1)
+	return [traces[numpy.arange(len(traces)),best], best, M]
+
+"""
+Converts traces of rotation matrices into rotation angles, in degrees
+"""
+def angleFromTrace(traces):
+	return numpy.degrees(numpy.arccos(numpy.clip(0.5*traces-0.5, -1., 1.)))
+
+"""
+Minimal misorientation between pairs of orientations, over all symmetry equivalents
+
+Parameters:
+- U1: (N,3,3) array, or a single (3,3) matrix
+- U2: (N,3,3) array, or a single (3,3) matrix. U1 and U2 are broadcast against each other
+- crystal_system
+
+Returns a (N,) array of misorientations, in degrees
+"""
+def misorientation(U1, U2, crystal_system):
+	[traces, best, M] = bestTraces(U1, U2, crystal_system)
+	return angleFromTrace(traces)
+
+"""
+Minimal misorientation between pairs of orientations, with the misorientation axis
+
+Parameters:
+- U1: (N,3,3) array, or a single (3,3) matrix
+- U2: (N,3,3) array, or a single (3,3) matrix. U1 and U2 are broadcast against each other
+- crystal_system
+
+Returns [angle, axis]
+- angle: (N,) array of misorientations, in degrees
+- axis: (N,3) array of unit vectors, in the crystal coordinates of grain 1. Axis is 0 for grains with no misorientation
+"""
+def misorientationAxis(U1, U2, crystal_system):
+	[traces, best, M] = bestTraces(U1, U2, crystal_system)
+	# Rotation from grain 2 to the closest equivalent of grain 1
+	delta = numpy.einsum('nba,nbc->nac', symmetryRotations(crystal_system)[best], M)
+	q = quaternionFromU(delta)
+	norm = numpy.linalg.norm(q[:,1:], axis=1)
+	axis = numpy.zeros((len(q),3))
+	k = (norm > 1.e-12)
+	axis[k] = q[k,1:] / norm[k,numpy.newaxis]
+	return [angleFromTrace(traces), axis]
+
+"""
+Compares two orientation matrices and checks whether they can be the same grain
+
+Single pair version of misorientation(), kept for scripts written for older versions
+
+Returns True if one of the equivalent has a mis-orientation below cutoff (in degrees)
+"""
+def matchGrains(U1, U2, crystal_system, cutoff):
+	return bool(misorientation(U1, U2, crystal_system)[0] < cutoff)
+
+"""
+Compares two orientation matrices and returns their minimal misorientation, in degrees
+
+Single pair version of misorientation(), kept for scripts written for older versions
+"""
+def minMisorientation(U1, U2, crystal_system):
+	return float(misorientation(U1, U2, crystal_system)[0])
+
+#################################################################
+#
+# Misorientations between 2 collections of grains, for all pairs at once
+#
+#################################################################
+
+"""
+U matrices for a list of grains, as a (N,3,3) array
+"""
+def orientationArray(grains):
+	return numpy.array([grain.getU() for grain in grains], dtype=float).reshape(len(grains),3,3)
+
+"""
+Minimal misorientation between all grains of two collections, calculated in blocks of grains from the first collection
+
+All symmetry equivalents and all pairs of grains are handled in one matrix product: for a symmetry operator R,
+trace(R^T.U1^T.U2) is the dot product of U1.R and U2, seen as vectors with 9 components.
+
+Parameters:
+- U1: U matrices of the first collection of grains, (N1,3,3) array
+- U2: U matrices of the second collection of grains, (N2,3,3) array
+- crystal_system
+- blocksize: maximum number of values calculated at once, to limit the memory use
+
+Yields [first, angles] where angles is a (n,N2) array with the misorientations between grains first to first+n of U1 and all grains of U2
+"""
+def misorientationBlocks(U1, U2, crystal_system, blocksize=4000000):
+	U1 = numpy.asarray(U1, dtype=float).reshape(-1,3,3)
+	U2 = numpy.asarray(U2, dtype=float).reshape(-1,3,3)
+	rot = symmetryRotations(crystal_system)
+	nrot = len(rot)
+	U2flat = U2.reshape(-1,9).T
+	step = max(1, blocksize // max(1, nrot*len(U2)))
+	for first in range(0, len(U1), step):
+		U1block = U1[first:first+step]
+		U1rot = numpy.einsum('ika,rab->irkb', U1block, rot).reshape(-1,9)
+		traces = numpy.dot(U1rot, U2flat).reshape(len(U1block),nrot,len(U2)).max(axis=1)
+		yield [first, angleFromTrace(traces)]
+
+"""
+Minimal misorientation between all grains of two collections, as a dense (N1,N2) array
+
+Only use for small collections of grains, see closeOrientations otherwise.
+"""
+def misorientationMatrix(U1, U2, crystal_system):
+	angles = numpy.zeros((len(U1),len(U2)))
+	for [first, block] in misorientationBlocks(U1, U2, crystal_system):
+		angles[first:first+len(block)] = block
+	return angles
+
+"""
+Pairs of grains, from two collections, with a misorientation below cutoff
+
+Parameters:
+- U1: U matrices of the first collection of grains, (N1,3,3) array
+- U2: U matrices of the second collection of grains, (N2,3,3) array
+- crystal_system
+- cutoff: mis-orientation below which the two grains are considered identical, in degrees
+
+Returns [i1, i2, angle]: three arrays with the index of the grain in U1, the index of the grain in U2, and their misorientation, sorted by i1 and i2
+"""
+def closeOrientations(U1, U2, crystal_system, cutoff):
+	i1 = [numpy.zeros(0, dtype=numpy.int64)]
+	i2 = [numpy.zeros(0, dtype=numpy.int64)]
+	angle = [numpy.zeros(0)]
+	for [first, block] in misorientationBlocks(U1, U2, crystal_system):
+		[rows, cols] = numpy.nonzero(block < cutoff)
+		i1.append(rows + first)
+		i2.append(cols)
+		angle.append(block[rows, cols])
+	return [numpy.concatenate(i1), numpy.concatenate(i2), numpy.concatenate(angle)]
+
+"""
+For each grain in U1, grain of U2 with the smallest misorientation
+
+Returns [index, angle]: two arrays with the index of the closest grain in U2 and the misorientation
+"""
+def nearestOrientations(U1, U2, crystal_system):
+	index = numpy.zeros(len(U1), dtype=numpy.int64)
+	angle = numpy.full(len(U1), numpy.nan)
+	if (len(U2) == 0):
+		return [index, angle]
+	for [first, block] in misorientationBlocks(U1, U2, crystal_system):
+		index[first:first+len(block)] = numpy.argmin(block, axis=1)
+		angle[first:first+len(block)] = numpy.min(block, axis=1)
+	return [index, angle]
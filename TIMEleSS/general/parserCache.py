@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+This is part of the TIMEleSS tools
+http://timeless.texture.rocks/
+
+Copyright (C) S. Merkel, Universite de Lille, France
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+"""
+In-memory cache for parsed files (grains, g-vectors, peaks, cif files...)
+
+Used when many commands are run in one process (e.g. "timeless serve"). The cache is
+disabled by default, and parsers behave as usual. Once enabled, the result of a parser
+is stored and reused as long as the file is not modified (same size and modification time).
+
+Parsers return copies of the cached lists and arrays, so that a command adding or removing grains
+or peaks does not affect the next one. Grain and peak objects themselves are shared between commands
+and should not be modified. Copying them would be slower than parsing the file again.
+"""
+
+# System functions
+import os
+import collections
+import functools
+
+# Cached results, None if the cache is disabled
+cache = None
+# Maximum number of files in the cache
+maxentries = 64
+# Number of cache hits and misses, for information
+hits = 0
+misses = 0
+
+"""
+Enables the cache
+
+Parameters:
+- nentries: maximum number of parsed files kept in memory
+"""
+def enableCache(nentries=64):
+	global cache, maxentries
+	maxentries = nentries
+	if (cache is None):
+		cache = collections.OrderedDict()
+
+"""
+Disables the cache and frees memory
+"""
+def disableCache():
+	global cache
+	cache = None
+
+"""
+Removes all files from the cache
+"""
+def clearCache():
+	global hits, misses
+	if (cache is not None):
+		cache.clear()
+	hits = 0
+	misses = 0
+
+"""
+Returns [number of files in cache, cache hits, cache misses]
+"""
+def cacheStatistics():
+	if (cache is None):
+		return [0, hits, misses]
+	return [len(cache), hits, misses]
+
+"""
+Copies the result of a parser: if the result is a list, each list, dictionnary, or numpy array
+it holds is copied. Objects inside them (grains, peaks) are not copied.
+"""
+def copyResult(result):
+	if isinstance(result, (list, tuple)):
+		return type(result)([copyItem(item) for item in result])
+	return copyItem(result)
+
+def copyItem(item):
+	if isinstance(item, list):
+		return list(item)
+	if isinstance(item, dict):
+		return dict(item)
+	if hasattr(item, 'copy') and hasattr(item, 'dtype'):
+		# numpy arrays
+		return item.copy()
+	return item
+
+"""
+Decorator for functions parsing a file. The file name should be the first argument of the function.
+
+If the cache is enabled, results are stored, with a key built from the function, the file path,
+size, and modification time, and the other arguments of the function.
+"""
+def cachedParser(function):
+	@functools.wraps(function)
+	def wrapper(fname, *args, **kwargs):
+		global hits, misses
+		if (cache is None):
+			return function(fname, *args, **kwargs)
+		try:
+			stat = os.stat(fname)
+		except (OSError, TypeError):
+			# Not a file we can check, we do not cache it
+			return function(fname, *args, **kwargs)
+		key = (function.__module__, function.__name__, os.path.abspath(fname), stat.st_size, stat.st_mtime_ns, repr(args), repr(sorted(kwargs.items())))
+		if (key in cache):
+			hits += 1
+			cache.move_to_end(key)
+			return copyResult(cache[key])
+		misses += 1
+		result = function(fname, *args, **kwargs)
+		cache[key] = copyResult(result)
+		while (len(cache) > maxentries):
+			cache.popitem(last=False)
+		return result
+	return wrapper
@@ -32,41 +32,47 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
+# Mathematical stuff (for data array)
+import numpy
+
 from TIMEleSS.general import multigrainOutputParser
 
 def cropFLT(grainfile, oldfltfile, newfltfile, verbose):
+	"""
+	Creates a new FLT file without the peaks assigned to grains in a GrainSpotter log
 
-	grains = multigrainOutputParser.parse_GrainSpotter_log(grainfile)
+	The FLT file is not loaded in memory. IDs of indexed peaks are collected from the grains and the FLT
+	file is then streamed through a filter, line by line, directly into the new file.
+	"""
+
+	with instrumentation.stage("parse"):
+		grains = multigrainOutputParser.parse_GrainSpotter_log(grainfile)
 	print("Parsed grains from %s" % grainfile)
 	print("Number of grains: %d" % len(grains))
 	
-	[peaksflt,idlist,header] = multigrainOutputParser.parseFLT(oldfltfile)
-
 	print("Removing peaks which have been assigned to grains in %s" % grainfile)
 
-	for grain in grains:
+	with instrumentation.stage("remove"):
+		# Sometimes, GrainSpotter indexes the same peak twice. Those double indexings are removed by numpy.unique
+		[peaks, offsets] = multigrainOutputParser.indexedPeaksTable(grains)
+		peakid = numpy.unique(peaks['peakid'])
 		if (verbose):
-			print("Looking at grain %s" % grain.getName())
-		peaks = grain.getPeaks()
-		# Sometimes, GrainSpotter indexes the same peak twice. We need to remove those double indexings
-		peakid = []
-		for peak in peaks:
-			peakid.append(peak.getPeakID())
-		peakid = list(set(peakid)) # remove duplicates, may loose the ordering but we do not care
-		# Removing assign peaks from the list of peaks
-		for thisid in peakid:
-			index = idlist.index(thisid)
-			if (verbose):
-				print("Trying to remove peak %d from the list of peaks" % thisid)
-			try:
-				del idlist[index]
-				del peaksflt[index]
-			except IndexError:
-				print("Failed removing peak ID %d which was found in grain %s" % (thisid, grain.getName()))
-				return
-	# print len(peaksflt)
-
-	multigrainOutputParser.saveFLT(peaksflt, header, newfltfile)
+			for i in range(len(grains)):
+				print("Looking at grain %s" % grains[i].getName())
+				for thisid in numpy.unique(peaks['peakid'][offsets[i]:offsets[i+1]]):
+					print("Trying to remove peak %d from the list of peaks" % thisid)
+		[found, header, lines] = multigrainOutputParser.filterFLT(oldfltfile, peakid, newfltfile, keep=False)
+
+	# Peaks assigned to grains which are not in the FLT file: the new file is not valid
+	missing = numpy.flatnonzero(~numpy.isin(peaks['peakid'], found))
+	if (len(missing) > 0):
+		i = missing[0]
+		print("Failed removing peak ID %d which was found in grain %s" % (peaks['peakid'][i], grains[peaks['grain'][i]].getName()))
+		os.remove(newfltfile)
+		return
 
 
 #################################################################
@@ -100,7 +106,9 @@ def main(argv):
 	
 	parser.add_argument('-v', '--verbose', required=False, help="Write out more details about what it does. Default is  Default is %(default)s", type=bool, default=False)
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "ClearFLTGrains")
 
 	gsfile = args['gsfile']
 	oldFLT = args['oldFLT']
@@ -32,46 +32,53 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 from TIMEleSS.general import multigrainOutputParser
 
 def cropGVE(grainfile, oldgvefile, newgvefile, verbose, skipbogus,saveIndexedGVEFile):
 
-	grains = multigrainOutputParser.parse_GrainSpotter_log(grainfile,skipbogus)
+	with instrumentation.stage("parse"):
+		grains = multigrainOutputParser.parse_GrainSpotter_log(grainfile,skipbogus)
 	print("Parsed grains from %s" % grainfile)
 	print("Number of grains: %d" % len(grains))
 	
-	[peaksgve,idlist,header] = multigrainOutputParser.parseGVE(oldgvefile)
+	with instrumentation.stage("parse"):
+		[peaksgve,idlist,header] = multigrainOutputParser.parseGVE(oldgvefile)
 
 	print("Removing peaks which have been assigned to grains in %s" % grainfile)
 	if (saveIndexedGVEFile != None):
 		print ("Indexed GVE's will be saved into %s" % saveIndexedGVEFile)
 	
 	indexedGVE = []
-	for grain in grains:
-		if (verbose):
-			print("Looking at grain %s" % grain.getName())
-		peaks = grain.getPeaks()
-		# Sometimes, GrainSpotter indexes the same peak twice. We need to remove those double indexings
-		peakid = []
-		for peak in peaks:
-			peakid.append(peak.getPeakID())
-		peakid = list(set(peakid)) # remove duplicates, may loose the ordering but we do not care
-		# Removing assign peaks from the list of g-vectors
-		for thisid in peakid:
-			try:
-				index = idlist.index(thisid)
-			except:
-				print("Failed removing g-vector ID %d which was found in grain %s" % (thisid, grain.getName()))
-				return
+	with instrumentation.stage("remove"):
+		for grain in grains:
 			if (verbose):
-				print("Trying to remove peak %d from the list of g-vectors" % thisid)
-			del idlist[index]
-			indexedGVE.append(peaksgve[index])
-			del peaksgve[index]
-
-	multigrainOutputParser.saveGVE(peaksgve, header, newgvefile)
-	if (saveIndexedGVEFile != None):
-		multigrainOutputParser.saveGVE(indexedGVE, header, saveIndexedGVEFile)
+				print("Looking at grain %s" % grain.getName())
+			peaks = grain.getPeaks()
+			# Sometimes, GrainSpotter indexes the same peak twice. We need to remove those double indexings
+			peakid = []
+			for peak in peaks:
+				peakid.append(peak.getPeakID())
+			peakid = list(set(peakid)) # remove duplicates, may loose the ordering but we do not care
+			# Removing assign peaks from the list of g-vectors
+			for thisid in peakid:
+				try:
+					index = idlist.index(thisid)
+				except:
+					print("Failed removing g-vector ID %d which was found in grain %s" % (thisid, grain.getName()))
+					return
+				if (verbose):
+					print("Trying to remove peak %d from the list of g-vectors" % thisid)
+				del idlist[index]
+				indexedGVE.append(peaksgve[index])
+				del peaksgve[index]
+
+	with instrumentation.stage("write"):
+		multigrainOutputParser.saveGVE(peaksgve, header, newgvefile)
+		if (saveIndexedGVEFile != None):
+			multigrainOutputParser.saveGVE(indexedGVE, header, saveIndexedGVEFile)
 
 
 #################################################################
@@ -107,7 +114,9 @@ def main(argv):
 	parser.add_argument('-s', '--skipbogus', required=False, help="Skip bogus grains in GrainSpotter output. Default is  Default is %(default)s", type=bool, default=False)
 	parser.add_argument('-k', '--keepindexed', required=False, help="Save peaks which were actually indexed. Provide file name. Default is %(default)s", default=None)
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "ClearGVEGrains")
 
 	gsfile = args['gsfile']
 	oldGVE = args['oldGVE']
@@ -32,41 +32,121 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
+# Mathematical stuff (for data array)
+import numpy
+
 from TIMEleSS.general import multigrainOutputParser
 
-def fltGrains(gsfile, oldFLT, newFLT, saveall, verbose=False):
+def fltGrains(gsfile, oldFLT, newFLT, saveall, verbose=False, stream=False, container=None):
+	"""
+	Creates a new FLT file with the peaks assigned to grains in a GrainSpotter log
+	
+	Peaks of indexed grains are located in a typed table of the FLT file, by sorting peak IDs once.
+	Output files are then written from preformatted lines.
+	
+	Parameters:
+	- gsfile: GrainSpotter log
+	- oldFLT: FLT file used for indexing
+	- newFLT: FLT file to create
+	- saveall: if True, also creates one FLT file per grain, newFLT-GrainXXX.flt
+	- verbose: print more details
+	- stream: if True, the FLT file is streamed instead of being loaded in memory (see streamFLTGrains)
+	- container: if set, peaks of each grain are also saved in this single file (see multigrainOutputParser.saveFLTGrains)
+	"""
 
-	grains = multigrainOutputParser.parse_GrainSpotter_log(gsfile)
+	with instrumentation.stage("parse"):
+		grains = multigrainOutputParser.parse_GrainSpotter_log(gsfile)
 	print("Parsed grains from %s" % gsfile)
 	print("Number of grains: %d" % len(grains))
 	
-	[peaksflt,idlist,header] = multigrainOutputParser.parseFLT(oldFLT)
+	if (stream):
+		streamFLTGrains(grains, gsfile, oldFLT, newFLT, saveall, verbose, container)
+		return
+	
+	with instrumentation.stage("parse"):
+		[peaksflt,lines,header] = multigrainOutputParser.parseFLTLines(oldFLT)
 
 	print("Detecting peaks which have been assigned to grains in %s" % gsfile)
 	basename, file_extension = os.path.splitext(newFLT)
 
-	newpeaksflt = []
-	for grain in grains:
-		peaksgrain = []
-		if (verbose):
-			print("Looking at grain %s" % grain.getName())
-		peaks = grain.getPeaks()
-		for peak in peaks:
-			if (verbose):
-				print("Trying to get info for peak %d from the list of peaks" % peak.getPeakID())
-			try:
-				index = idlist.index(peak.getPeakID())
-			except IndexError:
-				print("Failed to locate peak ID %d which was found in grain %s" % (peak.getPeakID(), grain.getName()))
-				return
-			newpeaksflt.append(peaksflt[index])
-			peaksgrain.append(peaksflt[index])
+	with instrumentation.stage("select"):
+		# Indexed peaks, sorted by grain, and their position in the FLT file
+		[peaks, offsets] = multigrainOutputParser.indexedPeaksTable(grains)
+		fltorder = numpy.argsort(peaksflt['spot3d_id'], kind='stable')
+		fltid = peaksflt['spot3d_id'][fltorder]
+		index = multigrainOutputParser.rowsForIDs(fltid, fltorder, peaks['peakid'])
+		if (not numpy.all(index >= 0)):
+			i = numpy.flatnonzero(index < 0)[0]
+			print("Failed to locate peak ID %d which was found in grain %s" % (peaks['peakid'][i], grains[peaks['grain'][i]].getName()))
+			return
+		grainlines = lines[index]
+
+	with instrumentation.stage("write"):
+		f = open(newFLT, 'w')
+		f.write(header + "".join(grainlines))
+		f.close()
+		print ("Saved list of %i peaks into flt file %s" % (len(grainlines), newFLT))
 		if (saveall):
-			grainfltname = basename + "-" + grain.getName() + ".flt"
-			multigrainOutputParser.saveFLT(peaksgrain, header, grainfltname)
-		#print len(newpeaksflt)
+			saveGrainFLT(grains, grainlines, offsets, header, basename, verbose)
+		if (container != None):
+			multigrainOutputParser.saveFLTGrains(container, peaksflt[index], offsets, [grain.getName() for grain in grains], header)
+
 
-	multigrainOutputParser.saveFLT(newpeaksflt, header, newFLT)
+def streamFLTGrains(grains, gsfile, oldFLT, newFLT, saveall, verbose, container=None):
+	"""
+	Same as fltGrains, but the FLT file is streamed through a filter instead of being loaded in memory.
+	Memory is bounded by the number of indexed peaks, not by the size of the FLT file.
+	
+	Peaks are saved in the order of the FLT file, and only once, even if they were assigned to more than
+	one grain. Files for individual grains (saveall) list peaks in the order of the grain, as in fltGrains.
+	"""
+	print("Detecting peaks which have been assigned to grains in %s" % gsfile)
+	basename, file_extension = os.path.splitext(newFLT)
+	
+	with instrumentation.stage("select"):
+		[peaks, offsets] = multigrainOutputParser.indexedPeaksTable(grains)
+		[found, header, lines] = multigrainOutputParser.filterFLT(oldFLT, peaks['peakid'], newFLT, keep=True, collect=(saveall or (container != None)))
+	
+	missing = numpy.flatnonzero(~numpy.isin(peaks['peakid'], found))
+	if (len(missing) > 0):
+		i = missing[0]
+		print("Failed to locate peak ID %d which was found in grain %s" % (peaks['peakid'][i], grains[peaks['grain'][i]].getName()))
+		os.remove(newFLT)
+		return
+	
+	if (lines is not None):
+		with instrumentation.stage("write"):
+			grainlines = [lines[thisid] for thisid in peaks['peakid'].tolist()]
+			if (saveall):
+				saveGrainFLT(grains, grainlines, offsets, header, basename, verbose)
+			if (container != None):
+				table = multigrainOutputParser.fltTableFromLines(grainlines, header)
+				multigrainOutputParser.saveFLTGrains(container, table, offsets, [grain.getName() for grain in grains], header)
+
+
+def saveGrainFLT(grains, grainlines, offsets, header, basename, verbose):
+	"""
+	Saves one FLT file per grain, basename-GrainXXX.flt
+	
+	Parameters:
+	- grains: list of grains
+	- grainlines: formatted lines for the indexed peaks, sorted by grain
+	- offsets: lines of grain i are in grainlines[offsets[i]:offsets[i+1]]
+	- header: FLT header line
+	- basename: start of the file names
+	- verbose: print more details
+	"""
+	for i in range(0,len(grains)):
+		if (verbose):
+			print("Looking at grain %s" % grains[i].getName())
+		grainfltname = basename + "-" + grains[i].getName() + ".flt"
+		f = open(grainfltname, 'w')
+		f.write(header + "".join(grainlines[offsets[i]:offsets[i+1]]))
+		f.close()
+		print ("Saved list of %i peaks into flt file %s" % (offsets[i+1]-offsets[i], grainfltname))
 
 
 #################################################################
@@ -99,16 +179,22 @@ def main(argv):
 	parser.add_argument('newFLT',  help="Name of FLT file to be created (required)")
 	
 	parser.add_argument('-a', '--saveall', required=False, help="This option will create a different file for each grain in the Grain Spotter output file. File naming will be newFLT-GrainXXX.flt. Default is  Default is %(default)s", type=bool, default=False)
+	parser.add_argument('-c', '--container', required=False, help="Also save the peaks of each grain in this single file, for tools reading grains in random order. HDF5 with one group per grain if the name ends with .h5 or .hdf5 (needs h5py), numpy npz with a grain-offset index otherwise. Default is %(default)s", default=None)
+	parser.add_argument('-s', '--stream', required=False, action='store_true', help="Stream the FLT file instead of loading it in memory, for very large files. Peaks are saved in the order of the FLT file, and only once.")
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "SaveFLTGrains")
 
 	gsfile = args['gsfile']
 	oldFLT = args['oldFLT']
 	newFLT = args['newFLT']
 	saveall = args['saveall']
+	stream = args['stream']
+	container = args['container']
 
 
-	fltGrains(gsfile, oldFLT, newFLT, saveall)
+	fltGrains(gsfile, oldFLT, newFLT, saveall, stream=stream, container=container)
 
 
 # Calling method 1 (used when generating a binary in setup.py)
@@ -33,14 +33,18 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # Maths stuff
 import numpy
 
 # TIMEleSS parsing utilities
 from TIMEleSS.general import multigrainOutputParser
 
-# Will use to crystallography functions in xfab.symmetry
-import xfab.symmetry
+# Orientations and misorientations. matchGrains and minMisorientation used to be defined here
+from TIMEleSS.general import orientation
+from TIMEleSS.general.orientation import matchGrains, minMisorientation
 
 
 #################################################################
@@ -122,83 +126,73 @@ numpy.
 
 #################################################################
 #
-# Compare the orientation matrices of two grains and check whether they can be the same grain
+# One to one assignment of grains between 2 collections
 #
 #################################################################
 
-def matchGrains(U1, U2, crystal_system, cutoff):
+def assignGrains(U1, U2, crystal_system, cutoff):
 	"""
-	Compare the orientation matrices of two grains and check whether they can be the same grain
-	This is a very crude version that does not pay attention to all symmetry equivalents. It might be
-	a problem for some high symmetry cubic phases
-	
-	Relies on Umis function in xfab
+	One to one assignment of grains between 2 collections of grains
 	
-	Returns True if one of the equivalent has a mis-orientation below 2°
+	Pairs of grains with a misorientation below cutoff form a sparse bipartite graph. Groups of connected grains
+	with a single pair are matched directly. Larger groups (ambiguous clusters, where a grain is close to more
+	than one grain of the other collection) are solved with a linear sum assignment, which maximizes the number of 
+	matched pairs and then minimizes the sum of misorientations.
 	
-	crystal_system can be one of the following values  
-		1: Triclinic
-		2: Monoclinic
-		3: Orthorhombic
-		4: Tetragonal
-		5: Trigonal
-		6: Hexagonal
-		7: Cubic
-		
 	Parameters:
-	  U1 - U matrix of grain 1
-	  U2 - U matrix of grain 2
-	  crystal_system
-	  cutoff: mis-orientation below which the two grains are considered identical, in degrees (default is 2°)
-	"""
-
-	# Ur = scipy.dot(scipy.linalg.inv(U2),U1)
-	#if (1-abs(Ur[0,0]) < 0.002) and (1-abs(Ur[1,1]) < 0.002) and (1-abs(Ur[1,1]) < 0.002) :
-	#	return True
-	
-	test = xfab.symmetry.Umis(U1, U2, crystal_system)
-	minMisorientation = min(test[:,1])
-	if abs(minMisorientation < cutoff):
-		return True
-	return False
-
-
-#################################################################
-#
-# Compare the orientation matrices of two grains and return the minimal misorientation
-#
-#################################################################
-
-def minMisorientation(U1,U2,crystal_system):
-	"""
-	Compare the orientation matrices of two grains and return the minimal misorientation
-	This is a very crude version that does not pay attention to all symmetry equivalents. It might be
-	a problem for some high symmetry cubic phases
-	
-	Relies on Umis function in xfab
-	
-	Returns the minimal misorientation
+	  U1 - U matrices of the first collection of grains (reference), (N1,3,3) array
+	  U2 - U matrices of the second collection of grains, (N2,3,3) array
+	  crystal_system - see TIMEleSS.general.orientation
+	  cutoff - mis-orientation below which the two grains are considered identical, in degrees
 	
-	crystal_system can be one of the following values  
-		1: Triclinic
-		2: Monoclinic
-		3: Orthorhombic
-		4: Tetragonal
-		5: Trigonal
-		6: Hexagonal
-		7: Cubic
-		
-	Parameters:
-	  U1 - U matrix of grain 1
-	  U2 - U matrix of grain 2
-	  crystal_system
+	Returns [matches, clusters, missing, spurious]
+	  - matches: list of [i1, i2, misorientation] for matched grains, sorted by i2
+	  - clusters: list of [indices in U1, indices in U2] for ambiguous clusters
+	  - missing: indices of grains in U1 with no match in U2
+	  - spurious: indices of grains in U2 with no match in U1
 	"""
-
-	# Ur = scipy.dot(scipy.linalg.inv(U2),U1)
-	#if (1-abs(Ur[0,0]) < 0.002) and (1-abs(Ur[1,1]) < 0.002) and (1-abs(Ur[1,1]) < 0.002) :
-	#	return True
-	test = xfab.symmetry.Umis(U1, U2, crystal_system)
-	return  min(test[:,1])
+	import scipy.sparse
+	import scipy.sparse.csgraph
+	import scipy.optimize
+	n1 = len(U1)
+	n2 = len(U2)
+	[i1, i2, angle] = orientation.closeOrientations(U1, U2, crystal_system, cutoff)
+	# Connected groups of grains, grains of U2 are numbered from n1
+	graph = scipy.sparse.coo_matrix((numpy.ones(len(i1)), (i1, i2+n1)), shape=(n1+n2,n1+n2))
+	[ngroups, labels] = scipy.sparse.csgraph.connected_components(graph, directed=False)
+	group = labels[i1]
+	npairs = numpy.bincount(group, minlength=ngroups)
+	# Groups with a single pair
+	single = (npairs[group] == 1)
+	matched1 = list(i1[single])
+	matched2 = list(i2[single])
+	matchedangle = list(angle[single])
+	# Ambiguous clusters
+	clusters = []
+	order = numpy.argsort(group[~single], kind='stable')
+	ci1 = i1[~single][order]
+	ci2 = i2[~single][order]
+	cangle = angle[~single][order]
+	limits = numpy.flatnonzero(numpy.diff(group[~single][order])) + 1
+	for [a1, a2, aangle] in zip(numpy.split(ci1, limits), numpy.split(ci2, limits), numpy.split(cangle, limits)):
+		if (len(a1) == 0):
+			continue
+		[rows, r] = numpy.unique(a1, return_inverse=True)
+		[cols, c] = numpy.unique(a2, return_inverse=True)
+		# Pairs above the cutoff are given a cost larger than any set of pairs below the cutoff
+		cost = numpy.full((len(rows),len(cols)), cutoff*(len(a1)+1))
+		cost[r,c] = aangle
+		[ar, ac] = scipy.optimize.linear_sum_assignment(cost)
+		valid = cost[ar,ac] < cutoff
+		matched1.extend(rows[ar[valid]])
+		matched2.extend(cols[ac[valid]])
+		matchedangle.extend(cost[ar[valid],ac[valid]])
+		clusters.append([rows.tolist(), cols.tolist()])
+	order = numpy.argsort(matched2, kind='stable')
+	matches = [[int(matched1[k]), int(matched2[k]), float(matchedangle[k])] for k in order]
+	missing = numpy.setdiff1d(numpy.arange(n1), numpy.array(matched1, dtype=numpy.int64)).tolist()
+	spurious = numpy.setdiff1d(numpy.arange(n2), numpy.array(matched2, dtype=numpy.int64)).tolist()
+	return [matches, clusters, missing, spurious]
 
 
 #################################################################
@@ -244,21 +238,18 @@ def removeDoubleGrains(grains, crystal_system, cutoff, logfile):
 	  logfile - link to log file
 	"""
 	
-	# find double grains
+	# find double grains, all pairs of grains are compared at once
+	[first, second, angle] = orientation.closeOrientations(orientation.orientationArray(grains), orientation.orientationArray(grains), crystal_system, cutoff)
 	grainsToRemove = []
 	pairs = []
-	for i in range(0, len(grains)):
-		for j in range((i+1), len(grains)):
-			U1 = (grains[i]).getU()
-			U2 = (grains[j]).getU()
-			if (matchGrains(U1,U2,crystal_system,cutoff)):
-				grainsToRemove.append(j)
-				pairs.append([i,j])
-				logit(logfile,"- grain %d and %d are identical" % (i, j))
+	for [i,j] in zip(first.tolist(), second.tolist()):
+		if (j > i):
+			grainsToRemove.append(j)
+			pairs.append([i,j])
+			logit(logfile,"- grain %d and %d are identical" % (i, j))
 	
 	# Remove those grains
-	grainsToRemove.sort()
-	grainsToRemove = unique(grainsToRemove)
+	grainsToRemove = list(unique(grainsToRemove))
 	grainsToRemove.sort()
 	grainsToRemove.reverse()
 	nRemove = len(grainsToRemove)
@@ -277,7 +268,7 @@ def removeDoubleGrains(grains, crystal_system, cutoff, logfile):
 #
 #################################################################
 
-def comparaison(file1, file2, crystal_system, cutoff, outputstem, verbose):
+def comparaison(file1, file2, crystal_system, cutoff, outputstem, verbose, assignment=False):
 	"""
 	Function designed to compare the orientations of 2 collections of grains.
 
@@ -304,6 +295,7 @@ def comparaison(file1, file2, crystal_system, cutoff, outputstem, verbose):
 	  outputstem - stem for output file for the grain comparison
 	  cutoff - mis-orientation below which the two grains are considered identical, in degrees
 	  verbose - save all grain comparison into an output file rather than only matching or non matching grain
+	  assignment - if True, grains are matched with a one to one assignment (see assignGrains) rather than by searching a single match for each grain of file2
 	"""
 	
 	# Prepare output files
@@ -315,6 +307,9 @@ def comparaison(file1, file2, crystal_system, cutoff, outputstem, verbose):
 	logerroneous = open(filename3,'w')
 	filename4 = "%s-%s" % (outputstem , "missing-grains.dat")
 	logmissing = open(filename4,'w')
+	if (assignment):
+		filename6 = "%s-%s" % (outputstem , "ambiguous-grains.dat")
+		logambiguous = open(filename6,'w')
 	if (not verbose):
 		print("4 output files will be generated: \n- %s,\n- %s,\n- %s,\n- %s\n" % (filename1, filename2, filename3, filename4))
 	else:
@@ -322,8 +317,9 @@ def comparaison(file1, file2, crystal_system, cutoff, outputstem, verbose):
 		logverbose = open(filename5,'w')
 	
 	# Counting number of grains
-	grains1 = multigrainOutputParser.parseGrains(file1)
-	grains2 = multigrainOutputParser.parseGrains(file2)
+	with instrumentation.stage("parse"):
+		grains1 = multigrainOutputParser.parseGrains(file1)
+		grains2 = multigrainOutputParser.parseGrains(file2)
 	ngrains1 = len(grains1)
 	ngrains2 = len(grains2)
 	logit(logfile, "Parsed %s, found %d grains" % (file1, len(grains1)))
@@ -333,67 +329,120 @@ def comparaison(file1, file2, crystal_system, cutoff, outputstem, verbose):
 
 	# Check for doubles in list 1
 	logit(logfile, "Check for doubles in %s" % file1)
-	grains1clean = removeDoubleGrains(grains1, crystal_system, cutoff, logfile)
+	with instrumentation.stage("doubles"):
+		grains1clean = removeDoubleGrains(grains1, crystal_system, cutoff, logfile)
 	logit(logfile, "")
 	
 	# Check for doubles in list 2
 	logit(logfile, "Check for doubles in %s" % file2)
-	grains2clean = removeDoubleGrains(grains2, crystal_system, cutoff, logfile)
+	with instrumentation.stage("doubles"):
+		grains2clean = removeDoubleGrains(grains2, crystal_system, cutoff, logfile)
 	logit(logfile, "")
 	
-	# Loop in unique grains in list 1, trying to find pairs in list 2
-	goodGrains = [] # grains in list 2 that exist in list 1
-	erroneousGrains = [] # grains in list 2 that do not exist in list 1
-	grains1cleanFound = numpy.full((len(grains1clean),1), False, dtype=bool)
-	logit(logfile, "Trying to match grains between the 2 collections...")
-	for i in range(0,len(grains2clean)):
-		grainMatched = []
-		grain2 = grains2clean[i]
-		U2 = grain2.getU()
-		for j in range(0,len(grains1clean)):
-			grain1 = grains1clean[j]
-			U1 = grain1.getU()
-			if (verbose): # We provide an output file all comparisons
-				angle = minMisorientation(U1,U2,crystal_system)
-				logverbose.write("Grain %s of %s\n" % (grain1.getName(), file1))
-				logverbose.write("\tcompared with grain %s of %s\n" % (grain2.getName(), file2))
-				logverbose.write("\tmisorientation: %.2f°\n" % (angle))
-				logverbose.write("U grain 1: \n" + numpy.array2string(U1) + "\n")
-				logverbose.write("U grain 2: \n" + numpy.array2string(U2) + "\n")
-				logverbose.write("\n\n")
-			if (matchGrains(U1, U2, crystal_system, cutoff)):
-				grainMatched.append(j)
-				grains1cleanFound[j] = True
-		if len(grainMatched) > 1 :
-			logit(logfile, "- Found more than 1 pair for grain %d. Something is wrong" % i)
-			sys.exit(2)
-		elif len(grainMatched) > 0 :
-			goodGrains.append(i)
-			grain1 = grains1clean[grainMatched[0]]
-			U1 = grain1.getU()
-			angle = minMisorientation(U1,U2,crystal_system)
+	U1clean = orientation.orientationArray(grains1clean)
+	U2clean = orientation.orientationArray(grains2clean)
+	if (assignment):
+		# One to one assignment between unique grains in both lists
+		logit(logfile, "Assigning grains between the 2 collections...")
+		with instrumentation.stage("match"):
+			[matches, clusters, missing, spurious] = assignGrains(U1clean, U2clean, crystal_system, cutoff)
+		goodGrains = [i2 for [i1, i2, angle] in matches]
+		erroneousGrains = spurious
+		if (verbose): # We provide an output file all comparisons
+			for [first, block] in orientation.misorientationBlocks(U1clean, U2clean, crystal_system):
+				for j in range(0,len(block)):
+					grain1 = grains1clean[first+j]
+					for i in range(0,len(grains2clean)):
+						grain2 = grains2clean[i]
+						logverbose.write("Grain %s of %s\n" % (grain1.getName(), file1))
+						logverbose.write("\tcompared with grain %s of %s\n" % (grain2.getName(), file2))
+						logverbose.write("\tmisorientation: %.2f°\n" % (block[j,i]))
+						logverbose.write("U grain 1: \n" + numpy.array2string(U1clean[first+j]) + "\n")
+						logverbose.write("U grain 2: \n" + numpy.array2string(U2clean[i]) + "\n")
+						logverbose.write("\n\n")
+		for [i1, i2, angle] in matches:
+			grain1 = grains1clean[i1]
+			grain2 = grains2clean[i2]
 			logit(logfile, "- Grain %s of %s matches %s of %s with a misorientation of %.2f°" % (grain1.getName(), file1, grain2.getName(), file2, angle))
 			logmatching.write("Grain %s of %s\n" % (grain1.getName(), file1))
 			logmatching.write("\tmatches grain %s of %s\n" % (grain2.getName(), file2))
 			logmatching.write("\tmisorientation: %.2f°\n" % (angle))
-			logmatching.write("U grain 1: \n" + numpy.array2string(U1) + "\n")
-			logmatching.write("U grain 2: \n" + numpy.array2string(U2) + "\n")
+			logmatching.write("U grain 1: \n" + numpy.array2string(grain1.getU()) + "\n")
+			logmatching.write("U grain 2: \n" + numpy.array2string(grain2.getU()) + "\n")
 			logmatching.write("\n\n")
-		else:
-			erroneousGrains.append(i)
+		for [rows, cols] in clusters:
+			names1 = [grains1clean[i].getName() for i in rows]
+			names2 = [grains2clean[i].getName() for i in cols]
+			logit(logfile, "- Ambiguous cluster: grains %s of %s and grains %s of %s are within %.1f°" % (", ".join(names1), file1, ", ".join(names2), file2, cutoff))
+			logambiguous.write("Cluster of %d grains of %s and %d grains of %s\n" % (len(rows), file1, len(cols), file2))
+			angles = orientation.misorientationMatrix(U1clean[rows], U2clean[cols], crystal_system)
+			for j in range(0,len(rows)):
+				for i in range(0,len(cols)):
+					logambiguous.write("- Grain %s of %s and grain %s of %s: misorientation %.2f°\n" % (names1[j], file1, names2[i], file2, angles[j,i]))
+			logambiguous.write("\n")
+		[nearest, nearestangle] = orientation.nearestOrientations(U2clean[spurious], U1clean, crystal_system)
+		for k in range(0,len(spurious)):
+			grain2 = grains2clean[spurious[k]]
 			logit(logfile, "- Grain %s of %s has no match" % (grain2.getName(), file2))
 			logerroneous.write("\nGrain %s of %s: no match\n" % (grain2.getName(), file2))
-			for j in range(0, len(grains1clean)):
-				grain1 = grains1clean[j]
-				U1 = grain1.getU()
-				angle = minMisorientation(U1,U2,crystal_system)
-				logerroneous.write("- Min angle with grain %s: %.2f°\n" % (grain1.getName(),angle))
-	logit(logfile, "End of run\n")
-	
-	for i in range(0,len(grains1clean)):
-		if (not grains1cleanFound[i]):
+			if (len(grains1clean) > 0):
+				logerroneous.write("- Min angle with grain %s: %.2f°\n" % (grains1clean[nearest[k]].getName(),nearestangle[k]))
+		logit(logfile, "End of run\n")
+		for i in missing:
 			grain1 = grains1clean[i]
 			logmissing.write("Grain %s of %s has no match\n" % (grain1.getName(), file1))
+	else:
+		# Loop in unique grains in list 1, trying to find pairs in list 2
+		goodGrains = [] # grains in list 2 that exist in list 1
+		erroneousGrains = [] # grains in list 2 that do not exist in list 1
+		grains1cleanFound = numpy.full((len(grains1clean),1), False, dtype=bool)
+		logit(logfile, "Trying to match grains between the 2 collections...")
+		with instrumentation.stage("match"):
+			# Misorientations with all grains in list 1, calculated for blocks of grains in list 2
+			for [first, block] in orientation.misorientationBlocks(U2clean, U1clean, crystal_system):
+				for k in range(0,len(block)):
+					i = first + k
+					angles = block[k]
+					grain2 = grains2clean[i]
+					U2 = U2clean[i]
+					if (verbose): # We provide an output file all comparisons
+						for j in range(0,len(grains1clean)):
+							grain1 = grains1clean[j]
+							logverbose.write("Grain %s of %s\n" % (grain1.getName(), file1))
+							logverbose.write("\tcompared with grain %s of %s\n" % (grain2.getName(), file2))
+							logverbose.write("\tmisorientation: %.2f°\n" % (angles[j]))
+							logverbose.write("U grain 1: \n" + numpy.array2string(U1clean[j]) + "\n")
+							logverbose.write("U grain 2: \n" + numpy.array2string(U2) + "\n")
+							logverbose.write("\n\n")
+					grainMatched = numpy.flatnonzero(angles < cutoff)
+					grains1cleanFound[grainMatched] = True
+					if len(grainMatched) > 1 :
+						logit(logfile, "- Found more than 1 pair for grain %d. Something is wrong, try the assignment mode (-a)" % i)
+						sys.exit(2)
+					elif len(grainMatched) > 0 :
+						goodGrains.append(i)
+						grain1 = grains1clean[grainMatched[0]]
+						U1 = U1clean[grainMatched[0]]
+						angle = angles[grainMatched[0]]
+						logit(logfile, "- Grain %s of %s matches %s of %s with a misorientation of %.2f°" % (grain1.getName(), file1, grain2.getName(), file2, angle))
+						logmatching.write("Grain %s of %s\n" % (grain1.getName(), file1))
+						logmatching.write("\tmatches grain %s of %s\n" % (grain2.getName(), file2))
+						logmatching.write("\tmisorientation: %.2f°\n" % (angle))
+						logmatching.write("U grain 1: \n" + numpy.array2string(U1) + "\n")
+						logmatching.write("U grain 2: \n" + numpy.array2string(U2) + "\n")
+						logmatching.write("\n\n")
+					else:
+						erroneousGrains.append(i)
+						logit(logfile, "- Grain %s of %s has no match" % (grain2.getName(), file2))
+						logerroneous.write("\nGrain %s of %s: no match\n" % (grain2.getName(), file2))
+						for j in range(0, len(grains1clean)):
+							logerroneous.write("- Min angle with grain %s: %.2f°\n" % (grains1clean[j].getName(),angles[j]))
+		logit(logfile, "End of run\n")
+	
+		for i in range(0,len(grains1clean)):
+			if (not grains1cleanFound[i]):
+				grain1 = grains1clean[i]
+				logmissing.write("Grain %s of %s has no match\n" % (grain1.getName(), file1))
 	
 	logit(logfile, "N. of grains in %s: %d" % (file1, ngrains1))
 	logit(logfile, "N. of unique grains in %s: %d" % (file1, len(grains1clean)))
@@ -402,6 +451,8 @@ def comparaison(file1, file2, crystal_system, cutoff, outputstem, verbose):
 	logit(logfile, "N. of unique grains found in both %s and %s: %d" % (file1, file2, len(goodGrains)))
 	logit(logfile, "N. of unique grains found only in %s: %d" % (file2, len(erroneousGrains)))
 	logit(logfile, "N. of unique grains found in %s but not in %s: %d" % (file1, file2, len(grains1clean)-len(goodGrains)))
+	if (assignment):
+		logit(logfile, "N. of ambiguous clusters: %d" % (len(clusters)))
 	logit(logfile, "\nIndexing capability")
 	logit(logfile, "- %.1f pc of %s grains indexed" % (100.*len(goodGrains)/len(grains1clean), file1))
 	logit(logfile, "- %.1f pc of %s grains not indexed" % (100.-100.*len(goodGrains)/len(grains1clean), file1))
@@ -418,6 +469,9 @@ def comparaison(file1, file2, crystal_system, cutoff, outputstem, verbose):
 	logmissing.close()
 	if (verbose):
 		logverbose.close()
+	if (assignment):
+		logambiguous.close()
+		print ("Ambiguous clusters saved in %s\n" % (filename6))
 
 
 #################################################################
@@ -452,8 +506,12 @@ def main(argv):
 	parser.add_argument('-m', '--misorientation', required=False, help="Misorientation below which two grains are considered identical, in degrees. Default is %(default)s", default=2.0, type=float)
 	
 	parser.add_argument('-v', '--verbose', required=False, help="Create output file with verbose grain comparison. Can be True or False. Default is  Default is %(default)s", type=bool, default=False)
+	
+	parser.add_argument('-a', '--assignment', required=False, action='store_true', help="One to one assignment of grains, solved with a linear sum assignment. Grains close to more than one grain of the other file are reported as ambiguous clusters instead of stopping the comparison.")
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "GrainComparison")
 
 	file1 = args['file1']
 	file2 = args['file2']
@@ -461,6 +519,7 @@ def main(argv):
 	stem = args['output_stem']
 	cutoff = args['misorientation']
 	verbose = args['verbose']
+	assignment = args['assignment']
 	
 	if (not(os.path.isfile(file1))):
 		print(("Error: file %s not found" % file1))
@@ -470,7 +529,7 @@ def main(argv):
 		print(("Error: file %s not found" % file2))
 		sys.exit(2)
 
-	comparaison(file1, file2, crystal_system, cutoff, stem, verbose)
+	comparaison(file1, file2, crystal_system, cutoff, stem, verbose, assignment)
 
 
 # Calling method 1 (used when generating a binary in setup.py)
@@ -29,172 +29,20 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # Maths stuff
 import numpy
 
 # TIMEleSS parsing utilities
 from TIMEleSS.general import multigrainOutputParser
 
-# Will use to crystallography functions in xfab.symmetry
-import xfab.symmetry
-
-
-#################################################################
-#
-# Return a list of the elements in a list, but without duplicates.
-#
-#################################################################
-
-def unique(s):
-    """Return a list of the elements in s, but without duplicates.
-
-    For example, unique([1,2,3,1,2,3]) is some permutation of [1,2,3],
-    unique("abcabc") some permutation of ["a", "b", "c"], and
-    unique(([1, 2], [2, 3], [1, 2])) some permutation of
-    [[2, 3], [1, 2]].
-numpy.
-    For best speed, all sequence elements should be hashable.  Then
-    unique() will usually work in linear time.
-
-    If not possible, the sequence elements should enjoy a total
-    ordering, and if list(s).sort() doesn't raise TypeError it's
-    assumed that they do enjoy a total ordering.  Then unique() will
-    usually work in O(N*log2(N)) time.
-100
-    If that's not possible either, the sequence elements must support
-    equality-testing.  Then unique() will usually work in quadratic
-    time.
-    """
-
-    n = len(s)
-    if n == 0:
-        return []
-
-    # Try using a dict first, as that's the fastest and will usually
-    # work.  If it doesn't work, it will usually fail quickly, so it
-    # usually doesn't cost much to *try* it.  It requires that all the
-    # sequence elements be hashable, and support equality comparison.
-    u = {}
-    try:
-        for x in s:
-            u[x] = 1
-    except TypeError:
-        del u  # move on to the next method
-    else:
-        return u.keys()
-
-    # We can't hash all the elements.  Second fastest is to sort,
-    # which brings the equal elements together; then duplicates are
-    # easy to weed out in a single pass.
-    # NOTE:  Python's list.sort() was designed to be efficient in the
-    # presence of many duplicate elements.  This isn't true of all
-    # sort functions in all languages or libraries, so this approach
-    # is more effective in Python than it may be elsewhere.
-    try:
-        t = list(s)
-        t.sort()#!/usr/bin/env python
-# -*- coding: utf-8 -*-
-
-    except TypeError:
-        del t  # move on to the next method
-    else:
-        assert n > 0
-        last = t[0]
-        lasti = i = 1
-        while i < n:
-            if t[i] != last:
-                t[lasti] = last = t[i]
-                lasti += 1
-            i += 1
-        return t[:lasti]
-
-    # Brute force is all that's left.
-    u = []
-    for x in s:
-        if x not in u:
-            u.append(x)
-    return u
-
-
-#################################################################
-#
-# Compare the orientation matrices of two grains and check whether they can be the same grain
-#
-#################################################################
-
-def matchGrains(U1, U2, crystal_system, cutoff):
-	"""
-	Compare the orientation matrices of two grains and check whether they can be the same grain
-	This is a very crude version that does not pay attention to all symmetry equivalents. It might be
-	a problem for some high symmetry cubic phases
-	
-	Relies on Umis function in xfab
-	
-	Returns True if one of the equivalent has a mis-orientation below 2°
-	
-	crystal_system can be one of the following values  
-		1: Triclinic
-		2: Monoclinic
-		3: Orthorhombic
-		4: Tetragonal
-		5: Trigonal
-		6: Hexagonal
-		7: Cubic
-		
-	Parameters:
-	  U1 - U matrix of grain 1
-	  U2 - U matrix of grain 2
-	  crystal_system
-	  cutoff: mis-orientation below which the two grains are considered identical, in degrees (default is 2°)
-	"""
+# Orientations and misorientations. matchGrains and minMisorientation used to be defined here
+from TIMEleSS.general.orientation import matchGrains, minMisorientation
 
-	# Ur = scipy.dot(scipy.linalg.inv(U2),U1)
-	#if (1-abs(Ur[0,0]) < 0.002) and (1-abs(Ur[1,1]) < 0.002) and (1-abs(Ur[1,1]) < 0.002) :
-	#	return True
-	
-	test = xfab.symmetry.Umis(U1, U2, crystal_system)
-	minMisorientation = min(test[:,1])
-	if abs(minMisorientation < cutoff):
-		return True
-	return False
-
-
-#################################################################
-#
-# Compare the orientation matrices of two grains and return the minimal misorientation
-#
-#################################################################
-
-def minMisorientation(U1,U2,crystal_system):
-	"""
-	Compare the orientation matrices of two grains and return the minimal misorientation
-	This is a very crude version that does not pay attention to all symmetry equivalents. It might be
-	a problem for some high symmetry cubic phases
-	
-	Relies on Umis function in xfab
-	
-	Returns the minimal misorientation
-	
-	crystal_system can be one of the following values  
-		1: Triclinic
-		2: Monoclinic
-		3: Orthorhombic
-		4: Tetragonal
-		5: Trigonal
-		6: Hexagonal
-		7: Cubic
-		
-	Parameters:
-	  U1 - U matrix of grain 1
-	  U2 - U matrix of grain 2
-	  crystal_system
-	"""
-
-	# Ur = scipy.dot(scipy.linalg.inv(U2),U1)
-	#if (1-abs(Ur[0,0]) < 0.002) and (1-abs(Ur[1,1]) < 0.002) and (1-abs(Ur[1,1]) < 0.002) :
-	#	return True
-	test = xfab.symmetry.Umis(U1, U2, crystal_system)
-	return  min(test[:,1])
+# Removal of doubles is shared with the grain comparison
+from TIMEleSS.simulation.grainComparison import removeDoubleGrains
 
 
 #################################################################
@@ -216,56 +64,71 @@ def logit(stream, text):
 
 #################################################################
 #
-# Remove doubles in a collection of grains
+# Inverted index from peaks to grains, and peaks shared between 2 collections of grains
 #
 #################################################################
 
-def removeDoubleGrains(grains, crystal_system, cutoff, logfile):
+def peakIndex(grains):
 	"""
-	Remove doubles in a collection of grains
+	Inverted index from GVE ID to grains, built once for a collection of grains
 	
-	crystal_system can be one of the following values  
-		1: Triclinic
-		2: Monoclinic
-		3: Orthorhombic
-		4: Tetragonal
-		5: Trigonal
-		6: Hexagonal
-		7: Cubic
+	A GVE ID listed twice in the same grain is only counted once.
 	
 	Parameters:
 	  grains - list of grains
-	  crystal_system - see abover
-	  cutoff - mis-orientation below which the two grains are considered identical, in degrees
-	  logfile - link to log file
+	
+	Returns [gveid, grain]: two arrays sorted by GVE ID, then grain, with one entry per (GVE ID, grain) pair. grain is the index of the grain in the list.
+	"""
+	[peaks, offsets] = multigrainOutputParser.indexedPeaksTable(grains)
+	pairs = numpy.zeros((len(peaks), 2), dtype=numpy.int64)
+	if (len(pairs) > 0):
+		pairs[:,0] = peaks['gveid']
+		pairs[:,1] = peaks['grain']
+		pairs = numpy.unique(pairs, axis=0)
+	return [pairs[:,0], pairs[:,1]]
+
+def sharedPeaks(index1, index2):
 	"""
+	Peaks shared between 2 collections of grains, found with a single join of their inverted indexes on GVE ID
 	
-	# find double grains
-	grainsToRemove = []
-	pairs = []
-	for i in range(0, len(grains)):
-		for j in range((i+1), len(grains)):
-			U1 = (grains[i]).getU()
-			U2 = (grains[j]).getU()
-			if (matchGrains(U1,U2,crystal_system,cutoff)):
-				grainsToRemove.append(j)
-				pairs.append([i,j])
-				logit(logfile,"- grain %d and %d are identical" % (i, j))
+	Parameters:
+	  index1 - inverted index for the first collection of grains, from peakIndex
+	  index2 - inverted index for the second collection of grains, from peakIndex
 	
-	# Remove those grains
-	grainsToRemove.sort()
-	grainsToRemove = unique(grainsToRemove)
-	grainsToRemove.sort()
-	grainsToRemove.reverse()
-	nRemove = len(grainsToRemove)
-	newgrains = grains[:]
-	for i in range(0, nRemove):
-		del newgrains[grainsToRemove[i]]
-	# Log and return
-	logit(logfile, "Found %d grains indexed twice" % (nRemove))
-	logit(logfile, "New number of grains: %d" % len(newgrains))
+	Returns [grain1, grain2, gveid]: three arrays, with one entry for each peak seen in grain1 of the first collection and grain2 of the second collection. Sorted by grain1, grain2, and GVE ID.
+	"""
+	[gveid1, grains1] = index1
+	[gveid2, grains2] = index2
+	# For each entry in index 1, range of entries in index 2 with the same GVE ID
+	first = numpy.searchsorted(gveid2, gveid1, side='left')
+	count = numpy.searchsorted(gveid2, gveid1, side='right') - first
+	rows = numpy.repeat(numpy.arange(len(gveid1)), count)
+	cols = numpy.repeat(first - numpy.cumsum(count) + count, count) + numpy.arange(len(rows))
+	grain1 = grains1[rows]
+	grain2 = grains2[cols]
+	gveid = gveid1[rows]
+	order = numpy.lexsort((gveid, grain2, grain1))
+	return [grain1[order], grain2[order], gveid[order]]
+
+def peakOverlap(grains1, grains2):
+	"""
+	Number of peaks shared by each pair of grains between 2 collections of grains
+	
+	Parameters:
+	  grains1 - first list of grains
+	  grains2 - second list of grains
 	
-	return newgrains
+	Returns a sparse matrix (scipy.sparse.csr_matrix) with len(grains1) rows and len(grains2) columns
+	"""
+	[grain1, grain2, gveid] = sharedPeaks(peakIndex(grains1), peakIndex(grains2))
+	return overlapMatrix(grain1, grain2, len(grains1), len(grains2))
+
+def overlapMatrix(grain1, grain2, ngrains1, ngrains2):
+	"""
+	Sparse overlap matrix from the list of shared peaks returned by sharedPeaks
+	"""
+	import scipy.sparse
+	return scipy.sparse.csr_matrix((numpy.ones(len(grain1), dtype=numpy.int64), (grain1, grain2)), shape=(ngrains1, ngrains2))
 
 #################################################################
 #
@@ -300,6 +163,8 @@ def comparaison(file1, file2, crystal_system, cutoff, outputstem):
 	  crystal_system - see abover
 	  outputstem - stem for output file for the grain comparison
 	  cutoff - mis-orientation below which the two grains are considered identical, in degrees
+	
+	Returns the number of peaks shared by each pair of unique grains, as a sparse matrix (see peakOverlap)
 	"""
 	
 	# Prepare output files
@@ -327,36 +192,40 @@ def comparaison(file1, file2, crystal_system, cutoff, outputstem):
 	grains2clean = removeDoubleGrains(grains2, crystal_system, cutoff, logfile)
 	logit(logfile, "")
 	
+	# Inverted index from peaks to grains, for each list, and join on GVE ID
+	with instrumentation.stage("index"):
+		[grain1, grain2, gveid] = sharedPeaks(peakIndex(grains1clean), peakIndex(grains2clean))
+		overlap = overlapMatrix(grain1, grain2, len(grains1clean), len(grains2clean))
+	
 	# Will hold grains that match a peak
 	peaksInGrains = {}
 	
-	# Loop in unique grains in list 1, trying to grains in list 2 that share the same peaks
-	for i in range(0,len(grains1clean)):
-		grain1 = grains1clean[i]
-		grains1GVEID = grain1.getPeaksGVEID()
-		for j in range(0,len(grains2clean)):
-			grain2 = grains2clean[j]
-			grains2GVEID = grain2.getPeaksGVEID()
-			matches = set(grains1GVEID).intersection(grains2GVEID)
-			if (len(matches)>0):
-				logit(logfile, "- Grain %s of %s shares %d peaks with %s of %s" % (grain1.getName(), file1, len(matches), grain2.getName(), file2))
-				logit(logfile, "Matching peaks (GVE ID): " + str(list(matches)))
-				for peak in matches:
-					try:
-						grains = peaksInGrains[peak]
-						grains.append(grain1.getName() + " in " + file1)
-						grains.append(grain2.getName() + " in " + file2)
-						peaksInGrains[peak] = grains
-					except KeyError:
-						# Key is not present
-						peaksInGrains[peak] = [grain1.getName() + " in " + file1, grain2.getName() + " in " + file2]
+	# Loop on pairs of grains that share peaks, grains in list 1 first
+	with instrumentation.stage("match"):
+		limits = numpy.flatnonzero((numpy.diff(grain1) != 0) | (numpy.diff(grain2) != 0)) + 1
+		limits = numpy.concatenate(([0], limits, [len(grain1)])) if (len(grain1) > 0) else []
+		for n in range(0,len(limits)-1):
+			grainA = grains1clean[grain1[limits[n]]]
+			grainB = grains2clean[grain2[limits[n]]]
+			matches = gveid[limits[n]:limits[n+1]].tolist()
+			logit(logfile, "- Grain %s of %s shares %d peaks with %s of %s" % (grainA.getName(), file1, len(matches), grainB.getName(), file2))
+			logit(logfile, "Matching peaks (GVE ID): " + str(matches))
+			for peak in matches:
+				try:
+					grains = peaksInGrains[peak]
+					grains.append(grainA.getName() + " in " + file1)
+					grains.append(grainB.getName() + " in " + file2)
+					peaksInGrains[peak] = grains
+				except KeyError:
+					# Key is not present
+					peaksInGrains[peak] = [grainA.getName() + " in " + file1, grainB.getName() + " in " + file2]
 	
 	
 	logit(logfile, "\nPeaks information\n")
 	for peak in peaksInGrains:
 		logit(logfile, "- peak %s is seen in %d grains: " % (peak, len(peaksInGrains[peak])) + str(peaksInGrains[peak]))
 
-	return
+	return overlap
 
 
 #################################################################
@@ -390,7 +259,9 @@ def main(argv):
 	
 	parser.add_argument('-m', '--misorientation', required=False, help="Misorientation below which two grains are considered identical, in degrees. Default is %(default)s", default=2.0, type=float)
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "GrainPeaksComparison")
 
 	file1 = args['file1']
 	file2 = args['file2']
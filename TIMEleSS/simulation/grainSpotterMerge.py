@@ -33,6 +33,9 @@ import sys
 import argparse
 import os.path
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 # Maths stuff
 import numpy
 
@@ -42,6 +45,7 @@ from TIMEleSS.simulation.grainComparison import logit
 
 # Grain comparison functions
 from TIMEleSS.simulation import grainComparison
+from TIMEleSS.general import orientation
 
 
 #################################################################
@@ -78,7 +82,8 @@ def grainSpotterMerge(files, crystal_system, cutoff, outputstem,skipbogus):
 	# Reading list of grains from all files
 	grainLists = []
 	for filename in files:
-		grains = multigrainOutputParser.parseGrains(filename,skipbogus)
+		with instrumentation.stage("parse"):
+			grains = multigrainOutputParser.parseGrains(filename,skipbogus)
 		grainLists.append(grains)
 		logit(logfile, "Parsed %s, found %d grains" % (filename, len(grains)))
 	
@@ -89,25 +94,23 @@ def grainSpotterMerge(files, crystal_system, cutoff, outputstem,skipbogus):
 	for grains in grainLists:
 		mergeGrains += grains
 	logit(logfile, "Looking for unique grains")
-	grainsUnique = grainComparison.removeDoubleGrains(mergeGrains, crystal_system, cutoff, logfile)
+	with instrumentation.stage("match"):
+		grainsUnique = grainComparison.removeDoubleGrains(mergeGrains, crystal_system, cutoff, logfile)
 	
 	logit(logfile, "")
 	
 	# Getting some stats for each for those grains
 	logit(logfile, "Indexing statistics")
-	nIndexed = []
-	for i in range(0,len(grainsUnique)):
-		grain1 = grainsUnique[i]
-		n = 0
-		for grain2 in mergeGrains:
-			U1 = (grain1).getU()
-			U2 = (grain2).getU()
-			if (grainComparison.matchGrains(U1,U2,crystal_system,cutoff)):
-				# We have a match. Keep the grain with the largest number of peaks
-				n += 1
-				if (grain2.getNPeaks() > grain1.getNPeaks()):
-					grainsUnique[i] = grain2
-		nIndexed.append(n)
+	with instrumentation.stage("statistics"):
+		# All pairs of unique and merged grains within the cutoff, sorted by unique grain, then merged grain
+		[i1, i2, angle] = orientation.closeOrientations(orientation.orientationArray(grainsUnique), orientation.orientationArray(mergeGrains), crystal_system, cutoff)
+		nIndexed = numpy.bincount(i1, minlength=len(grainsUnique)).tolist()
+		# We have a match. Keep the grain with the largest number of peaks
+		npeaksUnique = numpy.array([grain.getNPeaks() for grain in grainsUnique], dtype=numpy.int64)
+		npeaksMerge = numpy.array([grain.getNPeaks() for grain in mergeGrains], dtype=numpy.int64)
+		more = (npeaksMerge[i2] > npeaksUnique[i1])
+		for [i,j] in zip(i1[more].tolist(), i2[more].tolist()):
+			grainsUnique[i] = mergeGrains[j]
 	nn = grainComparison.unique(nIndexed)
 	nn.sort(reverse=True)
 	for i in nn:
@@ -117,7 +120,8 @@ def grainSpotterMerge(files, crystal_system, cutoff, outputstem,skipbogus):
 	# Saving new files (in GrainSpotter format), based on the number of time each grain was indexed
 	logit(logfile, "\nSaving unique grains")
 	filename = ("%s-grains.log" % (outputstem))
-	multigrainOutputParser.saveGrainSpotter(filename,grainsUnique)
+	with instrumentation.stage("write"):
+		multigrainOutputParser.saveGrainSpotter(filename,grainsUnique)
 	logit(logfile,"- all %d unique grains saved in %s" % (len(grainsUnique), filename))
 	for i in nn:
 		filename = ("%s-grains-%d.log" % (outputstem, i))
@@ -127,7 +131,8 @@ def grainSpotterMerge(files, crystal_system, cutoff, outputstem,skipbogus):
 		tosave = []
 		for j in range(0,len(indexlist)):
 			tosave.append(grainsUnique[j])
-		multigrainOutputParser.saveGrainSpotter(filename,tosave)
+		with instrumentation.stage("write"):
+			multigrainOutputParser.saveGrainSpotter(filename,tosave)
 		logit(logfile,"- %d grains indexed %d times saved in %s" % (len(tosave),i, filename))
 	
 	logfile.close()
@@ -164,7 +169,9 @@ def main(argv):
 	
 	parser.add_argument('-s', '--skipbogus', required=False, help="Skip bogus grains in GrainSpotter output. Default is  Default is %(default)s", type=bool, default=False)
 
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "GrainSpotterMerge")
 
 	files = args['files']
 	crystal_system = args['crystal_system']
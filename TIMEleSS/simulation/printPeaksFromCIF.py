@@ -35,6 +35,9 @@ import argparse
 import os.path
 from argparse import RawTextHelpFormatter
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 def printPeaksFromCIF(ciffile, ttheta_min,  ttheta_max, wavelength, minI = -1.0, normI = False, output=None):
 	"""
 	Prints a list of reflections for single-crystal diffraction based on a cif file
@@ -119,7 +122,9 @@ This is part of the TIMEleSS project\nhttp://timeless.texture.rocks
 	parser.add_argument('-o', '--output', required=False, help="If set, saves result to file name. Otherwise, prints results out to screen. Default is %(default)s (no filter)", default=None, type=str)
 	
 	# Parse arguments
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "PeaksFromCIF")
 	ciffile = args['ciffile']
 	ttheta_min = args['ttheta_min']
 	ttheta_max = args['ttheta_max']
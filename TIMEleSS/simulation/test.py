@@ -25,11 +25,11 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 from TIMEleSS.general import multigrainOutputParser
 
-# Locate file within a package
-import pkg_resources
-
 def test():
 
+	# Locate file within a package. pkg_resources is slow to load, only imported here
+	import pkg_resources
+
 	# here = os.path.dirname(__file__)
 	# logfile = os.path.join(sys.prefix, 'TIMEleSS', 'data', 'gve-62-3.log')
 	logfile = pkg_resources.resource_filename(__name__, '../data/gve-62-3.log')
@@ -44,3 +44,8 @@ def test():
 	print ("\nTest GFF parsing:")
 	grains2 = multigrainOutputParser.parseGrains(gfffile)
 	print ("Parsed %s, read %d grains" % (gfffile, len(grains2)))
+
+
+# Used by the timeless command, which calls main(argv) for all tools
+def main(argv):
+	test()
@@ -37,6 +37,9 @@ import argparse
 import os.path
 from argparse import RawTextHelpFormatter
 
+# Profiling and timing instrumentation
+from TIMEleSS.general import instrumentation
+
 def setGVEPeaksFromCIF(ciffile, gve_file_input, gve_file_output, ttheta_min,  ttheta_max, wavelength, minI = -1.0):
 
 	"""
@@ -161,7 +164,9 @@ This is part of the TIMEleSS project\nhttp://timeless.texture.rocks
 	parser.add_argument('-c', '--minI', required=False, help="Filter peaks below a cut-off intensity. Default is %(default)s (no filter). Intensities are normalized so that the most intense peak is 100 (see results of timelessPeaksFromCIF for details)", default=-1.0, type=float)
 	
 	# Parse arguments
-	args = vars(parser.parse_args())
+	instrumentation.addArguments(parser)
+	args = vars(parser.parse_args(argv))
+	instrumentation.start(args, "UpdateGVEFromCIF")
 	ciffile = args['ciffile']
 	gve_file_input = args['inputGVE']
 	gve_file_output = args['outputGVE']
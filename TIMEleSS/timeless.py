@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+This is part of the TIMEleSS tools
+http://timeless.texture.rocks/
+
+Copyright (C) S. Merkel, Universite de Lille, France
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+"""
+Single entry point for all TIMEleSS tools
+
+	timeless list
+	timeless GrainComparison [options] ...
+	timeless serve [--input commands.jsonl] [--output results.jsonl] [--sidecar]
+
+Each subcommand runs the main function of the corresponding timeless* script, with the same
+options. Commands are not case sensitive.
+
+In serve mode, commands are read as JSON lines, from a file or from the standard input, and are
+run one after the other in the same process. Parsed grains, g-vectors, peaks, and cif files are
+cached between commands. Each line can be
+	["GrainComparison", "-c", "7", "grains1.log", "grains2.log"]
+or
+	{"id": "run12", "command": "GrainComparison", "args": ["-c", "7", "grains1.log", "grains2.log"], "cwd": "sample1"}
+"id" and "cwd" are optional. A line {"command": "clearcache"} empties the cache, {"command": "quit"} stops.
+
+For each command, one JSON line is written with the id, command, exit status, time spent, and
+text output of the command.
+"""
+
+# System functions, to manipulate command line arguments
+import sys
+import argparse
+import os
+import io
+import json
+import time
+import importlib
+import contextlib
+import traceback
+
+# Parsed files can be cached between commands
+from TIMEleSS.general import parserCache
+# Timings are printed after each command
+from TIMEleSS.general import instrumentation
+# Parsed grains can be saved in binary sidecar files
+from TIMEleSS.general import grainSidecar
+
+
+# Subcommands, and the module holding their main(argv) function
+# Same as console scripts in setup.py, without the timeless prefix
+commands = {
+	'Test': 'TIMEleSS.simulation.test',
+	'GrainComparison': 'TIMEleSS.simulation.grainComparison',
+	'GrainPeaksComparison': 'TIMEleSS.simulation.grainPeaksComparison',
+	'GrainSpotterMerge': 'TIMEleSS.simulation.grainSpotterMerge',
+	'Tiff2edf': 'TIMEleSS.diffraction.tiff2edf',
+	'ID27_hdf5_To_Edf': 'TIMEleSS.diffraction.ID27_hdf5_To_Edf',
+	'Mccd2edf': 'TIMEleSS.diffraction.mccd2edf',
+	'Edf2tiffFileSeries': 'TIMEleSS.diffraction.edf2tiffFileSeries',
+	'Edf2tiff': 'TIMEleSS.diffraction.edf2tiffSingle',
+	'AverageEDF': 'TIMEleSS.diffraction.averageImage',
+	'SubtractEDF': 'TIMEleSS.diffraction.subtractImage',
+	'MeanFileSeries': 'TIMEleSS.diffraction.meanFileSeries',
+	'CreateEmptyImage': 'TIMEleSS.diffraction.createEmptyImage',
+	'DiamondSpotRemoval': 'TIMEleSS.diffraction.diamondSpotRemoval',
+	'DACShadow': 'TIMEleSS.diffraction.dacShadowMask',
+	'ClearGVEGrains': 'TIMEleSS.simulation.clearGVEGrains',
+	'ClearFLTGrains': 'TIMEleSS.simulation.clearFLTGrains',
+	'SaveFLTGrains': 'TIMEleSS.simulation.fltForGrains',
+	'ExtractEulerAngles': 'TIMEleSS.evaluation.extractEulerAngles',
+	'TestGSEulerAngles': 'TIMEleSS.evaluation.testGSEulerAngles',
+	'TestGSvsGVE': 'TIMEleSS.evaluation.testGSvsGVE',
+	'2thetaHistFromGVE': 'TIMEleSS.evaluation.twoThetaHistFromGVE',
+	'GSIndexingStatistics': 'TIMEleSS.evaluation.GSIndexingStatistics',
+	'PeaksFromCIF': 'TIMEleSS.simulation.printPeaksFromCIF',
+	'UpdateGVEFromCIF': 'TIMEleSS.simulation.updateGVEFromCIF',
+	'FixGSOutput': 'TIMEleSS.evaluation.fixGrainSpotterOutput',
+	'TthHistogram2Maud': 'TIMEleSS.evaluation.tthHistogram2Maud',
+	'ExtractGrainSizes': 'TIMEleSS.evaluation.extractGrainSizes',
+	'RelToAbsGrainSize': 'TIMEleSS.evaluation.relToAbsGrainSize',
+	'GrainDatabase': 'TIMEleSS.evaluation.grainDatabase',
+	'PlotIndexedGrain': 'TIMEleSS.evaluation.testGrainsPeaksGui',
+}
+
+
+#################################################################
+#
+# Running commands
+#
+#################################################################
+
+"""
+Finds a command, ignoring case
+
+Returns the command name, as in the commands dictionnary, or None if not found
+"""
+def findCommand(name):
+	for command in commands:
+		if (command.lower() == name.lower()):
+			return command
+	return None
+
+"""
+Runs a command, as if it was called from the command line
+
+Parameters:
+- name: command name
+- argv: list of arguments for the command
+
+Returns the exit status of the command (0 if everything went fine)
+"""
+def runCommand(name, argv):
+	command = findCommand(name)
+	if (command is None):
+		print ("Unknown command %s. Try timeless list" % name)
+		return 2
+	module = importlib.import_module(commands[command])
+	try:
+		module.main(argv)
+	except SystemExit as e:
+		if (e.code is None):
+			return 0
+		if isinstance(e.code, int):
+			return e.code
+		print (e.code)
+		return 1
+	finally:
+		instrumentation.finish()
+	return 0
+
+"""
+Runs one command from serve mode, capturing its output
+
+Parameters:
+- request: dictionnary with command, args, and, optionally, id and cwd
+
+Returns a dictionnary with id, command, status, time, and output
+"""
+def serveCommand(request):
+	result = {'id': request.get('id'), 'command': request.get('command'), 'status': 0}
+	output = io.StringIO()
+	start = time.perf_counter()
+	olddir = os.getcwd()
+	try:
+		with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+			if (request.get('cwd') is not None):
+				os.chdir(request['cwd'])
+			result['status'] = runCommand(request['command'], [str(arg) for arg in request.get('args', [])])
+	except Exception:
+		result['status'] = 1
+		result['error'] = traceback.format_exc()
+	finally:
+		os.chdir(olddir)
+	result['time'] = time.perf_counter() - start
+	result['output'] = output.getvalue()
+	return result
+
+"""
+Serve mode: reads commands as JSON lines and runs them in this process
+
+Parameters:
+- input: file object from which commands are read
+- output: file object in which results are written
+- nentries: maximum number of parsed files in cache
+"""
+def serve(input, output, nentries=64):
+	parserCache.enableCache(nentries)
+	for line in input:
+		line = line.strip()
+		if ((len(line) == 0) or line.startswith("#")):
+			continue
+		try:
+			request = json.loads(line)
+		except ValueError as e:
+			result = {'id': None, 'command': None, 'status': 2, 'error': "Could not parse %s: %s" % (line, str(e))}
+			output.write(json.dumps(result) + "\n")
+			output.flush()
+			continue
+		if isinstance(request, list):
+			request = {'command': request[0], 'args': request[1:]}
+		command = str(request.get('command')).lower()
+		if (command == "quit"):
+			break
+		if (command == "clearcache"):
+			[n, hits, misses] = parserCache.cacheStatistics()
+			parserCache.clearCache()
+			result = {'id': request.get('id'), 'command': "clearcache", 'status': 0, 'output': "Removed %d files from cache (%d hits, %d misses)" % (n, hits, misses)}
+		else:
+			result = serveCommand(request)
+		output.write(json.dumps(result) + "\n")
+		output.flush()
+	parserCache.disableCache()
+
+"""
+Prints the list of available commands
+"""
+def listCommands():
+	print ("Available commands:")
+	for command in commands:
+		print ("\t%-25s (%s)" % (command, commands[command]))
+	print ("\nRun timeless command --help for help on a given command")
+
+
+#################################################################
+#
+# Main subroutines
+#
+#################################################################
+
+class MyParser(argparse.ArgumentParser):
+	"""
+	Extend the regular argument parser to show the full help in case of error
+	"""
+	def error(self, message):
+
+		sys.stderr.write('\nError : %s\n\n' % message)
+		self.print_help()
+		sys.exit(2)
+
+
+def main(argv):
+	"""
+	Main subroutine
+	"""
+
+	if ((len(argv) == 0) or (argv[0] in ['-h', '--help'])):
+		print ("Usage: timeless command [options]\n       timeless serve [options]\n\nSingle entry point for the TIMEleSS tools\nThis is part of the TIMEleSS project\nhttp://timeless.texture.rocks\n")
+		listCommands()
+		return
+
+	if (argv[0] == 'list'):
+		listCommands()
+		return
+
+	if (argv[0] == 'serve'):
+		parser = MyParser(usage='timeless serve [options]', description="Runs TIMEleSS commands read as JSON lines, in a single process, with a cache for parsed files\nThis is part of the TIMEleSS project\nhttp://timeless.texture.rocks\n")
+		parser.add_argument('-i', '--input', required=False, help="File with one command per line. Default is to read from the standard input", default=None)
+		parser.add_argument('-o', '--output', required=False, help="File for results. Default is to write to the standard output", default=None)
+		parser.add_argument('-c', '--cache', type=int, required=False, help="Maximum number of parsed files to keep in memory. Default is %(default)s", default=64)
+		parser.add_argument('-s', '--sidecar', required=False, action='store_true', help="Save parsed grains in binary sidecar files (grains.log.timeless.npz), and reuse them in later runs")
+		args = vars(parser.parse_args(argv[1:]))
+		if (args['sidecar']):
+			grainSidecar.enableSidecars()
+		input = sys.stdin if (args['input'] is None) else open(args['input'], 'r')
+		output = sys.stdout if (args['output'] is None) else open(args['output'], 'w')
+		serve(input, output, args['cache'])
+		if (args['input'] is not None):
+			input.close()
+		if (args['output'] is not None):
+			output.close()
+		return
+
+	status = runCommand(argv[0], argv[1:])
+	if (status != 0):
+		sys.exit(status)
+
+
+# Calling method 1 (used when generating a binary in setup.py)
+def run():
+	main(sys.argv[1:])
+
+# Calling method 2 (if run from the command line)
+if __name__ == "__main__":
+	main(sys.argv[1:])
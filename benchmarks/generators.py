@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+This is part of the TIMEleSS tools
+http://timeless.texture.rocks/
+
+Copyright (C) S. Merkel, Universite de Lille, France
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+"""
+Generators for synthetic 3D-XRD datasets, used by the benchmarks
+
+A dataset is a set of randomly oriented grains of a cubic F phase, with indexed peaks, and
+extra peaks which are not assigned to any grain. From it, one can write
+- GrainSpotter log files,
+- gff and ubi files,
+- flt and gve files, with consistent peak IDs,
+- GrainSpotter input files,
+- cif files,
+- stacks of EDF images with sharp spots, as from diamond anvils.
+
+Values are realistic in format, not in physics: angles of peaks are random, but 2theta is
+consistent with the d-spacing of each hkl, and g-vectors are consistent with the orientation of
+the grains.
+"""
+
+# System functions
+import os
+
+# Mathematical stuff (for data array)
+import numpy
+
+# Euler angles from orientation matrices
+from TIMEleSS.general import orientation
+
+# Default wavelength and cubic lattice parameter
+wavelength = 0.3738
+latticeparameter = 3.6
+
+#################################################################
+#
+# Synthetic dataset
+#
+#################################################################
+
+"""
+List of hkl for a cubic F lattice, sorted by d-spacing
+
+Parameters:
+- hmax: maximum value of h, k, l
+
+Returns [hkl, ds] with hkl an Nx3 array of integers and ds = 1/d
+"""
+def cubicFReflections(hmax=5, a=latticeparameter):
+	r = numpy.arange(-hmax, hmax+1)
+	hkl = numpy.array(numpy.meshgrid(r, r, r, indexing='ij')).reshape(3,-1).T
+	parity = (hkl % 2).sum(axis=1)
+	keep = ((parity == 0) | (parity == 3)) & (numpy.abs(hkl).sum(axis=1) > 0)
+	hkl = hkl[keep]
+	ds = numpy.sqrt((hkl**2).sum(axis=1))/a
+	order = numpy.argsort(ds, kind='stable')
+	return [hkl[order], ds[order]]
+
+"""
+Random rotation matrices, from random quaternions
+
+Returns an array of shape (n,3,3)
+"""
+def randomRotations(n, rng):
+	q = rng.normal(size=(n,4))
+	q /= numpy.sqrt((q**2).sum(axis=1))[:,numpy.newaxis]
+	w, x, y, z = q[:,0], q[:,1], q[:,2], q[:,3]
+	U = numpy.empty((n,3,3))
+	U[:,0,0] = 1-2*(y*y+z*z)
+	U[:,0,1] = 2*(x*y-z*w)
+	U[:,0,2] = 2*(x*z+y*w)
+	U[:,1,0] = 2*(x*y+z*w)
+	U[:,1,1] = 1-2*(x*x+z*z)
+	U[:,1,2] = 2*(y*z-x*w)
+	U[:,2,0] = 2*(x*z-y*w)
+	U[:,2,1] = 2*(y*z+x*w)
+	U[:,2,2] = 1-2*(x*x+y*y)
+	return U
+
+"""
+Creates a synthetic dataset
+
+Parameters:
+- ngrains: number of grains
+- npeaks: number of indexed peaks per grain
+- nextra: number of peaks not assigned to any grain
+- ttmax: maximum 2theta, in degrees
+- seed: seed for the random number generator
+
+Returns a dictionnary with
+- U, UBI: orientation and UBI matrices of the grains, arrays of shape (ngrains,3,3)
+- euler: Euler angles of the grains, in degrees
+- grain: grain of each peak, -1 for unassigned peaks
+- hkl, ds, tth, eta, omega: indexing information for each peak
+- g: g-vectors of each peak
+- ids: peak IDs, in random order
+- reflections: [hkl, ds] for all reflections of the phase
+"""
+def syntheticDataset(ngrains, npeaks, nextra=0, ttmax=25., seed=0):
+	rng = numpy.random.RandomState(seed)
+	a = latticeparameter
+	[hklall, dsall] = cubicFReflections()
+	dsmax = 2.*numpy.sin(numpy.radians(ttmax/2.))/wavelength
+	nref = numpy.count_nonzero(dsall <= dsmax)
+	U = randomRotations(ngrains, rng)
+	B = numpy.identity(3)/a
+	UBI = numpy.linalg.inv(numpy.matmul(U, B))
+	# Euler angles are calculated from U. Random numbers are still drawn, so that peaks do not change
+	rng.uniform(0., 360., (ngrains,3))
+	euler = orientation.eulerFromU(U)
+	ntotal = ngrains*npeaks + nextra
+	grain = numpy.concatenate((numpy.repeat(numpy.arange(ngrains), npeaks), numpy.full(nextra, -1)))
+	ref = rng.randint(0, nref, ntotal)
+	hkl = hklall[ref]
+	ds = dsall[ref]
+	tth = numpy.degrees(2.*numpy.arcsin(ds*wavelength/2.))
+	eta = rng.uniform(0., 360., ntotal)
+	omega = rng.uniform(-180., 180., ntotal)
+	# g-vectors: U.B.hkl for indexed peaks, random orientation for the others
+	g = numpy.empty((ntotal,3))
+	indexed = (grain >= 0)
+	g[indexed] = numpy.einsum('nij,nj->ni', U[grain[indexed]], hkl[indexed]/a)
+	rand = rng.normal(size=(nextra,3))
+	g[~indexed] = rand/numpy.sqrt((rand**2).sum(axis=1))[:,numpy.newaxis]*ds[~indexed,numpy.newaxis]
+	ids = rng.permutation(ntotal)
+	return {'U': U, 'UBI': UBI, 'euler': euler, 'grain': grain, 'hkl': hkl, 'ds': ds, 'tth': tth, 'eta': eta, 'omega': omega, 'g': g, 'ids': ids, 'reflections': [hklall[:nref], dsall[:nref]]}
+
+"""
+Detector positions of peaks, from 2theta and eta (simple flat detector, for file formats only)
+
+Returns [sc, fc]
+"""
+def detectorPositions(data, distance=200000., pixelsize=200., center=1024.):
+	r = distance*numpy.tan(numpy.radians(data['tth']))/pixelsize
+	sc = center + r*numpy.cos(numpy.radians(data['eta']))
+	fc = center + r*numpy.sin(numpy.radians(data['eta']))
+	return [sc, fc]
+
+#################################################################
+#
+# File writers
+#
+#################################################################
+
+"""
+Writes a GrainSpotter log file
+
+Parameters:
+- fname: file name
+- data: dataset from syntheticDataset
+"""
+def writeGrainSpotterLog(fname, data):
+	ngrains = len(data['U'])
+	grain = data['grain']
+	rng = numpy.random.RandomState(1)
+	f = open(fname, 'w')
+	f.write("Found %d grains\nSyntax:\nGrain nr\n#expected gvectors #measured gvectors #measured once #measured more than once\n" % ngrains)
+	f.write("mean_IA position_x position_y position_z pos_chisq\nU11 U12 U13\nU21 U22 U23\nU31 U32 U33\n\nUBI11 UBI12 UBI13\nUBI21 UBI22 UBI23\nUBI31 UBI32 UBI33\n\nr1 r2 r3\n\nphi1 phi phi2\n\nq0 qx qy qz\n\n")
+	f.write("#  gvector_id peak_id  h k l  h_pred k_pred l_pred  dh dk dl  tth_meas tth_pred dtth  omega_meas omega_pred domega  eta_meas  eta_pred deta  IA\n.\n.\n\n")
+	gveid = numpy.empty(len(grain), dtype=int)
+	gveid[numpy.argsort(data['ids'])] = numpy.arange(len(grain))
+	for i in range(0, ngrains):
+		peaks = numpy.flatnonzero(grain == i)
+		n = len(peaks)
+		f.write("Grain %4d, %d\n" % (i+1, n))
+		f.write("%4d %4d %4d %4d\n" % (n+5, n, n, 0))
+		f.write(" %.4f %10.3f %10.3f %10.3f %10.3f\n" % (rng.uniform(0.01, 0.1), 0., 0., 0., 0.))
+		for k in range(0,3):
+			f.write("%.9f %.9f %.9f\n" % tuple(data['U'][i,k]))
+		f.write("\n")
+		for k in range(0,3):
+			f.write("%.9f %.9f %.9f\n" % tuple(data['UBI'][i,k]))
+		f.write("\n%.9f %.9f %.9f\n\n" % tuple(rng.normal(0., 0.3, 3)))
+		f.write("%.9f %.9f %.9f\n\n" % tuple(data['euler'][i]))
+		f.write("%.9f %.9f %.9f %.9f\n\n" % (1., 0., 0., 0.))
+		dtth = rng.normal(0., 0.02, n)
+		domega = rng.normal(0., 0.05, n)
+		deta = rng.normal(0., 0.1, n)
+		for j in range(0,n):
+			p = peaks[j]
+			h, k, l = data['hkl'][p]
+			tth = data['tth'][p]
+			omega = data['omega'][p]
+			eta = data['eta'][p]
+			f.write("%5d %8d %8d %5d %3d %3d %8.2f %7.2f %7.2f %8.2f %7.2f %7.2f %8.2f %7.2f %7.2f %8.2f %7.2f %7.2f %8.2f %7.2f %7.2f %8.2f\n" % (j+1, gveid[p], data['ids'][p], h, k, l, h, k, l, 0., 0., 0., tth+dtth[j], tth, dtth[j], omega+domega[j], omega, domega[j], eta+deta[j], eta, deta[j], abs(deta[j])))
+		f.write("\n")
+	f.close()
+
+"""
+Writes a gff file, as from FitAllB
+"""
+def writeGFF(fname, data):
+	ngrains = len(data['U'])
+	f = open(fname, 'w')
+	f.write("# grain_id phase_id grainsize grainvolume x y z phi1 PHI phi2 U11 U12 U13 U21 U22 U23 U31 U32 U33 UBI11 UBI12 UBI13 UBI21 UBI22 UBI23 UBI31 UBI32 UBI33 eps11 eps12 eps13 eps22 eps23 eps33 \n")
+	for i in range(0, ngrains):
+		values = [i, 0, 0.0001, 1.e-12, 0., 0., 0.] + list(data['euler'][i]) + list(data['U'][i].ravel()) + list(data['UBI'][i].ravel()) + [0.]*6
+		f.write("%d %d %f %e %f %f %f " % tuple(values[0:7]) + " ".join(["%.12f" % v for v in values[7:28]]) + " " + " ".join(["%e" % v for v in values[28:]]) + " \n")
+	f.close()
+
+"""
+Writes a ubi file, as from ImageD11
+"""
+def writeUBI(fname, data):
+	f = open(fname, 'w')
+	for UBI in data['UBI']:
+		for k in range(0,3):
+			f.write("%f %f %f\n" % tuple(UBI[k]))
+		f.write("\n")
+	f.close()
+
+"""
+Writes a flt file with all peaks of the dataset, in random order of peak ID
+"""
+def writeFLT(fname, data):
+	[sc, fc] = detectorPositions(data)
+	n = len(sc)
+	rng = numpy.random.RandomState(2)
+	table = numpy.column_stack((sc, fc, data['omega'], numpy.full(n, 10), numpy.full(n, 5.), sc, fc, numpy.ones(n), numpy.ones(n), numpy.zeros(n), numpy.ones(n), numpy.zeros(n), numpy.zeros(n), rng.uniform(100., 1.e5, n), numpy.full(n, 50.), data['ids']))
+	order = numpy.argsort(data['ids'])
+	header = "omegastep = 0.25\n sc  fc  omega  Number_of_pixels  avg_intensity  s_raw  f_raw  sigs  sigf  covsf  sigo  covso  covfo  sum_intensity  IMax_int  spot3d_id"
+	numpy.savetxt(fname, table[order], fmt=["%.4f"]*3 + ["%d"] + ["%.4f"]*11 + ["%d"], header=header)
+
+"""
+Writes a gve file with all peaks of the dataset
+
+Parameters:
+- fname: file name
+- data: dataset from syntheticDataset
+- select: optional boolean array, to only write some of the peaks
+"""
+def writeGVE(fname, data, select=None):
+	[sc, fc] = detectorPositions(data)
+	if (select is None):
+		select = numpy.ones(len(sc), dtype=bool)
+	[hkl, ds] = data['reflections']
+	a = latticeparameter
+	f = open(fname, 'w')
+	f.write("%f %f %f 90.000000 90.000000 90.000000 F\n# wavelength = %f\n# wedge = 0.000000\n# ds h k l\n" % (a, a, a, wavelength))
+	for i in range(0, len(ds)):
+		f.write("%10.7f %4d %4d %4d\n" % (ds[i], hkl[i,0], hkl[i,1], hkl[i,2]))
+	f.write("#  gx  gy  gz  xc  yc  ds  eta  omega  spot3d_id  xl  yl  zl\n")
+	n = numpy.count_nonzero(select)
+	table = numpy.column_stack((data['g'][select], sc[select], fc[select], data['ds'][select], data['eta'][select], data['omega'][select], data['ids'][select], numpy.full(n, 200000.), sc[select], fc[select]))
+	order = numpy.argsort(data['ids'][select])
+	numpy.savetxt(f, table[order], fmt=["%.6f"]*8 + ["%d"] + ["%.6f"]*3)
+	f.close()
+
+"""
+Writes a GrainSpotter input file
+"""
+def writeGSInput(fname, ttmax=25.):
+	f = open(fname, 'w')
+	f.write("! Synthetic GrainSpotter input\ntthrange 0 %f\netarange 0 360\nomegarange -180 180\ndomega 0.25\nfiltersimple\nuncertainties 0.05 0.2 0.5\nnsigmas 2\nNhkls_in_indexing 10\nrandom 10000\npositionfit\nminfracg 0.5\n" % ttmax)
+	f.close()
+
+"""
+Writes an ImageD11 parameter file, matching detectorPositions
+"""
+def writePar(fname):
+	f = open(fname, 'w')
+	f.write("chi 0.0\ndistance 200000.0\nfit_tolerance 0.05\no11 1\no12 0\no21 0\no22 -1\nomegasign 1.0\nt_x 0\nt_y 0\nt_z 0\ntilt_x 0.0\ntilt_y 0.0\ntilt_z 0.0\nwavelength %f\nwedge 0.0\ny_center 1024.0\ny_size 200.0\nz_center 1024.0\nz_size 200.0\n" % wavelength)
+	f.close()
+
+"""
+Writes a cif file for NaCl, a simple cubic F structure
+"""
+def writeCIF(fname):
+	f = open(fname, 'w')
+	f.write("data_NaCl\n_cell_length_a 5.64\n_cell_length_b 5.64\n_cell_length_c 5.64\n_cell_angle_alpha 90\n_cell_angle_beta 90\n_cell_angle_gamma 90\n_symmetry_space_group_name_H-M 'F m -3 m'\n")
+	f.write("loop_\n_atom_site_label\n_atom_site_type_symbol\n_atom_site_fract_x\n_atom_site_fract_y\n_atom_site_fract_z\n_atom_site_occupancy\n_atom_site_U_iso_or_equiv\nNa1 Na 0 0 0 1 0.01\nCl1 Cl 0.5 0.5 0.5 1 0.01\n")
+	f.close()
+
+"""
+Writes a stack of EDF images, with a smooth background, noise, and a few sharp spots which move
+from one image to the next, as for diamond spots. A median image is saved as well.
+
+Parameters:
+- directory: where to save the images
+- stem: stem for file names
+- nframes: number of images
+- npixels: size of the images (they are square)
+- nspots: number of spots
+- ndigits: number of digits in file numbers
+
+Returns the name of the median image (without path)
+"""
+def writeEDFStack(directory, stem, nframes, npixels, nspots=20, ndigits=4, seed=3):
+	import fabio.edfimage
+	rng = numpy.random.RandomState(seed)
+	y, x = numpy.mgrid[0:npixels, 0:npixels]
+	r2 = (x-npixels/2.)**2 + (y-npixels/2.)**2
+	background = 100. + 50.*numpy.exp(-r2/(0.1*npixels**2))
+	centers = rng.uniform(0, npixels, (nspots,2))
+	frames = rng.randint(0, nframes, nspots)
+	width = max(1., npixels/200.)
+	stack = numpy.empty((nframes, npixels, npixels), dtype=numpy.float32)
+	for i in range(0, nframes):
+		image = background + rng.normal(0., 5., (npixels, npixels))
+		for j in numpy.flatnonzero(numpy.abs(frames-i) <= 1):
+			image += 5.e4*numpy.exp(-((x-centers[j,0])**2+(y-centers[j,1])**2)/(2.*width**2))
+		stack[i] = image
+		header = {'Omega': "%f" % (0.25*i), 'OmegaMin': "%f" % (0.25*i-0.125), 'OmegaMax': "%f" % (0.25*i+0.125)}
+		edf = fabio.edfimage.edfimage(data=image.astype(numpy.uint16), header=header)
+		edf.write(os.path.join(directory, ("%s%0" + str(ndigits) + "d.edf") % (stem, i)))
+	median = stem + "median.edf"
+	edf = fabio.edfimage.edfimage(data=numpy.median(stack, axis=0).astype(numpy.uint16))
+	edf.write(os.path.join(directory, median))
+	return median
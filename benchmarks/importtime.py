@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+This is part of the TIMEleSS tools
+http://timeless.texture.rocks/
+
+Copyright (C) S. Merkel, Universite de Lille, France
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+"""
+Measures the time needed to import the modules behind each TIMEleSS console script,
+in a fresh interpreter, and lists the heavy libraries which were loaded in the process.
+
+Used to make sure that command line tools start fast. Heavy libraries (plotting,
+ImageD11, xfab, CIF parsers...) should only be loaded when they are actually needed.
+
+Run from the root of the source tree, e.g.
+	python benchmarks/importtime.py
+	python benchmarks/importtime.py --max 0.5
+"""
+
+# System functions, to manipulate command line arguments
+import sys
+import argparse
+import os.path
+import re
+import subprocess
+
+# Libraries which are slow to import and should not be loaded when importing a tool
+heavylibs = ['matplotlib', 'matplotlib.pyplot', 'scipy', 'scipy.linalg', 'scipy.ndimage', 'scipy.stats', 'PIL', 'ImageD11', 'xfab', 'CifFile', 'polyxsim', 'PyQt5', 'h5py', 'fabio']
+
+# Code ran in a fresh interpreter for each module
+timingcode = """
+import sys, time
+start = time.perf_counter()
+import %s
+print(time.perf_counter()-start)
+print(",".join([lib for lib in %s if lib in sys.modules]))
+"""
+
+#################################################################
+#
+# Benchmark functions
+#
+#################################################################
+
+"""
+Lists modules used as console or gui scripts in setup.py
+
+Parameters:
+- setupfile: name of setup.py
+
+Returns a list of [script name, module name]
+"""
+def scriptModules(setupfile):
+	text = open(setupfile).read()
+	return [[m[0], m[1]] for m in re.findall(r"'(\w+)\s*=\s*([\w.]+):\w+'", text)]
+
+"""
+Measures the import time of a module, in a fresh interpreter
+
+Parameters:
+- module: name of the module
+- repeat: number of measurements, the median is returned
+- path: directory to add to the python path
+
+Returns [time in seconds, list of heavy libraries loaded], or [None, error message] if the import failed
+"""
+def importTime(module, repeat, path):
+	env = dict(os.environ)
+	env['PYTHONPATH'] = path + os.pathsep + env.get('PYTHONPATH', '')
+	times = []
+	for i in range(0,repeat):
+		p = subprocess.run([sys.executable, '-c', timingcode % (module, repr(heavylibs))], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+		if (p.returncode != 0):
+			return [None, p.stderr.strip().splitlines()[-1]]
+		lines = p.stdout.splitlines()
+		times.append(float(lines[-2]))
+		libs = [lib for lib in lines[-1].split(",") if lib != ""]
+	times.sort()
+	return [times[len(times)//2], libs]
+
+#################################################################
+#
+# Main subroutines
+#
+#################################################################
+
+class MyParser(argparse.ArgumentParser):
+	"""
+	Extend the regular argument parser to show the full help in case of error
+	"""
+	def error(self, message):
+
+		sys.stderr.write('\nError : %s\n\n' % message)
+		self.print_help()
+		sys.exit(2)
+
+
+def main(argv):
+	"""
+	Main subroutine
+	"""
+
+	root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+	parser = MyParser(usage='%(prog)s [options]', description="Measures the import time of the modules behind TIMEleSS console scripts\nThis is part of the TIMEleSS project\nhttp://timeless.texture.rocks\n")
+
+	parser.add_argument('-s', '--setup', required=False, help="setup.py file listing the console scripts. Default is %(default)s", default=os.path.join(root, "setup.py"))
+	parser.add_argument('-n', '--repeat', type=int, required=False, help="Number of measurements for each module. Default is %(default)s", default=5)
+	parser.add_argument('-m', '--max', type=float, required=False, help="Maximum import time, in seconds. Returns an error if a module is slower. Default is None (no check)", default=None)
+	parser.add_argument('-o', '--only', required=False, help="Only test modules with this string in their name", default=None)
+
+	args = vars(parser.parse_args(argv))
+
+	modules = scriptModules(args['setup'])
+	if (args['only'] is not None):
+		modules = [m for m in modules if args['only'] in m[1]]
+
+	# Reference: time needed to start python and import numpy
+	[reference, libs] = importTime("numpy", args['repeat'], root)
+	print ("Import time for numpy, for reference: %.3f s\n" % reference)
+
+	print ("%-30s %-45s %8s  %s" % ("Script", "Module", "Time (s)", "Heavy libraries loaded"))
+	failed = []
+	for [script, module] in modules:
+		[t, libs] = importTime(module, args['repeat'], root)
+		if (t is None):
+			print ("%-30s %-45s %8s  %s" % (script, module, "failed", libs))
+			failed.append(module)
+			continue
+		print ("%-30s %-45s %8.3f  %s" % (script, module, t, ", ".join(libs)))
+		if ((args['max'] is not None) and (t > args['max'])):
+			failed.append(module)
+
+	if (len(failed) > 0):
+		print ("\n%d modules failed or were too slow to import:\n%s" % (len(failed), "\n".join(failed)))
+		sys.exit(1)
+
+
+# Calling method 1 (used when generating a binary in setup.py)
+def run():
+	main(sys.argv[1:])
+
+# Calling method 2 (if run from the command line)
+if __name__ == "__main__":
+	main(sys.argv[1:])
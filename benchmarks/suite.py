@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+"""
+This is part of the TIMEleSS tools
+http://timeless.texture.rocks/
+
+Copyright (C) S. Merkel, Universite de Lille, France
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+"""
+End-to-end benchmarks for the TIMEleSS tools, on synthetic datasets
+
+Synthetic files are generated in a temporary directory (see generators.py), and each case is run
+a few times. For each case, we record the wall and CPU time of each run and the peak memory
+allocated by python (tracemalloc), measured in an extra run.
+
+Results are saved as JSON, to track performance across releases. Run from the root of the source tree, e.g.
+	python benchmarks/suite.py --scale small -o results.json
+	python benchmarks/suite.py --scale medium --only parse --compare results.json
+"""
+
+# System functions, to manipulate command line arguments
+import sys
+import argparse
+import os
+import io
+import json
+import time
+import shutil
+import tempfile
+import platform
+import tracemalloc
+import contextlib
+import traceback
+
+# Mathematical stuff (for data array)
+import numpy
+
+# Benchmark the source tree in which this file is located
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+import TIMEleSS
+import generators
+
+# Size of datasets
+# grains: number of grains, peaks: indexed peaks per grain, extra: unassigned peaks, frames: number of images, pixels: image size
+scales = {
+	'small':  {'grains': 50, 'peaks': 50, 'extra': 2000, 'frames': 10, 'pixels': 256},
+	'medium': {'grains': 500, 'peaks': 100, 'extra': 20000, 'frames': 40, 'pixels': 1024},
+	'large':  {'grains': 5000, 'peaks': 150, 'extra': 200000, 'frames': 200, 'pixels': 2048},
+}
+
+#################################################################
+#
+# Benchmark cases
+#
+#################################################################
+
+"""
+Creates all input files for the benchmarks
+
+Parameters:
+- directory: where to save the files
+- scale: dictionnary with grains, peaks, extra, frames, pixels
+
+Returns a dictionnary with file names, and the dataset
+"""
+def createFiles(directory, scale):
+	files = {}
+	data = generators.syntheticDataset(scale['grains'], scale['peaks'], scale['extra'], seed=0)
+	files['data'] = data
+	files['log'] = os.path.join(directory, "grains.log")
+	generators.writeGrainSpotterLog(files['log'], data)
+	# Second GrainSpotter log, half the grains in common, for comparisons and merges
+	data2 = generators.syntheticDataset(scale['grains'], scale['peaks'], scale['extra'], seed=1)
+	half = scale['grains']//2
+	for key in ['U', 'UBI', 'euler']:
+		data2[key][:half] = data[key][:half]
+	files['log2'] = os.path.join(directory, "grains2.log")
+	generators.writeGrainSpotterLog(files['log2'], data2)
+	files['gff'] = os.path.join(directory, "grains.gff")
+	generators.writeGFF(files['gff'], data)
+	files['ubi'] = os.path.join(directory, "grains.ubi")
+	generators.writeUBI(files['ubi'], data)
+	files['flt'] = os.path.join(directory, "peaks.flt")
+	generators.writeFLT(files['flt'], data)
+	files['gve'] = os.path.join(directory, "peaks.gve")
+	generators.writeGVE(files['gve'], data)
+	files['gsinput'] = os.path.join(directory, "grainspotter.ini")
+	generators.writeGSInput(files['gsinput'])
+	files['par'] = os.path.join(directory, "detector.par")
+	generators.writePar(files['par'])
+	files['cif'] = os.path.join(directory, "NaCl.cif")
+	generators.writeCIF(files['cif'])
+	files['edfdir'] = os.path.join(directory, "edf")
+	os.mkdir(files['edfdir'])
+	files['edfmedian'] = generators.writeEDFStack(files['edfdir'], "image_", scale['frames'], scale['pixels'])
+	files['out'] = os.path.join(directory, "out")
+	os.mkdir(files['out'])
+	return files
+
+"""
+List of benchmark cases
+
+Each case is [group, name, function], function being called with the dictionnary of files
+"""
+def benchmarkCases(scale):
+
+	from TIMEleSS.general import multigrainOutputParser
+	from TIMEleSS.general import cifTools
+
+	def out(files, name):
+		return os.path.join(files['out'], name)
+
+	# Parsing
+	def parseLog(files):
+		return multigrainOutputParser.parse_GrainSpotter_log(files['log'])
+	def parseGFF(files):
+		return multigrainOutputParser.parse_gff(files['gff'])
+	def parseUBI(files):
+		return multigrainOutputParser.parse_ubi(files['ubi'])
+	def parseFLT(files):
+		return multigrainOutputParser.parseFLT(files['flt'])
+	def parseFLTTable(files):
+		return multigrainOutputParser.parseFLTTable(files['flt'])
+	def parseGVE(files):
+		return multigrainOutputParser.parseGVE(files['gve'])
+	def parseGVETable(files):
+		return multigrainOutputParser.parseGVETable(files['gve'])
+	def indexedPeaks(files):
+		grains = multigrainOutputParser.parse_GrainSpotter_log(files['log'])
+		return multigrainOutputParser.indexedPeaksTable(grains)
+
+	# Removing duplicates, comparing and merging grains
+	def removeDoubleGrains(files):
+		from TIMEleSS.simulation import grainComparison
+		grains = multigrainOutputParser.parse_GrainSpotter_log(files['log'])
+		grains = grains + grains[0:len(grains)//10]
+		log = io.StringIO()
+		return grainComparison.removeDoubleGrains(grains, 7, 2., log)
+	def compareGrains(files):
+		from TIMEleSS.simulation import grainComparison
+		return grainComparison.comparaison(files['log'], files['log2'], 7, 2., out(files, "comp"), False)
+	def mergeGrains(files):
+		from TIMEleSS.simulation import grainSpotterMerge
+		return grainSpotterMerge.grainSpotterMerge([files['log'], files['log2']], 7, 2., out(files, "merge"), False)
+
+	# Orientations
+	def checkEulerAngles(files):
+		from TIMEleSS.evaluation import testGSEulerAngles
+		return testGSEulerAngles.check_euler_angles(files['log'])
+
+	# Removing peaks of indexed grains
+	def cropFLT(files):
+		from TIMEleSS.simulation import clearFLTGrains
+		return clearFLTGrains.cropFLT(files['log'], files['flt'], out(files, "cleared.flt"), False)
+	def cropGVE(files):
+		from TIMEleSS.simulation import clearGVEGrains
+		return clearGVEGrains.cropGVE(files['log'], files['gve'], out(files, "cleared.gve"), False, False, None)
+	def fltGrains(files):
+		from TIMEleSS.simulation import fltForGrains
+		return fltForGrains.fltGrains(files['log'], files['flt'], out(files, "grains.flt"), False)
+	def fltGrainsStream(files):
+		from TIMEleSS.simulation import fltForGrains
+		return fltForGrains.fltGrains(files['log'], files['flt'], out(files, "grains-stream.flt"), False, stream=True)
+	def removeUsedGVE(files):
+		from TIMEleSS.evaluation import removeUsedGVE
+		return removeUsedGVE.RemoveUsedGVE(files['log'], files['gve'], out(files, "unused.gve"))
+
+	# Indexing statistics
+	def indexingStatistics(files):
+		from TIMEleSS.evaluation import GSIndexingStatistics
+		return GSIndexingStatistics.gs_indexing_statistics([files['log']], [files['gve']], [files['gsinput']], generators.wavelength)
+	def plotData(files):
+		from TIMEleSS.evaluation import testGrainsPeaks
+		data = testGrainsPeaks.grainPlotData()
+		data.parseInputFiles(files['log'], files['flt'], files['par'])
+		return data
+
+	# Structure factors
+	def peaksFromCIF(files):
+		return cifTools.peaksFromCIF(files['cif'], 0., 25., generators.wavelength)
+
+	# Images
+	def createMask(files):
+		from TIMEleSS.diffraction import diamondSpotRemoval
+		return diamondSpotRemoval.createMask(files['edfdir'], "image_", 0, scale['frames']-1, files['edfmedian'], scale=min(400,scale['pixels']))
+	def inpaint(files):
+		from TIMEleSS.diffraction import inpaint
+		rng = numpy.random.RandomState(4)
+		image = rng.normal(100., 5., (scale['pixels']//2, scale['pixels']//2))
+		n = scale['pixels']//16
+		for [x, y] in rng.randint(0, scale['pixels']//2-n, (10,2)):
+			image[x:x+n, y:y+n] = numpy.nan
+		return inpaint.replace_nans(image, max_iter=20, tol=1., kernel_radius=2, kernel_sigma=5, method='idw')
+	def meanFileSeries(files):
+		from TIMEleSS.diffraction import meanFileSeries
+		return meanFileSeries.meanFileSeries(os.path.join(files['edfdir'], "image_"), 0, scale['frames']-1, 4, "edf", out(files, "mean.edf"), False)
+	def averageImage(files):
+		from TIMEleSS.diffraction import averageImage
+		return averageImage.averageImage(os.path.join(files['edfdir'], "image_0000.edf"), os.path.join(files['edfdir'], "image_0001.edf"), out(files, "average.edf"))
+
+	return [
+		['parse', 'parse_GrainSpotter_log', parseLog],
+		['parse', 'parse_gff', parseGFF],
+		['parse', 'parse_ubi', parseUBI],
+		['parse', 'parseFLT', parseFLT],
+		['parse', 'parseFLTTable', parseFLTTable],
+		['parse', 'parseGVE', parseGVE],
+		['parse', 'parseGVETable', parseGVETable],
+		['parse', 'indexedPeaksTable', indexedPeaks],
+		['merge', 'removeDoubleGrains', removeDoubleGrains],
+		['merge', 'grainComparison', compareGrains],
+		['merge', 'grainSpotterMerge', mergeGrains],
+		['orientation', 'testGSEulerAngles', checkEulerAngles],
+		['clear', 'cropFLT', cropFLT],
+		['clear', 'cropGVE', cropGVE],
+		['clear', 'fltGrains', fltGrains],
+		['clear', 'fltGrainsStream', fltGrainsStream],
+		['clear', 'removeUsedGVE', removeUsedGVE],
+		['statistics', 'GSIndexingStatistics', indexingStatistics],
+		['statistics', 'grainPlotData', plotData],
+		['cif', 'peaksFromCIF', peaksFromCIF],
+		['images', 'createMask', createMask],
+		['images', 'inpaint', inpaint],
+		['images', 'meanFileSeries', meanFileSeries],
+		['images', 'averageImage', averageImage],
+	]
+
+"""
+Runs a benchmark case
+
+Parameters:
+- function: function to run
+- files: input files
+- repeat: number of timed runs
+- memory: if True, an extra run is done to measure memory with tracemalloc
+
+Returns a dictionnary with wall and cpu times for each run, and peak memory in Mb
+"""
+def runCase(function, files, repeat, memory):
+	result = {'wall': [], 'cpu': [], 'status': 'ok'}
+	output = io.StringIO()
+	try:
+		with contextlib.redirect_stdout(output):
+			for i in range(0, repeat):
+				wall = time.perf_counter()
+				cpu = time.process_time()
+				function(files)
+				result['cpu'].append(time.process_time()-cpu)
+				result['wall'].append(time.perf_counter()-wall)
+			if (memory):
+				tracemalloc.start()
+				function(files)
+				result['peak_memory_mb'] = tracemalloc.get_traced_memory()[1]/1048576.
+				tracemalloc.stop()
+	except (Exception, SystemExit):
+		if tracemalloc.is_tracing():
+			tracemalloc.stop()
+		result['status'] = 'failed'
+		result['error'] = traceback.format_exc().strip().splitlines()[-1]
+	if (len(result['wall']) > 0):
+		result['median'] = float(numpy.median(result['wall']))
+		result['min'] = float(numpy.min(result['wall']))
+	return result
+
+
+#################################################################
+#
+# Main subroutines
+#
+#################################################################
+
+class MyParser(argparse.ArgumentParser):
+	"""
+	Extend the regular argument parser to show the full help in case of error
+	"""
+	def error(self, message):
+
+		sys.stderr.write('\nError : %s\n\n' % message)
+		self.print_help()
+		sys.exit(2)
+
+
+def main(argv):
+	"""
+	Main subroutine
+	"""
+
+	parser = MyParser(usage='%(prog)s [options]', description="End-to-end benchmarks for the TIMEleSS tools, on synthetic datasets\nThis is part of the TIMEleSS project\nhttp://timeless.texture.rocks\n")
+
+	parser.add_argument('-s', '--scale', required=False, choices=list(scales.keys()), help="Size of the synthetic datasets. Default is %(default)s", default='small')
+	parser.add_argument('--grains', type=int, required=False, help="Number of grains (overrides scale)", default=None)
+	parser.add_argument('--peaks', type=int, required=False, help="Number of indexed peaks per grain (overrides scale)", default=None)
+	parser.add_argument('--extra', type=int, required=False, help="Number of unassigned peaks (overrides scale)", default=None)
+	parser.add_argument('--frames', type=int, required=False, help="Number of images (overrides scale)", default=None)
+	parser.add_argument('--pixels', type=int, required=False, help="Size of images, in pixels (overrides scale)", default=None)
+	parser.add_argument('-n', '--repeat', type=int, required=False, help="Number of timed runs for each case. Default is %(default)s", default=3)
+	parser.add_argument('--no-memory', dest='memory', action='store_false', help="Do not measure memory (saves one run per case)")
+	parser.add_argument('--only', required=False, help="Only run cases with this string in their group or name", default=None)
+	parser.add_argument('-o', '--output', required=False, help="Save results in this JSON file", default=None)
+	parser.add_argument('-c', '--compare', required=False, help="Compare with results saved in this JSON file", default=None)
+	parser.add_argument('-k', '--keep', required=False, help="Generate files in this directory and keep them, instead of a temporary directory", default=None)
+
+	args = vars(parser.parse_args(argv))
+
+	scale = dict(scales[args['scale']])
+	for key in scale:
+		if (args[key] is not None):
+			scale[key] = args[key]
+
+	if (args['keep'] is None):
+		directory = tempfile.mkdtemp(prefix="timeless-benchmark-")
+	else:
+		directory = args['keep']
+		if (not os.path.isdir(directory)):
+			os.makedirs(directory)
+
+	reference = {}
+	if (args['compare'] is not None):
+		for result in json.load(open(args['compare']))['results']:
+			reference[result['case']] = result
+
+	try:
+		print ("Generating synthetic files in %s" % directory)
+		start = time.perf_counter()
+		files = createFiles(directory, scale)
+		print ("Done in %.1f s\n" % (time.perf_counter()-start))
+
+		results = []
+		print ("%-12s %-25s %10s %10s %10s  %s" % ("Group", "Case", "Median (s)", "Min (s)", "Mem (Mb)", "Compared to reference"))
+		for [group, name, function] in benchmarkCases(scale):
+			if ((args['only'] is not None) and (args['only'] not in group) and (args['only'] not in name)):
+				continue
+			result = runCase(function, files, args['repeat'], args['memory'])
+			result['case'] = name
+			result['group'] = group
+			results.append(result)
+			if (result['status'] != 'ok'):
+				print ("%-12s %-25s failed: %s" % (group, name, result['error']))
+				continue
+			comparison = ""
+			if ((name in reference) and ('median' in reference[name])):
+				comparison = "%.2fx" % (result['median']/reference[name]['median'])
+			memory = "%10.1f" % result['peak_memory_mb'] if ('peak_memory_mb' in result) else "%10s" % "-"
+			print ("%-12s %-25s %10.4f %10.4f %s  %s" % (group, name, result['median'], result['min'], memory, comparison))
+	finally:
+		if (args['keep'] is None):
+			shutil.rmtree(directory)
+
+	if (args['output'] is not None):
+		metadata = {
+			'version': TIMEleSS.__version__,
+			'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+			'python': platform.python_version(),
+			'numpy': numpy.__version__,
+			'machine': platform.machine(),
+			'node': platform.node(),
+			'scale': scale,
+			'repeat': args['repeat'],
+		}
+		f = open(args['output'], 'w')
+		json.dump({'metadata': metadata, 'results': results}, f, indent=1)
+		f.close()
+		print ("\nResults saved in %s" % args['output'])
+
+
+# Calling method 2 (if run from the command line)
+if __name__ == "__main__":
+	main(sys.argv[1:])
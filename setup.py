@@ -67,6 +67,7 @@ setup(
 	
 	entry_points = {
 		'console_scripts': [
+			'timeless = TIMEleSS.timeless:run',
 			'timelessTest = TIMEleSS.simulation.test:test',
 			'timelessGrainComparison = TIMEleSS.simulation.grainComparison:run',
 			'timelessGrainPeaksComparison = TIMEleSS.simulation.grainPeaksComparison:run',
@@ -96,6 +97,7 @@ setup(
 			'timelessTthHistogram2Maud = TIMEleSS.evaluation.tthHistogram2Maud:run',
 			'timelessExtractGrainSizes = TIMEleSS.evaluation.extractGrainSizes:run',
 			'timelessRelToAbsGrainSize = TIMEleSS.evaluation.relToAbsGrainSize:run',
+			'timelessGrainDatabase = TIMEleSS.evaluation.grainDatabase:run',
         ],
 		'gui_scripts': [
 		    'timelessPlotIndexedGrain = TIMEleSS.evaluation.testGrainsPeaksGui:run',